@@ -4,15 +4,35 @@
 
 import logging
 import time
+import struct
+import bisect
 
 from general_utility import *
 import link
+import timer
+
+# The DNP header, see DNP.header_size
+DNP_header_format = struct.Struct("!7L")
+
+# Just the destination, the first field of the header
+DNP_dest_format = struct.Struct("!L")
+
+# Largest packet id, ids wrap back to 0 after it
+# Ids must not come around again while fragments of an older packet may still be buffered, or the two get mixed
+# The id field was always 32 bits and relays pass ids through unchanged, so older nodes that wrap at 125 read these ids as they are
+packet_id_max = 0xffffffff
+
+# Largest message reassembled from fragments, the same limit as an IP packet
+# The total size comes from the header, so a larger one is dropped before its buffer is made
+message_size_max = 0xffff
 
 class DNP:
 
 	# Configures DNP protocol
 	# buffer_timeout defines how long a fragmented message will be kept without an update before being dropped
-	def __init__(self, node_id, send_list, buffer_timeout = .5, upper_layer = None):
+	# checksum_name selects the link layer integrity algorithm, see checksum.py
+	# timers is the node's shared timer.Timers, DNP makes its own if none is sent
+	def __init__(self, node_id, send_list, buffer_timeout = .5, upper_layer = None, checksum_name = None, timers = None):
 
 		self.node_id = node_id
 
@@ -34,8 +54,24 @@ class DNP:
 		# Holds fragmented messages
 		self.message_buffer = {}
 
+		# Deadlines for this node, also used by the layers above through this class
+		if timers is None:
+
+			timers = timer.Timers()
+
+		self.timers = timers
+
 		# The link layer that will handle lower level communication
-		self.lower_layer = link.Link(self)
+		self.lower_layer = link.Link(self, checksum_name = checksum_name)
+
+		# If packets for other nodes can be forwarded without repacking them
+		self.fast_forward = True
+
+		# Counts packets forwarded for other nodes
+		# forwarded_count : sent on with only the TTL and checksum changed
+		# repacked_count : too big for the next link, fragmented again
+		self.forwarded_count = 0
+		self.repacked_count = 0
 
 	# Sets the routing info to be used for forwarding packets
 	# WARNING needs to be called before using DNP
@@ -51,38 +87,67 @@ class DNP:
 		fragments = self.pack(message, destination_id, destination_port, source_port, TTL, source_id=source_id, pkt_id = pkt_id, offset_start= offset_start, total_size=total_size, link_only=link_only)
 
 		# Get the send info from the routing table, fails if desintation not reachable
-		send_info = self.routing_layer.get_next_hop_sock(destination_id, link_only=link_only)
+		send_info = self.routing_layer.get_next_hop_sock(destination_id, link_only=link_only, flow=self.flow(source_id, destination_port, source_port))
 
 		# Place each fragment into the send buffer
 		for item in fragments:
 
 			self.send_list.append((item, send_info))
 
-	# Removes stale fragments
+	# The flow a packet belongs to, routing keeps each flow on one path when there are several
+	# A source_id of None is this node
+	def flow(self, source_id, destination_port, source_port):
+
+		if source_id is None:
+
+			source_id = self.node_id
+
+		return (int(source_id), int(destination_port), int(source_port))
+
+	# Runs any expired timers, this is where stale fragments are removed
+	# The node runs the shared timers itself, so this only matters when DNP is used alone
 	def cleanup(self):
 
-		# Go through the ledger
-		for pkt_name in self.message_buffer.keys():
+		self.timers.run()
 
-			# Get the timestamp
-			time_stamp = self.message_buffer[pkt_name]["last_timestamp"]
+	# Removes a fragmented message if it has not been updated within buffer_timeout
+	# Called by the timers, checks again later if a fragment came in since this was scheduled
+	def expire_fragments(self, pkt_name):
 
-			# If it is too long ago, remove this entry
-			if time.time() - time_stamp > self.buffer_timeout:
+		# Already completed
+		try:
 
-				logging.debug("Dumped: " + str(pkt_name))
+			packet_buffer = self.message_buffer[pkt_name]
+
+		except KeyError:
+
+			return None
+
+		# Time left before this entry is stale
+		remaining = packet_buffer.last_timestamp + self.buffer_timeout - time.time()
+
+		if remaining > 0:
+
+			packet_buffer.timer = self.timers.schedule(remaining, self.expire_fragments, pkt_name)
+
+		else:
+
+			logging.debug("Dumped: " + str(pkt_name))
+
+			del self.message_buffer[pkt_name]
 
-				del self.message_buffer[pkt_name]
 	# Creates a best effort service packet
-	# Returns a list of strings with the packet header and content
+	# Returns a list of bytearrays with the packet header and content
 	# Each item in the list is a fragment of the packet, commonly there will only be one
 	def pack(self, message, destination_id, destination_port, source_port, TTL = None, source_id=None, pkt_id = None, offset_start = 0, total_size = None, link_only=False):
 
 		# Holds all of the fragments to send
 		message_fragments = []
 
-		# Encode the message as a standard format to ensure bytes are properly counted
-		message = message.encode("utf8")
+		# Messages are sent as raw bytes, only text needs to be encoded to ensure bytes are properly counted
+		if isinstance(message, unicode):
+
+			message = message.encode("utf8")
 
 		# Save the total size of the message if override is not set
 		if total_size is None:
@@ -91,7 +156,7 @@ class DNP:
 			tot_size = total_size
 
 		# Get the mtu for the destination
-		link_mtu = self.routing_layer.get_next_hop_info(destination_id, link_only=link_only)[1]
+		link_mtu = self.routing_layer.get_next_hop_info(destination_id, link_only=link_only, flow=self.flow(source_id, destination_port, source_port))[1]
 
 		# Max size of a message body is based off of the link_mtu
 		max_size = link_mtu - self.header_total()
@@ -99,51 +164,21 @@ class DNP:
 		logging.debug("Message sending to: " + str(destination_id))
 
 		# If the message (and header) is larger than the mtu, it will need to be fragmented
-		# Fragmentation will continue as long as needed
-		message_remaining = message # Holds remaining message chunks
-		offset_counter = offset_start # Tracks the byte offset
-		first = True # First packet fragment to be sent
-		while len(message_remaining) > max_size:
+		# The message is walked by offset, each chunk is a view so the only copy is into the fragment
+		message_view = memoryview(message)
+		message_size = len(message)
+		chunk_start = 0
+		while chunk_start < message_size:
 
-			# Take a chunk of the message off and make a packet out of it
-			message_chunk = message_remaining[:max_size]
+			chunk_end = min(chunk_start + max_size, message_size)
 
 			# Pack and add to the message list, will fail if TTL expires
-			try:
-
-				to_send = self.single_pack(message_chunk, destination_id, destination_port, source_port, TTL = TTL, source_id=source_id, pkt_id=pkt_id, offset = offset_counter, total_size = tot_size)
-
-			# TTL has expired, don't deal with it here for now
-			except RuntimeError:
+			# TODO: configure this to pass the error along if desired
+			to_send = self.single_pack(message_view[chunk_start:chunk_end], destination_id, destination_port, source_port, TTL = TTL, source_id=source_id, pkt_id=pkt_id, offset = offset_start + chunk_start, total_size = tot_size)
 
-				# TODO: configure this to pass the error along if desired
-				raise
+			message_fragments.append(to_send)
 
-			else:
-
-				message_fragments.append(to_send)
-
-				# Remove the packed message
-				message_remaining = message_remaining[max_size:]
-
-			# Set the byte offset by incrementing by the size of this fragment
-			offset_counter += len(message_chunk)
-
-		# Get the remainder of the message
-		if len(message_remaining) > 0:
-
-			# TTL catch
-			try:
-
-				to_send = self.single_pack(message_remaining, destination_id, destination_port, source_port, TTL = TTL, source_id=source_id, pkt_id=pkt_id, offset = offset_counter, total_size = tot_size)
-
-			# TTL expired
-			except RuntimeError:
-
-				raise
-
-			else:
-				message_fragments.append(to_send)
+			chunk_start = chunk_end
 
 		# Incrment count
 		self.packet_counter += 1
@@ -151,6 +186,7 @@ class DNP:
 		return message_fragments
 
 	# Makes a single packet, size must be less than the mtu
+	# message can be a string or a memoryview of part of a larger message
 	def single_pack(self, message, destination_id, destination_port, source_port, TTL = None, source_id = None, pkt_id=None, offset = 0, total_size = None, increment = False):
 
 		# If source_id is None, use this node
@@ -169,7 +205,7 @@ class DNP:
 
 		# If pkt_id is not set, use the counter
 		if pkt_id is None:
-			if self.packet_counter > 125:
+			if self.packet_counter > packet_id_max:
 				self.packet_counter = 0
 			packet_id = self.packet_counter
 
@@ -177,14 +213,19 @@ class DNP:
 
 			packet_id = pkt_id
 
-		# Get the binary header for the DNP portion of the message
-		DNP_header = pack_string([int(destination_id), packet_id, offset, total_size, destination_port, send_to, source_port])
+		# Make the whole packet at once, the link layer fills in the front
+		link_size = self.lower_layer.header_size()
+		body_start = link_size + self.header_size()
+		whole_packet = bytearray(body_start + len(message))
+
+		# Write the binary header for the DNP portion of the message
+		DNP_header_format.pack_into(whole_packet, link_size, int(destination_id), packet_id, offset, total_size, destination_port, send_to, source_port)
 
-		# Concatinate with the body to make the DNP portion of the packet
-		DNP_partial_packet = DNP_header + message
+		# Copy the body in after the header
+		whole_packet[body_start:] = message
 
 		# Finish the packet by adding the link layer info
-		whole_packet = self.lower_layer.pack(DNP_partial_packet, TTL=TTL)
+		self.lower_layer.pack_into(whole_packet, TTL=TTL)
 
 		# Increment the overall packet counter to keep IDs unique, if requested
 		if increment:
@@ -204,28 +245,40 @@ class DNP:
 	# (dest_port, source_id, source_port, message)
 	def unpack(self, packet):
 
-		# Unpack the packet, might fail
+		# Too short to hold the headers, can't be checked or forwarded
+		if len(packet) < self.header_total():
+
+			logging.info("DROPPED: Packet too short: " + str(len(packet)))
+
+			return None
+
+		# Check the link layer, just ignore corrupted packets
 		try:
 
-			unpacked = self.single_unpack(packet)
+			TTL = self.lower_layer.verify(packet)
 
-		# Just ignore corrupted packets
 		except RuntimeError:
 
 			return None
 
-		# More readable form of the packet contents
-		(TTL, dest_id, pkt_id, offset, total_size, dest_port, source_id, source_port, message) = unpacked
+		# The DNP header starts after the link header
+		header_start = self.lower_layer.header_size()
+		body_start = header_start + self.header_size()
+
+		# Only the destination is needed to decide if this packet is for this node
+		dest_id = DNP_dest_format.unpack_from(packet, header_start)[0]
 
 		# If this packet is not destined for this node, forward it
 		if dest_id != self.node_id:
 
-			logging.info("Got packet for another destination: " + str(dest_id))
-
-			self.send(message, dest_id, dest_port, source_port, TTL = TTL, source_id=source_id, pkt_id=pkt_id, offset_start = offset, total_size = total_size)
+			self.forward(packet, dest_id, TTL)
 
 			return None
 
+		# More readable form of the packet contents
+		(dest_id, pkt_id, offset, total_size, dest_port, source_id, source_port) = DNP_header_format.unpack_from(packet, header_start)
+		message = str(buffer(packet, body_start))
+
 		# The common case is that the packet is not fragmented, immediately return
 		if len(message) == total_size:
 
@@ -235,7 +288,7 @@ class DNP:
 		else:
 
 			# Place into buffer
-			response = self.defragment(unpacked)
+			response = self.defragment((TTL, dest_id, pkt_id, offset, total_size, dest_port, source_id, source_port, message))
 
 			if response is not None:
 
@@ -245,35 +298,64 @@ class DNP:
 
 				return None
 
-	# Unpacks a single DNP packet
-	# Returns all header info for this layer and TTL from the lower layer
-	def single_unpack(self, packet):
+	# Sends a packet that is destined for another node on to the next hop
+	# Packets that fit the next link only get a new TTL and checksum, the rest of the packet is sent as is
+	# Packets that are too big are unpacked and fragmented again
+	def forward(self, packet, dest_id, TTL):
+
+		logging.info("Got packet for another destination: " + str(dest_id))
+
+		# The ports and source pick the path when there are several
+		header_start = self.lower_layer.header_size()
+		(dest_id, pkt_id, offset, total_size, dest_port, source_id, source_port) = DNP_header_format.unpack_from(packet, header_start)
+		flow = (source_id, dest_port, source_port)
+
+		# Get the next link, drop the packet if the destination can't be reached
+		try:
+
+			link_mtu = self.routing_layer.get_next_hop_info(dest_id, flow=flow)[1]
+			send_info = self.routing_layer.get_next_hop_sock(dest_id, flow=flow)
+
+		except KeyError:
+
+			logging.info("DROPPED: Destination not reachable: " + str(dest_id))
+
+			return None
+
+		# Fast path, change the packet in place
+		if self.fast_forward and len(packet) <= link_mtu:
+
+			if not isinstance(packet, bytearray):
+
+				packet = bytearray(packet)
+
+			# Decrements the TTL and makes the new checksum, fails if the TTL expired
+			try:
+
+				self.lower_layer.pack_into(packet, TTL)
+
+			except RuntimeError:
+
+				return None
+
+			self.send_list.append((packet, send_info))
 
-		# Dummy to keep intenting happy while try is commented out
-		if True:
-		# Get the link info
-		# Will fail if packet is corrupted
-		#try:
+			self.forwarded_count += 1
 
-			TTL, DNP_packet = self.lower_layer.unpack(packet)
+		# Slow path, unpack and send again
+		else:
 
-		# Currently, do nothing about corrupt packets
-		#except RuntimeError as r_error:
+			message = str(buffer(packet, header_start + self.header_size()))
 
-			#raise
+			try:
 
-		# Get the DNP info
-		#else:
+				self.send(message, dest_id, dest_port, source_port, TTL = TTL, source_id=source_id, pkt_id=pkt_id, offset_start = offset, total_size = total_size)
 
-			# Separate the header from the body
-			header = DNP_packet[:self.header_size()]
-			body = DNP_packet[self.header_size():]
+			except (KeyError, RuntimeError):
 
-			# Get the header info
-			DNP_header_info = unpack_string(header)
+				return None
 
-			# Return all info and the body
-			return TTL + DNP_header_info + (body,)
+			self.repacked_count += 1
 
 	# Reassembles packet fragments
 	# returns None if packet is not complete
@@ -294,61 +376,31 @@ class DNP:
 		# This is a new packet
 		except KeyError:
 
-			# Add to the buffer
-			packet_buffer = self.ledger_entry(packet)
-
-		# Update the buffer with the new packet chunk
-		self.ledger_update(packet_buffer, message, offset)
-
-		# Attempt to combine the packet
-		fused = self.ledger_combine(packet_buffer)
+			# Nothing sends messages this large, the header is corrupt or hostile
+			if total_size > message_size_max:
 
-		# If fused contains data, the entry can be removed from the ledger
-		if fused is not None:
+				logging.info("DROPPED: Message too large to reassemble: " + str(total_size))
 
-			del self.message_buffer[packet_key]
+				return None
 
-		# Return the combined packet, will be None if not all fragments are present
-		return fused
+			# Add to the buffer
+			packet_buffer = self.ledger_entry(packet)
 
-	# Attempts to combine the given packet buffer
-	# Returns None if not all fragments are present
-	# Returns all data if all fragments are present
-	def ledger_combine(self, packet_buffer):
+		# Update the buffer with the new packet chunk, duplicates are ignored
+		# If all fragments are present, the entry can be removed from the ledger
+		if packet_buffer.add(offset, message):
 
-		# Combine all data
-		combined_data = "".join(packet_buffer["data_buffer"])
+			del self.message_buffer[packet_key]
 
-		# Packet is complete if size of data is equal to the total_size
-		if len(combined_data) == packet_buffer["total_size"]:
+			self.timers.cancel(packet_buffer.timer)
 
-			# Send back all data
-			return combined_data
+			return packet_buffer.contents()
 
-		# Not complete
+		# Not all fragments are present
 		else:
 
 			return None
 
-	# Updates the given ledger entry with the sent data and offset
-	def ledger_update(self, packet_buffer, data, offset):
-
-		# TODO: fix duplicates and non aligned repeats?
-		# This might not even be an issue
-
-		# Set the new time stamp
-		packet_buffer["last_timestamp"] = time.time()
-
-		# Add the offset
-		packet_buffer["byte_offsets"].append(offset)
-
-		# Sort and get the position of the new entry in order to know where the data needs to go
-		packet_buffer["byte_offsets"].sort()
-		chunk_index = packet_buffer["byte_offsets"].index(offset)
-
-		# Insert the data into the correct location
-		packet_buffer["data_buffer"].insert(chunk_index, data)
-
 	# Creates an entry in the buffer ledger
 	def ledger_entry(self, packet):
 
@@ -359,7 +411,10 @@ class DNP:
 		packet_key = self.buffer_key(dest_port, source_id, source_port, pkt_id)
 
 		# Create the entry
-		self.message_buffer[packet_key] = {"last_timestamp" : time.time(), "total_size" : total_size, "data_buffer" : [], "byte_offsets" : []}
+		self.message_buffer[packet_key] = ReassemblyBuffer(total_size)
+
+		# Drop the entry if the rest of the fragments don't show up in time
+		self.message_buffer[packet_key].timer = self.timers.schedule(self.buffer_timeout, self.expire_fragments, packet_key)
 
 		# Return for ease
 		return self.message_buffer[packet_key]
@@ -381,7 +436,95 @@ class DNP:
 	# The total size of the header including the lower layer header
 	# Expected size
 	# Link layer	| DNP layer
-	# 20		| 28
+	# 8 - 20	| 28
 	def header_total(self):
 
 		return self.lower_layer.header_total() + self.header_size()
+
+# Holds the fragments of one message while it is being reassembled
+# The message is written straight into place, received byte ranges are tracked as sorted intervals
+class ReassemblyBuffer:
+
+	def __init__(self, total_size):
+
+		self.total_size = total_size
+
+		# The whole message, filled in as fragments arrive
+		self.data = bytearray(total_size)
+
+		# Number of distinct bytes received, the message is complete when this reaches total_size
+		self.received = 0
+
+		# Received byte ranges [start, end), sorted and never touching each other
+		self.starts = []
+		self.ends = []
+
+		# Last time a fragment arrived, used to drop stale messages
+		self.last_timestamp = time.time()
+
+		# The handle of the timer that will drop this message
+		self.timer = None
+
+	# Adds a fragment at the sent byte offset
+	# Bytes that were already received are ignored, so duplicates and overlaps can't corrupt the message
+	# Returns True if the message is complete
+	def add(self, offset, data):
+
+		self.last_timestamp = time.time()
+
+		# Ignore anything that falls outside of the message
+		end = min(offset + len(data), self.total_size)
+		if offset >= end:
+
+			return self.complete()
+
+		data_view = memoryview(data)
+
+		# First range that touches or comes after this fragment
+		first = bisect.bisect_left(self.ends, offset)
+
+		# Go through every range this fragment touches, filling in the gaps between them
+		merged_start = offset
+		merged_end = end
+		position = offset
+		last = first
+		while last < len(self.starts) and self.starts[last] <= end:
+
+			# New bytes before this range
+			if self.starts[last] > position:
+
+				self.write(position, self.starts[last], data_view, offset)
+
+			position = max(position, self.ends[last])
+			merged_start = min(merged_start, self.starts[last])
+			merged_end = max(merged_end, self.ends[last])
+
+			last += 1
+
+		# New bytes after the last range
+		if position < end:
+
+			self.write(position, end, data_view, offset)
+
+		# Replace all of the touched ranges with one
+		self.starts[first:last] = [merged_start]
+		self.ends[first:last] = [merged_end]
+
+		return self.complete()
+
+	# Copies the part of a fragment between start and end into place
+	def write(self, start, end, data_view, offset):
+
+		self.data[start:end] = data_view[start - offset:end - offset]
+
+		self.received += end - start
+
+	# True if every byte has been received
+	def complete(self):
+
+		return self.received == self.total_size
+
+	# Returns the whole message
+	def contents(self):
+
+		return str(self.data)
@@ -1,15 +1,133 @@
 # Reliable transport protocol
 # Sends messages that are checked for arrival
 # Header:
-# type | sequence number
+# version | type | flags | sequence number | total size | window
+#
+# Older nodes send a text header instead: type|sequence number|total size|
+# Either one is understood, replies use the same header the other side sent last
+#
+# AK block, the body of type 7 and the start of the body of any packet with flag_ak set:
+# first sequence number not received | number of ranges | ranges of received sequence numbers (start, end)
+# Older nodes get one type 6 AK per segment instead
 
 import logging
 import time
 import os
 import base64
 import re
+import struct
+import io
+import mmap
 
 from general_utility import *
+import congestion
+
+# Version of the binary header, sent as the first byte
+# Text headers always start with a digit, so the two can't be confused
+header_version = 2
+
+# The binary header, see RTP.header_size
+RTP_header_format = struct.Struct("!BBBLLH")
+
+# Largest window that fits in the header
+window_max = 0xffff
+
+# Largest text header older nodes send: 2 digit type, 10 digit sequence number and total size, 3 delimiters
+legacy_header_max = 2 + 10 + 10 + 3
+
+# Amount of content in each segment sent by older nodes
+legacy_chunk_size = 1000
+
+# Largest segment including the RTP header when the path MTU is not known
+fallback_segment_max = 1000
+
+# Limits on the retransmit timeout in seconds
+# The upper limit caps the exponential backoff
+rto_min = .1
+rto_max = 3
+
+# Gains for the smoothed round trip time and its variance, Jacobson/Karels
+rtt_alpha = 1 / 8.0
+rtt_beta = 1 / 4.0
+
+# The connection is broken if nothing comes for this many retransmit timeouts
+# Never less than two full backoffs, so a sender that is backing off is not mistaken for a dead one
+broken_factor = 10
+broken_min = 2 * rto_max
+
+# Closing waits this many retransmit timeouts, never less than one full backoff
+close_factor = 6
+close_min = rto_max
+
+# A segment is taken as lost once this many segments sent after it are AKed
+dup_threshold = 3
+
+# Set in the flags when the body starts with an AK block
+flag_ak = 0x01
+
+# Set in the flags of a segment that fills the sender's window, the receiver AKs it without waiting for more
+flag_ak_now = 0x02
+
+# AK block fields, see the top of the file
+ak_block_format = struct.Struct("!LB")
+sack_range_format = struct.Struct("!LL")
+
+# Most ranges sent in one AK block
+max_sack_ranges = 16
+
+# Largest AK block
+ak_block_max = ak_block_format.size + max_sack_ranges * sack_range_format.size
+
+# Room left in each segment for AKs going the other way, enough for a block with this many ranges
+# Larger blocks are sent on their own
+ak_room_ranges = 2
+ak_room = ak_block_format.size + ak_room_ranges * sack_range_format.size
+
+# Seconds an AK waits for more segments to AK along with it
+ak_delay = .02
+
+# Packs an AK block
+# ranges is a list of (start, end), end not included
+def pack_ak_block(cumulative, ranges):
+
+	return ak_block_format.pack(cumulative, len(ranges)) + "".join([sack_range_format.pack(start, end) for (start, end) in ranges])
+
+# Splits an AK block from the front of a body
+# Returns (cumulative, ranges, rest of the body)
+def unpack_ak_block(body):
+
+	(cumulative, range_count) = ak_block_format.unpack_from(body)
+
+	ranges = []
+	offset = ak_block_format.size
+	for range_index in range(range_count):
+
+		ranges.append(sack_range_format.unpack_from(body, offset))
+
+		offset += sack_range_format.size
+
+	return (cumulative, ranges, body[offset:])
+
+# Splits a message into the header fields and the body
+# Returns (legacy, pkt_type, flags, sequence_num, total_size, window, body)
+# legacy is True for the old text header, which has no flags or window
+def unpack_header(message):
+
+	# Old text header
+	if message[:1].isdigit():
+
+		(pkt_type, sequence_num, total_size, body) = message.split("|", 3)
+
+		return (True, int(pkt_type), 0, int(sequence_num), int(total_size), None, body)
+
+	# Binary header
+	(version, pkt_type, flags, sequence_num, total_size, window) = RTP_header_format.unpack_from(message)
+
+	if version != header_version:
+
+		raise ValueError("RTP header version not known: " + str(version))
+
+	return (False, pkt_type, flags, sequence_num, total_size, window, message[RTP_header_format.size:])
 
 # Gets the window from the packet, used for peeking
 def get_window(packet):
@@ -17,33 +135,45 @@ def get_window(packet):
 	# Get the readable form of the packet
 	(dest_port, source_id, source_port, message) = packet
 
-	# Get the pkt type and sequence num
-	pkt_type, sequence_num, total_size, body = [int(x) for x in message.split('|')]
+	(legacy, pkt_type, flags, sequence_num, total_size, window, body) = unpack_header(message)
+
+	# Old nodes send the window as the body
+	if legacy:
+
+		return int(body)
 
-	return int(body)
+	return window
+
+# Checks if the packet uses the old text header, used for peeking
+def is_legacy(packet):
+
+	return packet[3][:1].isdigit()
 
 # The size of the header generated by this layer
 # Expected size
-# type	| sequence number
-# 4	| 4
-# Total: 8
+# version	| type	| flags	| sequence number	| total size	| window
+# 1		| 1	| 1	| 4			| 4		| 2
+# Total: 13
 def gen_header_size():
 
-	return (field_size * 2)
+	return RTP_header_format.size
 
 # The total size of the header including the lower layer header
 # Expected size
 # DNP layer	| RTP layer
-# 48		| 8
+# 36 - 48	| 13
 def gen_header_total():
 
 	return self.DNP.header_total() + self.header_size()
 
 class RTP:
 
-	# timeout determines how long to wait for AKs of any kind
+	# timeout determines how long to wait for AKs of any kind, until the round trip time has been measured
 	# Set target port if this is accepting a request
-	def __init__(self, node_id, service_id, DNP, target_id, connected_to, target_port=None, listen_port=10, timeout=.5, window=5, default_max = 1000):
+	# default_max is the largest segment including the RTP header, None to fit segments to the path MTU
+	# legacy_header starts the connection with the old text header, needed to connect to older nodes
+	# congestion_name is the congestion controller used when sending, see congestion.controllers
+	def __init__(self, node_id, service_id, DNP, target_id, connected_to, target_port=None, listen_port=10, timeout=.5, window=5, default_max = None, legacy_header = False, congestion_name = None):
 
 		self.node_id = node_id
 
@@ -62,18 +192,44 @@ class RTP:
 		# This is used to send single packets
 		self.DNP = DNP
 
-		# This is the timeout for cleanup duties
+		# This is the timeout used until the round trip time is measured
 		self.timeout=timeout
 
-		# This is the timeout for closing the service
-		self.close_timeout = 6 * self.timeout
+		# Round trip time estimates, None until the first sample
+		self.srtt = None
+		self.rttvar = None
+
+		# The retransmit timeout, starts at timeout and follows the round trip time once measured
+		self.rto = self.timeout
+
+		# The last time the retransmit timeout was backed off
+		self.last_backoff = 0
+
+		# Time the first handshake message was sent, None if it had to be sent again
+		self.handshake_sent = None
+
+		# Resends handshake messages, None once the connection is active
+		self.handshake_timer = None
 
 		# This is the number of packets to allow in flight
-		self.window = window
+		self.window = min(window, window_max)
+
+		# Limits packets in flight further when the network can't take the whole window
+		# A new controller is made for every message sent
+		self.congestion_name = congestion_name
+		self.congestion = congestion.get_controller(congestion_name)
+
+		# Send the old text header, changes to match whatever the other side sends
+		self.legacy = legacy_header
 
 		# The is how big to make packets by default in bytes
 		self.default_max = default_max
 
+		# The smallest MTU on the path to the target, None until it is known
+		# Looked up again whenever the routing table version changes
+		self.path_mtu = None
+		self.path_version = None
+
 		# If the connection is active
 		self.connected = False
 
@@ -94,6 +250,33 @@ class RTP:
 		self.accept_max = 6
 		self.finalize_max = 6
 
+		# Deadlines are shared with the rest of the node through DNP
+		self.timers = self.DNP.timers
+
+		# Checks for a broken connection, None when nothing is being watched
+		self.watch_timer = None
+
+		# Set by the watch timer when the other side stops responding
+		self.broken = False
+
+		# The source of the message being sent, None if not sending
+		# Segments are read from it as they are needed, into segment_buffer
+		self.source = None
+		self.segment_buffer = None
+
+		# Retransmit timers for segments waiting on AKs
+		# Sequence number : timer handle
+		self.segment_timers = {}
+
+		# Sends gathered AKs when it runs out, None if no AKs are waiting
+		self.ak_timer = None
+
+		# The file being downloaded into, None if not receiving
+		# Segments are written through receive_map, the name is the temporary name until it is done
+		self.receive_file = None
+		self.receive_map = None
+		self.receive_name = None
+
 		self.reset_trackers()
 
 		self.last_clean = 0
@@ -124,7 +307,14 @@ class RTP:
 		# Get the readable form of the packet
 		(dest_port, source_id, source_port, message) = packet
 
-		(pkt_type, sequence_num, total_size, body) = self.separate(message)
+		(pkt_type, flags, sequence_num, total_size, body) = self.separate(message)
+
+		# AKs can ride along with other packets
+		if flags & flag_ak:
+
+			(cumulative, ranges, body) = unpack_ak_block(body)
+
+			self.sacked(cumulative, ranges)
 
 		# Execution depends on connection state and packet type
 
@@ -133,7 +323,7 @@ class RTP:
 		if pkt_type == 1:
 
 			# Window size
-			self.window = int(message)
+			self.window = min(get_window(packet), window_max)
 
 			# Set the target based on the sender service id
 			self.target_port = source_port
@@ -149,8 +339,10 @@ class RTP:
 			# Set the target based on the sender service id
 			self.target_port = source_port
 
-			# Time since last finalize
-			self.last_finalize = time.time()
+			# Round trip of the request, only if it was sent once
+			if self.stage == 1 and self.handshake_sent is not None:
+
+				self.rtt_sample(time.time() - self.handshake_sent)
 
 			self.finalize()
 
@@ -161,12 +353,13 @@ class RTP:
 		elif pkt_type == 3:
 
 			if self.stage < 4:
-				self.stage = 4
 
-				logging.warning("Established connection to: " + str(self.target_id))
+				# Round trip of the accept, only if it was sent once
+				if self.handshake_sent is not None:
+
+					self.rtt_sample(time.time() - self.handshake_sent)
 
-				# Add to the connected list
-				self.connected_to.append((self.service_id, self.target_id, self.target_port))
+				self.activate("Established connection to: ")
 
 		# Content message
 		elif pkt_type == 5:
@@ -175,46 +368,59 @@ class RTP:
 			packet_info = (sequence_num, total_size, body)
 
 			# Get the content
-			self.unpack_content(packet_info)
+			self.unpack_content(packet_info, ak_now=flags & flag_ak_now)
 
 		# AK
 		elif pkt_type == 6:
 
 			self.aked(sequence_num)
 
+		# Cumulative and selective AK
+		elif pkt_type == 7:
+
+			(cumulative, ranges, body) = unpack_ak_block(body)
+
+			self.sacked(cumulative, ranges)
+
 		# File request
 		elif pkt_type == 10:
 
 			# Get the name of the requested file
 			file_name = body
 
-			# Try to open the file
-			try:
+			# Connection may already be in use
+			# The request is repeated if the yes response was lost
+			if self.sending():
 
-				with open(os.path.join(content_folder, str(self.node_id), file_name), 'rb') as the_file:
+				self.yes()
 
-					# Get all of the file contents
-					#self.file_contents = base64.b64encode(the_file.read())
-					self.file_contents = the_file.read().encode('base64')
-
-			# File doesn't exist
-			except IOError:
-
-				self.DNE()
-
-			# Send the yes response and start sending content
+			# Try to open the file, content is read as it is sent
 			else:
 
-				# Connection may already be in use
 				try:
 
-					self.send(self.file_contents)
+					the_file = io.open(os.path.join(content_folder, str(self.node_id), file_name), 'rb')
 
-				except RuntimeError:
+				# File doesn't exist
+				except IOError:
 
-					pass
+					self.DNE()
 
+				# Send the yes response and start sending content
 				else:
+
+					# Older nodes expect base64, which needs the whole file
+					if self.legacy:
+
+						with the_file:
+
+							the_file = io.BytesIO(base64.b64encode(the_file.read()))
+
+					the_file.seek(0, os.SEEK_END)
+					file_size = the_file.tell()
+
+					self.send_file(the_file, file_size)
+
 					self.yes()
 					self.window_send()
 
@@ -222,16 +428,30 @@ class RTP:
 		elif pkt_type == 11:
 
 			# Accepted
-			if body == 'yes':
+			if body[:3] == 'yes':
+
+				# Round trip of the file request, only if it was sent once
+				if self.requested and self.handshake_sent is not None:
+
+					self.rtt_sample(time.time() - self.handshake_sent)
 
 				# Unset flag, content is incoming
 				self.requested = False
 
+				# The size of each segment follows, older nodes always use the same size
+				if len(body) > 3:
+
+					self.receive_chunk = unpack_string(body[3:])[0]
+
+				else:
+
+					self.receive_chunk = legacy_chunk_size
+
 			# File doesn't exist
 			elif body == 'DNE':
 
 				# Abort content request
-				self.reset_trackers
+				self.reset_trackers()
 
 				logging.warning("Download failed, file does not exist")
 
@@ -241,72 +461,203 @@ class RTP:
 			logging.error("Packet type not known: " + str(pkt_type))
 
 	# Sends a message reliably
+	# chunk_size is the amount of the message in each segment
 	def send(self, message, chunk_size=None):
 
-		if chunk_size is None:
-			chunk_size = self.default_max
+		self.send_file(io.BytesIO(message), len(message), chunk_size)
+
+	# Sends the contents of a file reliably
+	# Segments are read from the file as they are sent, so only the window is ever held in memory
+	# The file is closed once everything is AKed
+	def send_file(self, source, source_size, chunk_size=None):
+
+		# Segments are sized to fit the path in one frame, with room for a small AK block
+		# Older nodes expect the size they use themselves
+		segment_max = self.segment_max()
+		if chunk_size is None and self.legacy:
+			chunk_size = legacy_chunk_size
+		elif chunk_size is None:
+			chunk_size = max(1, segment_max - self.header_size() - ak_room)
 
-		if len(self.all_queue.keys()) != 0:
+		if self.sending():
 
 			raise RuntimeError("Connection is busy")
 
 		# Reset the trackers, timing depends on it
 		self.reset_trackers()
 
-		# Save the total size of the message
-		message_total = len(message)
+		self.source = source
+		self.source_size = source_size
+		self.chunk_size = chunk_size
+
+		# Largest segment to send, an AK block only goes along if it fits
+		self.segment_limit = max(segment_max, self.header_size() + chunk_size)
+
+		# Every message starts from a small congestion window
+		self.congestion = congestion.get_controller(self.congestion_name)
 
-		start = 0
-		offset = chunk_size
-		message_parts = []
-		while offset < message_total:
+		# Sequence numbers of the first and last segments, an empty message still sends one segment
+		self.first_seq = self.packet_counter
+		self.last_seq = self.first_seq + max(0, (source_size - 1) // chunk_size)
 
-			message_parts.append(message[start:offset])
+		# The next sequence number that has never been sent
+		self.next_seq = self.first_seq
 
-			start += chunk_size
-			offset += chunk_size
+		# Segments are built here, reused for every segment
+		# Leaves room for AKs going the other way
+		self.segment_buffer = bytearray(self.header_size() + ak_block_max + chunk_size)
 
-		if start < message_total:
+	# The largest segment to send, including the RTP header
+	# Fits in one frame on the path so segments are not fragmented
+	def segment_max(self):
+
+		self.probe_path()
+
+		# Path not known, fall back to a size that fits the larger links
+		if self.path_mtu is None:
+
+			largest = fallback_segment_max
+
+		else:
 
-			message_parts.append(message[start:])
+			largest = self.path_mtu - self.DNP.header_total()
 
-		# Add all of the messages to the queue
-		tot = 0
-		start_counter = self.packet_counter
-		for packet_id in range(start_counter, len(message_parts) + start_counter):
+		if self.default_max is not None:
 
-			tot += len(message_parts[packet_id - self.packet_counter])
+			largest = min(largest, self.default_max)
 
-			self.all_queue[packet_id] = self.make_header(5,packet_id, message_total) + message_parts[packet_id - self.packet_counter]
+		# Always leave room for some content
+		return max(largest, self.header_size() + 1)
 
-	# Sends the messages currently in the window
+	# Looks up the path MTU again if the routing table has changed since the last look
+	# A transfer keeps the segment size it started with, the receiver places segments by it
+	def probe_path(self):
+
+		route = self.DNP.routing_layer
+
+		if route is None or route.table_version == self.path_version:
+
+			return None
+
+		self.path_version = route.table_version
+
+		try:
+
+			path_mtu = route.get_path_mtu(self.target_id, flow=self.DNP.flow(None, self.target_port, self.service_id))
+
+		# Keep the last known value until the target can be reached again
+		except KeyError:
+
+			return None
+
+		if path_mtu != self.path_mtu:
+
+			logging.info("Path MTU to: " + str(self.target_id) + " is: " + str(path_mtu))
+
+			self.path_mtu = path_mtu
+
+	# True if a message is being sent and is not fully AKed
+	def sending(self):
+
+		return self.source is not None
+
+	# Sends new segments while there is room in the window and the congestion window
+	# Segments waiting on AKs are resent by their own timers, not here
 	def window_send(self):
 
 		# Ignore if there is nothing to send
-		if len(self.all_queue.keys()) != 0:
+		if self.sending():
+
+			in_flight_max = min(self.window, self.congestion.limit())
+
+			while len(self.ak_waiting) < in_flight_max and self.next_seq <= self.last_seq:
+
+				# Nothing more can be sent until this is AKed, and the receiver won't have enough segments to AK them without waiting
+				# Asking once per AK block is enough, the AK for the first ask frees the segments sent after it as well
+				ak_now = (len(self.ak_waiting) + 1 >= in_flight_max and in_flight_max < self.ak_every() and not self.ak_now_sent) or self.next_seq == self.last_seq
+
+				if ak_now:
+
+					self.ak_now_sent = True
+
+				self.send_segment(self.next_seq, ak_now=ak_now)
+
+				self.next_seq += 1
+
+	# Sends a segment and starts its retransmit timer
+	def send_segment(self, send_num, retransmit=False, ak_now=False):
+
+		sent_size = self.send_single(send_num, ak_now)
+
+		if retransmit:
+
+			self.bytes_retransmitted += sent_size
+
+			# AKs for it can't be timed, they may be for either copy
+			self.resent.add(send_num)
+
+		else:
+
+			self.bytes_original += sent_size
+
+		# It is now waiting on ak
+		self.ak_waiting[send_num] = time.time()
+		self.later_aks[send_num] = 0
+
+		# Replaces the timer if this is sent again before it ran out
+		self.timers.cancel(self.segment_timers.get(send_num))
+		self.segment_timers[send_num] = self.timers.schedule(self.rto, self.segment_timeout, send_num)
+
+	# Called by a segment's timer, the segment is sent again if it still has not been AKed
+	# With AK blocks only the oldest segment waiting is resent, one lost AK block would otherwise have every segment it covered sent again
+	# The receiver AKs it right away with everything it has, see sacked
+	def segment_timeout(self, send_num):
+
+		if send_num in self.ak_waiting:
+
+			if not self.legacy and send_num != min(self.ak_waiting):
+
+				self.segment_timers[send_num] = self.timers.schedule(self.rto, self.segment_timeout, send_num)
+
+				return None
+
+			# Segments sent before the last backoff already waited on the shorter timeout, don't back off again for them
+			if self.ak_waiting[send_num] >= self.last_backoff:
+
+				self.back_off()
+
+			self.congestion_loss(send_num, timeout=True)
 
-			# Get a window of messages
-			send_candidates = sorted(self.all_queue.keys())[:self.window]
+			self.send_segment(send_num, retransmit=True)
 
-			# Send any that are not waiting on AKs
-			for candidate in send_candidates:
+			self.probe_seq = send_num
 
-				# Check for freshness
-				#if candidate not in self.ak_waiting:
-				if True:
+	# Tells the congestion controller about a lost segment
+	# Only the first loss in a window counts, the rest were sent before the controller reacted
+	def congestion_loss(self, send_num, timeout):
 
-					# It is now waiting on ak
-					if candidate not in self.ak_waiting:
-						self.ak_waiting.append(candidate)
+		if send_num < self.recovery_seq:
 
-					# Send the content of this message
-					self.send_single(candidate)
+			return None
+
+		self.recovery_seq = self.next_seq
+
+		if timeout:
+
+			self.congestion.on_timeout()
+
+		else:
 
-	# Sends one message from the queue
-	def send_single(self, send_num):
+			self.congestion.on_duplicate()
 
-		# Get the message out of the queue
-		message = self.all_queue[send_num]
+		logging.info("Congestion window: " + str(self.congestion.cwnd) + " after loss of: " + str(send_num))
+
+	# Sends one segment, read from the source
+	# Returns the size of the content in the segment
+	def send_single(self, send_num, ak_now=False):
+
+		# Get the message out of the source
+		message = self.make_segment(send_num, ak_now)
 
 		# Send it
 		try:
@@ -316,42 +667,253 @@ class RTP:
 
 			pass
 
-	# Buffers content
-	def unpack_content(self, packet):
+		return self.segment_size(send_num)
+
+	# The amount of content in a segment
+	def segment_size(self, send_num):
+
+		return min(self.chunk_size, self.source_size - (send_num - self.first_seq) * self.chunk_size)
+
+	# Reads a segment from the source into the segment buffer
+	# Returns a view of the buffer, only valid until the next segment is made
+	# ak_now asks the receiver to AK it right away
+	def make_segment(self, send_num, ak_now=False):
+
+		# Where this segment is in the source
+		offset = (send_num - self.first_seq) * self.chunk_size
+		length = self.segment_size(send_num)
+
+		flags = flag_ak_now if ak_now else 0
+
+		header = self.make_header(5, send_num, self.source_size, flags)
+
+		# AKs owed for content coming the other way go along with it, if they fit
+		# Otherwise they are still owed and go on their own
+		if self.aks_owed > 0 and not self.legacy:
+
+			ak_block = self.make_ak_block()
+
+			if len(header) + len(ak_block) + length <= self.segment_limit:
+
+				header = self.make_header(5, send_num, self.source_size, flags | flag_ak) + ak_block
+
+				self.aks_sent()
+
+		body_start = len(header)
+
+		segment_view = memoryview(self.segment_buffer)
+		segment_view[:body_start] = header
+
+		self.source.seek(offset)
+		self.source.readinto(segment_view[body_start:body_start + length])
+
+		return segment_view[:body_start + length]
+
+	# Stops sending and closes the source
+	def end_send(self):
+
+		if self.source is not None:
+
+			self.source.close()
+
+		self.source = None
+		self.segment_buffer = None
+
+		# Nothing is left to resend
+		for handle in self.segment_timers.values():
+
+			self.timers.cancel(handle)
+
+		self.segment_timers = {}
+
+	# Writes content straight to the file being downloaded
+	# ak_now is set when the sender can't send more until this is AKed
+	def unpack_content(self, packet, ak_now=False):
+
+		(sequence_num, total_size, body) = packet
 
 		if not self.done:
 			self.last_content = time.time()
+			self.watch()
+
+			# The segment size comes with the yes response, content can't be placed until then
+			# The sender will send it again
+			if self.receive_chunk is None:
 
-			(sequence_num, total_size, body) = packet
+				return None
 
-			# New stream, set the total size
-			if self.total_size is None:
+			# New stream, make the file
+			if self.receive_file is None:
 
-				self.total_size = total_size
+				self.start_receive(total_size)
+
+			# Where this segment goes
+			index = sequence_num - self.packet_counter
+			offset = index * self.receive_chunk
+
+			# Ignore anything that does not fit the file
+			if not (0 <= index < self.receive_total) or len(body) != min(self.receive_chunk, self.total_size - offset):
+
+				logging.info("Segment does not fit the download: " + str(sequence_num))
+
+				return None
 
 			# New content
-			if sequence_num not in self.content_ids:
+			if not self.has_index(index):
+
+				# A segment that opens a new gap or fills one is AKed now, so the sender finds losses and repairs sooner
+				# Segments that only extend the highest one wait for the delayed AK, even behind a gap, the sender already knows about it
+				changes_gap = index > self.highest_index + 1 or index < self.highest_index
+
+				self.received[index // 8] |= 1 << (index % 8)
+				self.received_count += 1
+
+				# Move past everything that is in
+				self.highest_index = max(self.highest_index, index)
+				while self.cumulative_index < self.receive_total and self.has_index(self.cumulative_index):
+
+					self.cumulative_index += 1
+
+				# Write it in place
+				if len(body) > 0:
+
+					self.receive_map[offset:offset + len(body)] = body
 
-				# Add to the ledger
-				self.content_ids.append(sequence_num)
-				self.content_ids.sort()
+				# Every segment is in
+				if self.received_count == self.receive_total:
 
-				# Get the location to add
-				index = self.content_ids.index(sequence_num)
+					# AK the packet now, nothing more will come
+					self.ak(sequence_num, now=True)
 
-				# Add the content to the buffer
-				self.content_buffer.insert(index, body)
+					self.save_content()
+
+					return None
+
+				self.ak(sequence_num, now=ak_now or changes_gap)
+
+				return None
+
+		# A repeat, the AK for it was lost
+		self.ak(sequence_num, now=True)
+
+	# Checks if the segment at index has been received
+	def has_index(self, index):
+
+		return self.received[index // 8] & (1 << (index % 8))
+
+	# Makes the file a download is written to
+	# The file is a hidden temporary in the content folder until the download completes
+	def start_receive(self, total_size):
+
+		self.total_size = total_size
+
+		# Number of segments, an empty file still has one
+		self.receive_total = max(1, (total_size + self.receive_chunk - 1) // self.receive_chunk)
+
+		# One bit per segment, set once it has been written
+		self.received = bytearray((self.receive_total + 7) // 8)
+		self.received_count = 0
+
+		# The first index not received and the highest index received, for AK blocks
+		self.cumulative_index = 0
+		self.highest_index = -1
+
+		# Make the file and set it to the full size, segments are written into it through the map
+		self.receive_name = os.path.join(content_folder, str(self.node_id), "." + self.file_name + "." + str(self.service_id) + ".part")
+		self.receive_file = open(self.receive_name, "w+b")
+		self.receive_file.truncate(total_size)
+
+		# Empty files can't be mapped
+		if total_size > 0:
+
+			self.receive_map = mmap.mmap(self.receive_file.fileno(), total_size)
+
+	# Stops receiving, the partial file is removed unless keep is True
+	def end_receive(self, keep=False):
+
+		if self.receive_map is not None:
+
+			self.receive_map.close()
+
+		if self.receive_file is not None:
+
+			self.receive_file.close()
+
+			if not keep:
+
+				os.remove(self.receive_name)
 
-		# AK the packet
-		self.ak(sequence_num)
+		self.receive_map = None
+		self.receive_file = None
+		self.receive_name = None
+
+	# Finishes the download, the file is moved to its final name all at once
+	def save_content(self):
+
+		# Set flag
+		self.done = True
+
+		# Stop counters
+		self.last_content = None
+
+		# Get the total time
+		total_time = time.time() - self.start_time
+
+		if self.receive_map is not None:
+
+			self.receive_map.flush()
+
+		saved_name = self.receive_name
+		self.end_receive(keep=True)
+
+		# Content is raw bytes, unless it came from an older node
+		if self.legacy:
+
+			with open(saved_name, 'rb') as encoded:
+
+				content = base64.b64decode(encoded.read())
+
+			with open(saved_name, 'wb') as the_file:
+
+				the_file.write(content)
+
+		# Get the size of the content
+		content_size = os.path.getsize(saved_name)
+
+		logging.warning("File downloaded: " + self.file_name + " time taken: " + str(total_time) + " bandwidth (bytes/second): " + str(content_size / total_time))
+
+		# Save it
+		os.rename(saved_name, os.path.join(content_folder, str(self.node_id), self.file_name))
 
 	# AKs a packet
-	def ak(self, num):
+	# Older nodes get an AK for every segment right away
+	# Otherwise AKs are gathered into one AK block, sent once ak_every segments are owed, when now is set, or when the delayed AK timer runs out
+	def ak(self, num, now=False):
+
+		if self.legacy:
+
+			if num not in self.send_aks:
+				self.send_aks.append(num)
+
+			self.window_ak()
+
+			return None
 
-		if num not in self.send_aks:
-			self.send_aks.append(num)
+		self.aks_owed += 1
 
-		#self.DNP.send(self.make_header(6,num,0), self.target_id, self.target_port, self.service_id)
+		if now or self.aks_owed >= self.ak_every():
+
+			self.window_ak()
+
+		elif self.ak_timer is None:
+
+			self.ak_timer = self.timers.schedule(ak_delay, self.window_ak)
+
+	# Segments to gather before sending an AK block
+	# Half the window, so the sender can keep sending while the AK is on its way
+	def ak_every(self):
+
+		return max(2, self.window // 2)
 
 	# Sends all aks
 	def window_ak(self):
@@ -367,28 +929,88 @@ class RTP:
 		# Clear the list
 		self.send_aks = []
 
+		# Everything owed goes in one AK block
+		if self.aks_owed > 0:
+
+			try:
+				self.DNP.send(self.make_header(7,0,0) + self.make_ak_block(), self.target_id, self.target_port, self.service_id)
+			except KeyError:
+
+				pass
+
+		self.aks_sent()
+
+	# Makes the AK block for everything received so far
+	# Ranges start after the first missing segment, up to max_sack_ranges of them
+	def make_ak_block(self):
+
+		ranges = []
+
+		index = self.cumulative_index
+		while index <= self.highest_index and len(ranges) < max_sack_ranges:
+
+			# Skip what is missing, the highest index is always received
+			while not self.has_index(index):
+
+				index += 1
+
+			start = index
+			while index <= self.highest_index and self.has_index(index):
+
+				index += 1
+
+			ranges.append((start + self.packet_counter, index + self.packet_counter))
+
+		return pack_ak_block(self.cumulative_index + self.packet_counter, ranges)
+
+	# Clears the owed AKs once they have been sent
+	def aks_sent(self):
+
+		self.aks_owed = 0
+
+		self.timers.cancel(self.ak_timer)
+		self.ak_timer = None
+
 	# Asks for a file
+	# Sending a file name starts a new download, otherwise the last request is sent again
 	def ask(self, file_name=None):
 
 		if file_name is not None:
 
+			self.reset_trackers()
+
 			self.file_name = file_name
 
-		elif file_name is None:
+			self.requested = True
+
+			# Only the first ask can be timed
+			self.handshake_sent = time.time()
+
+		elif self.file_name is None:
 
 			return None
+
+		else:
+
+			self.handshake_sent = None
 		try:
 			self.DNP.send(self.make_header(10,0,0) + self.file_name, self.target_id, self.target_port, self.service_id)
 			self.last_content = time.time()
+			self.watch()
 		except KeyError:
 
 			pass
 
 	# Sends file acceptance
+	# Includes the segment size so the content can be written in place, older nodes only expect yes
 	def yes(self):
+		response = 'yes'
+		if not self.legacy:
+			response += pack_string(self.chunk_size)
 		try:
-			self.DNP.send(self.make_header(11,0,0) + 'yes', self.target_id, self.target_port, self.service_id)
+			self.DNP.send(self.make_header(11,0,0) + response, self.target_id, self.target_port, self.service_id)
 			self.last_ak = time.time()
+			self.watch()
 		except KeyError:
 			pass
 
@@ -403,146 +1025,265 @@ class RTP:
 	def aked(self, num):
 
 		self.last_ak = time.time()
+		self.watch()
 
-		# Remove from the waiting and queue
-		#if num in self.ak_waiting:
-		if num in self.all_queue.keys():
+		# Remove from the waiting and stop its timer
+		if num in self.ak_waiting:
 
-			del self.all_queue[num]
+			sent_time = self.ak_waiting[num]
 
-			if len(self.all_queue.keys()) == 0:
-				logging.warning("Download complete")
-				self.done = True
+			# Only segments sent once give a round trip time
+			if num not in self.resent:
 
-	# Attempts to get the content
-	def get_content(self):
+				self.rtt_sample(time.time() - sent_time)
 
-		# Combine all data
-		combined_data = "".join(self.content_buffer)
+			# A resent segment got through, the path is working again
+			else:
 
-		# Packet is complete if size of data is equal to the total_size
-		if self.total_size and len(combined_data) == self.total_size:
+				self.reset_rto()
 
-			# Set flag
-			self.done = True
+			# The congestion window only grows while it is what limits sending
+			if len(self.ak_waiting) >= self.congestion.limit():
 
-			# Stop counters
-			self.last_content = None
+				self.congestion.on_ak()
 
-			# Send back all data
-			return combined_data
+			del self.ak_waiting[num]
+			del self.later_aks[num]
+			self.timers.cancel(self.segment_timers.pop(num, None))
 
-		# Not complete
-		else:
+			self.congestion.record(self.segment_size(num))
 
-			return None
+			# Segments sent before this one should have been AKed already
+			for waiting_num in self.ak_waiting.keys():
 
-	# Saves the content
-	def save_content(self):
+				if self.ak_waiting[waiting_num] <= sent_time:
 
-		# Ignore if there is no content
-		if len(self.content_buffer) != 0:
+					self.later_aks[waiting_num] += 1
 
-			# Try to get the content
-			content = self.get_content()
+					# Missing, send it again without waiting for its timer
+					if self.later_aks[waiting_num] == dup_threshold:
 
-			# Content got
-			if content is not None:
+						self.congestion_loss(waiting_num, timeout=False)
 
-				# Get the total time
-				total_time = time.time() - self.start_time
+						self.send_segment(waiting_num, retransmit=True)
 
-				# Need to go from utf-8 -> base64 -> file
-				content = content.decode('utf-8')
-				content = content.decode('base64')
+			# Everything has been sent and AKed
+			if len(self.ak_waiting) == 0 and self.next_seq > self.last_seq:
+				logging.warning("Download complete, bytes sent: " + str(self.bytes_original) + " bytes resent: " + str(self.bytes_retransmitted))
+				self.done = True
 
-				# Get the size of the content
-				content_size = len(content)
+				self.congestion.add_history()
+				logging.info("Congestion history:\n" + self.congestion.history_string())
 
-				logging.warning("File downloaded: " + self.file_name + " time taken: " + str(total_time) + " bandwidth (bytes/second): " + str(content_size / total_time))
+				self.end_send()
 
-				# Save it
-				with open(os.path.join(content_folder, str(self.node_id), self.file_name ), 'w') as the_file:
+			# A slot in the window is free
+			else:
 
-					the_file.write(content)
+				self.window_send()
 
-	# Does maintainence on the connection
-	def cleanup(self):
+	# Deals with an AK block
+	# Everything before cumulative and inside the ranges has been received
+	def sacked(self, cumulative, ranges):
 
-		# Based on stage, do cleanup
+		self.last_ak = time.time()
+		self.watch()
 
-		# Requesting
-		if self.stage == 1:
+		# The window this frees can ask for an AK again
+		self.ak_now_sent = False
 
-			# Resend request
-			self.request()
+		probe_sent = self.ak_waiting.get(self.probe_seq)
 
-		# Accepting
-		elif self.stage == 2:
+		# In order, so later segments count against the ones missing before them
+		for num in sorted(self.ak_waiting.keys()):
 
-			# Resend accept
-			self.accept()
+			if num < cumulative or any(start <= num < end for (start, end) in ranges):
 
-		# Finalizing
-		elif self.stage == 3:
+				self.aked(num)
 
-			# If no accepts have been recieved in a while, connection is active
-			if(self.last_finalize_time and self.last_finalize_time > self.timeout*self.accept_max):
+		# The segment resent after a timeout is in, and this block has everything the receiver had then
+		# Anything sent before it that is still waiting was lost, so it is sent again now rather than after another timeout
+		if probe_sent is not None and self.probe_seq not in self.ak_waiting:
 
-				self.stage = 4
+			self.probe_seq = None
 
-				logging.warning("Finalized connection to: " + str(self.target_id))
+			for waiting_num in sorted(self.ak_waiting.keys()):
 
-				# Add to the connected list
-				self.connected_to.append((self.service_id, self.target_id, self.target_port))
+				if self.ak_waiting[waiting_num] <= probe_sent:
 
-			else:
+					self.congestion_loss(waiting_num, timeout=False)
 
-				# Resend finalize
-				self.finalize()
+					self.send_segment(waiting_num, retransmit=True)
 
-		# Active
-		else:
+	# Does maintainence on the connection
+	def cleanup(self):
+
+		# The watch timer found that content or AKs stopped coming, or the handshake ran out of tries
+		if self.broken:
+
+			raise RuntimeError("Connection broken")
+
+		# Handshake messages are resent by the handshake timer
+		if self.stage == 4:
 
 			# Make sure enough time has passed
-			if time.time() - self.last_clean > self.timeout:
+			if time.time() - self.last_clean > self.rto:
 
 				self.last_clean = time.time()
 
+				# The next transfer uses the new path
+				self.probe_path()
+
 				# Check for response ak
-				if self.requested:
+				if self.requested and not self.done:
 
-					self.ask(self.file_name)
+					self.ask()
 
 				# Stream is not complete
 				if not self.done:
 
-					# Check for content timeout
-					if self.last_content and time.time() - self.last_content > self.timeout:
+					# Start anything the window has room for, resends are done by the segment timers
+					self.window_send()
 
-						#print "content time out"
+				# Send aks, repeats after the download is done still need them
+				self.window_ak()
 
-						# Check for broken
-						if time.time() - self.last_content > self.timeout * 10:
+	# Starts watching for a broken connection, if not already
+	# The connection is broken if content or AKs stop coming for broken_timeout
+	def watch(self):
 
-							raise RuntimeError("Connection broken")
+		if self.watch_timer is None:
 
-					# Check for ak timeout
-					if self.last_ak and time.time() - self.last_ak > self.timeout:
+			self.watch_timer = self.timers.schedule(self.broken_timeout(), self.check_alive)
 
-						# Check for broken
-						if time.time() - self.last_ak > self.timeout * 10:
+	# How long to wait for content or AKs before the connection is broken
+	def broken_timeout(self):
 
-							raise RuntimeError("Connection broken")
+		return max(self.rto * broken_factor, broken_min)
 
-					# Resend content
-					self.window_send()
+	# The timeout for closing the service
+	def close_timeout(self):
 
-					# Resend aks
-					self.window_ak()
+		return max(self.rto * close_factor, close_min)
 
-					# Try to get all content
-					self.save_content()
+	# Called by the watch timer, marks the connection as broken or waits for the next deadline
+	def check_alive(self):
+
+		self.watch_timer = None
+
+		# Nothing left to watch
+		if self.done:
+
+			return None
+
+		# The oldest of the times being watched decides
+		watched = [item for item in (self.last_content, self.last_ak) if item is not None]
+		if len(watched) == 0:
+
+			return None
+
+		remaining = min(watched) + self.broken_timeout() - time.time()
+
+		if remaining > 0:
+
+			self.watch_timer = self.timers.schedule(remaining, self.check_alive)
+
+		else:
+
+			self.broken = True
+
+	# Adds a round trip time sample and sets the retransmit timeout from it, Jacobson/Karels
+	# Any backoff is dropped, the path is answering again
+	def rtt_sample(self, sample):
+
+		if self.srtt is None:
+
+			self.srtt = sample
+			self.rttvar = sample / 2
+
+		else:
+
+			self.rttvar = (1 - rtt_beta) * self.rttvar + rtt_beta * abs(self.srtt - sample)
+			self.srtt = (1 - rtt_alpha) * self.srtt + rtt_alpha * sample
+
+		self.reset_rto()
+
+	# Sets the retransmit timeout from the round trip time estimates, dropping any backoff
+	def reset_rto(self):
+
+		if self.srtt is not None:
+
+			self.rto = min(max(self.srtt + 4 * self.rttvar, rto_min), rto_max)
+
+	# Doubles the retransmit timeout after a loss
+	def back_off(self):
+
+		self.rto = min(self.rto * 2, rto_max)
+
+		self.last_backoff = time.time()
+
+	# Restarts the handshake timer, the current handshake message is resent when it runs out
+	def handshake_retry(self):
+
+		self.timers.cancel(self.handshake_timer)
+
+		self.handshake_timer = self.timers.schedule(self.rto, self.handshake_timeout)
+
+	# Called by the handshake timer
+	def handshake_timeout(self):
+
+		self.handshake_timer = None
+
+		# Running out of tries breaks the connection, it is dropped on the next cleanup
+		try:
+
+			# Requesting, resend request
+			if self.stage == 1:
+
+				self.back_off()
+				self.request()
+
+			# Accepting, resend accept
+			elif self.stage == 2:
+
+				self.back_off()
+				self.accept()
+
+			# Finalizing, no accept came back after the finalize so it got through
+			elif self.stage == 3:
+
+				self.activate("Finalized connection to: ")
+
+		except RuntimeError:
+
+			self.broken = True
+
+	# Marks the handshake as done
+	def activate(self, message):
+
+		self.stage = 4
+
+		self.timers.cancel(self.handshake_timer)
+		self.handshake_timer = None
+
+		logging.warning(message + str(self.target_id))
+
+		# Add to the connected list
+		self.connected_to.append((self.service_id, self.target_id, self.target_port))
+
+	# Stops all timers for this connection, use before dropping it
+	def close(self):
+
+		self.timers.cancel(self.watch_timer)
+		self.timers.cancel(self.handshake_timer)
+
+		self.watch_timer = None
+		self.handshake_timer = None
+
+		self.aks_sent()
+
+		self.end_send()
+		self.end_receive()
 
 	# Sends a request, step 1 in handshake
 	def request(self):
@@ -557,9 +1298,21 @@ class RTP:
 
 			raise RuntimeError("Request limit reached")
 
+		# Older nodes can't read the binary header, try the text header for the second half of the requests
+		if self.request_counter > self.request_max / 2 and not self.legacy:
+
+			logging.info("No response, trying the text header with: " + str(self.target_id))
+
+			self.legacy = True
+
 		# Get the header for the packet
-		# This is also the only content
-		message = self.make_header(1,0,0) + str(self.window)
+		# The binary header carries the window, old nodes expect it as the content
+		message = self.make_header(1,0,0)
+		if self.legacy:
+			message += str(self.window)
+
+		# Only the first request can be timed
+		self.handshake_sent = time.time() if self.request_counter == 1 else None
 
 		# Send this message
 		try:
@@ -567,6 +1320,8 @@ class RTP:
 		except KeyError:
 			pass
 
+		self.handshake_retry()
+
 	# Accepts the request and replies with the AK, step 2 in handshake
 	def accept(self):
 
@@ -584,24 +1339,23 @@ class RTP:
 		# This is also the only content
 		message = self.make_header(2,0,0)
 
+		# Only the first accept can be timed
+		self.handshake_sent = time.time() if self.accept_counter == 1 else None
+
 		# Send this message
 		try:
 			self.DNP.send(message, self.target_id, self.target_port, self.service_id)
 		except KeyError:
 			pass
 
+		self.handshake_retry()
+
 		# Add to the connected list
 		#self.connected_to.append((self.target_id, self.target_port))
 
 	# Finalizes handshake, step 3 in handshake
 	def finalize(self):
 
-		try:
-			self.last_finalize_time
-
-		except AttributeError:
-			self.last_finalize_time = time.time()
-
 		logging.info("Finalizing connection with: " + str(self.target_id))
 
 		# Increment counter
@@ -622,6 +1376,9 @@ class RTP:
 		except KeyError:
 			pass
 
+		# The connection is active once accepts stop coming for a timeout
+		self.handshake_retry()
+
 		# Add to the connected list
 		#self.connected_to.append((self.target_id, self.target_port))
 
@@ -635,12 +1392,31 @@ class RTP:
 		# The packet ID counter
 		self.packet_counter = 2
 
-		# The total queue of packets
-		# Sequence number : content
-		self.all_queue = {}
+		# Stop sending anything left from the last message
+		self.end_send()
 
 		# The packet IDs waiting AK
-		self.ak_waiting = []
+		# Sequence number : time last sent
+		self.ak_waiting = {}
+
+		# Content bytes sent for the first time and sent again
+		self.bytes_original = 0
+		self.bytes_retransmitted = 0
+
+		# Segments that have been sent more than once
+		self.resent = set()
+
+		# Sequence number : number of segments sent after it that were AKed first
+		self.later_aks = {}
+
+		# Losses of segments before this are not told to the congestion controller again
+		self.recovery_seq = 0
+
+		# The last segment resent after a timeout
+		self.probe_seq = None
+
+		# A segment with flag_ak_now was sent since the last AK block, only one is asked for until the next one comes
+		self.ak_now_sent = False
 
 		# The last time content was got
 		self.last_content = None
@@ -663,43 +1439,58 @@ class RTP:
 		# The expected content size
 		self.total_size = None
 
-		# Content buffer
-		self.content_buffer = []
+		# Drop any partial download
+		self.end_receive()
 
-		# Sequence nums in the buffer
-		self.content_ids = []
+		# Size of each incoming segment, comes with the yes response
+		self.receive_chunk = None
 
-		# The aks to send
+		# The aks to send to older nodes
 		self.send_aks = []
 
+		# Segments received but not yet AKed, for nodes that take AK blocks
+		self.aks_owed = 0
+		self.timers.cancel(self.ak_timer)
+		self.ak_timer = None
+
 	# Makes the header
-	def make_header(self, pkt_type, sequence_num, total_size):
+	# Uses the old text header if the other side is an older node
+	def make_header(self, pkt_type, sequence_num, total_size, flags=0):
 
-		return "|".join([str(x) for x in [pkt_type, sequence_num, total_size]]) + '|'
+		if self.legacy:
+
+			return "|".join([str(x) for x in [pkt_type, sequence_num, total_size]]) + '|'
+
+		return RTP_header_format.pack(header_version, pkt_type, flags, sequence_num, total_size, self.window)
 
 	# Gets the header, body
+	# Replies will use the same kind of header as this packet
 	def separate(self, packet):
 
-		(pkt_type, sequence_num, total_size, body) = packet.split("|", 3)
-		pkt_type = int(pkt_type)
-		sequence_num = int(sequence_num)
-		total_size = int(total_size)
+		(legacy, pkt_type, flags, sequence_num, total_size, window, body) = unpack_header(packet)
+
+		self.legacy = legacy
 
-		return (pkt_type, sequence_num, total_size, body)
+		return (pkt_type, flags, sequence_num, total_size, body)
 
 	# The size of the header generated by this layer
 	# Expected size
-	# type	| sequence number	
-	# 4	| 4			
-	# Total: 8
+	# version	| type	| flags	| sequence number	| total size	| window
+	# 1		| 1	| 1	| 4			| 4		| 2
+	# Total: 13
+	# The old text header is up to 25
 	def header_size(self):
 
-		return (field_size * 2)
+		if self.legacy:
+
+			return legacy_header_max
+
+		return RTP_header_format.size
 
 	# The total size of the header including the lower layer header
 	# Expected size
 	# DNP layer	| RTP layer
-	# 48		| 8
+	# 36 - 48	| 13
 	def header_total(self):
 
 		return self.DNP.header_total() + self.header_size()
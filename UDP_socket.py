@@ -1,11 +1,60 @@
 # This manages a UDP port
 # Can be configured to send garbled messages to emulate packet loss / corruption
+# Datagrams are sent and received in batches, with one sendmmsg / recvmmsg call on Linux
 
+import sys
 import string
 import socket
+import select
+import errno
+import struct
 import random
 import logging
 
+# Most datagrams handled by one batched call
+batch_size = 64
+
+# Largest datagram that can be received
+buffer_size = 4096
+
+# Returned when a non blocking read has nothing waiting
+would_block = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# Reads don't wait when nothing is queued, None where the flag does not exist and select has to be used
+dont_wait = getattr(socket, "MSG_DONTWAIT", None)
+
+# sendmmsg and recvmmsg through ctypes, libc is None if they can't be used here
+# The structures below are laid out as on Linux, anywhere else one datagram is sent or received per call
+try:
+
+	import ctypes
+	import ctypes.util
+
+	libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+	libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+	libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+
+	class iovec(ctypes.Structure):
+		_fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+	class sockaddr_in(ctypes.Structure):
+		_fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16), ("sin_addr", ctypes.c_uint8 * 4), ("sin_zero", ctypes.c_uint8 * 8)]
+
+	class msghdr(ctypes.Structure):
+		_fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32), ("msg_iov", ctypes.POINTER(iovec)), ("msg_iovlen", ctypes.c_size_t), ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t), ("msg_flags", ctypes.c_int)]
+
+	class mmsghdr(ctypes.Structure):
+		_fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+except (ImportError, OSError, AttributeError, TypeError):
+
+	libc = None
+
+if dont_wait is None or not sys.platform.startswith("linux"):
+
+	libc = None
+
 class UDP_socket:
 
 	# Class members
@@ -33,7 +82,13 @@ class UDP_socket:
 	# corruption_threshold : int
 	# The chance from 0 - 100 that a packet, if not entirely lost, will be sent with errors
 	# Higher values mean a higher chance for corruption
-	def __init__(self, ip_address, port, loss_threshold = 0, corruption_threshold = 0):
+	#
+	# batched : bool
+	# False sends and receives one datagram per call even where sendmmsg / recvmmsg can be used
+	#
+	# receive_size : int
+	# The largest datagram that can be received
+	def __init__(self, ip_address, port, loss_threshold = 0, corruption_threshold = 0, batched = True, receive_size = buffer_size):
 
 		# Save the socket info
 		self.ip_address = ip_address
@@ -48,6 +103,10 @@ class UDP_socket:
 		# Set the garbling parameters
 		self.set_garble_parameters("DEFAULT", "DEFAULT")
 
+		# Counts what actually went out on the socket, after the garbler
+		self.sent_count = 0
+		self.sent_bytes = 0
+
 		# Create and bind the UDP socket
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -56,6 +115,67 @@ class UDP_socket:
 
 		logging.warning("Bound socket to: " + str((self.ip_address, self.port)))
 
+		self.batched = batched and libc is not None
+		self.receive_size = receive_size
+
+		# Receive buffers are made once and reused for every batch
+		if self.batched:
+
+			self.setup_batches()
+
+		else:
+
+			self.receive_buffer = bytearray(self.receive_size)
+
+		# Destinations resolved for sendmmsg
+		# (host, port) : sockaddr_in
+		self.destinations = {}
+
+	# Makes the buffers and message headers used by sendmmsg and recvmmsg
+	def setup_batches(self):
+
+		# One block holds every receive buffer, each message lands receive_size after the one before
+		self.receive_block = ctypes.create_string_buffer(self.receive_size * batch_size)
+		self.receive_addresses = (sockaddr_in * batch_size)()
+		self.receive_vectors = (iovec * batch_size)()
+		self.receive_headers = (mmsghdr * batch_size)()
+
+		for message_index in range(batch_size):
+
+			self.receive_vectors[message_index].iov_base = ctypes.addressof(self.receive_block) + message_index * self.receive_size
+			self.receive_vectors[message_index].iov_len = self.receive_size
+
+			header = self.receive_headers[message_index].msg_hdr
+			header.msg_name = ctypes.addressof(self.receive_addresses[message_index])
+			header.msg_namelen = ctypes.sizeof(sockaddr_in)
+			header.msg_iov = ctypes.pointer(self.receive_vectors[message_index])
+			header.msg_iovlen = 1
+
+		# Received lengths and senders are read straight from copies of the headers, it is much faster than going through each field
+		# The kernel always gives back a full sockaddr_in for this socket, so the headers never need to be set again
+		self.header_size = ctypes.sizeof(mmsghdr)
+		self.address_size = ctypes.sizeof(sockaddr_in)
+		self.port_offset = sockaddr_in.sin_port.offset
+
+		# Unpacks the length of every message in the first count headers
+		# count : struct.Struct
+		length_offset = mmsghdr.msg_len.offset
+		length_format = str(length_offset) + "xI" + str(self.header_size - length_offset - struct.calcsize("I")) + "x"
+		self.length_formats = dict((count, struct.Struct("=" + length_format * count)) for count in range(1, batch_size + 1))
+
+		# The sender as packed in a sockaddr_in, port and address : (ip, port)
+		self.senders = {}
+
+		self.send_vectors = (iovec * batch_size)()
+		self.send_headers = (mmsghdr * batch_size)()
+
+		for message_index in range(batch_size):
+
+			header = self.send_headers[message_index].msg_hdr
+			header.msg_namelen = ctypes.sizeof(sockaddr_in)
+			header.msg_iov = ctypes.pointer(self.send_vectors[message_index])
+			header.msg_iovlen = 1
+
 	# Releases the socket once this class is destroyed
 	def __del__(self):
 
@@ -72,7 +192,26 @@ class UDP_socket:
 	# The ip and port to send to
 	def send_garbled(self, message, send_info):
 
-		# Use the garble parameters to determine the fate of the message
+		message = self.garble(message, send_info)
+
+		# Lost
+		if message is None:
+
+			return
+
+		# Send the message
+		#print send_info
+		self.sock.sendto(message, send_info)
+
+		self.sent_count += 1
+		self.sent_bytes += len(message)
+
+		logging.debug("Packet sent to: " + str(send_info))
+		logging.debug("Message contents: " + message)
+
+	# Uses the garble parameters to determine the fate of the message
+	# Returns the message to send, None if it is lost
+	def garble(self, message, send_info):
 
 		# Loss, failure means no sending
 		if random.randint(1, 100) <= self.current_loss_threshold:
@@ -80,7 +219,7 @@ class UDP_socket:
 			logging.debug("Packet loss sending to: " + str(send_info))
 			logging.debug("Message contents: " + message)
 
-			return
+			return None
 
 		# Corruption, failure means that the message will be randomly altered
 		if random.randint(1, 100) <= self.current_corruption_threshold:
@@ -88,23 +227,167 @@ class UDP_socket:
 			logging.debug("Packet corruption sending to: " + str(send_info))
 			logging.debug("Message contents: " + message)
 
-			message = ''.join(i if random.randint(0, 1) else random.choice(string.letters) for i in message)
+			message = ''.join(i if random.randint(0, 1) else random.choice(string.letters) for i in str(message))
 
-		# Send the message
-		#print send_info
-		self.sock.sendto(message, send_info)
+		return message
 
-		logging.debug("Packet sent to: " + str(send_info))
-		logging.debug("Message contents: " + message)
-
-	# Sends a list of messages to the same address. Uses send_garbled
+	# Sends a list of messages, each is garbled like send_garbled
 	# Each item should have (message, (ip, port))
+	# Sent batch_size at a time with sendmmsg where it can be used
 	def send_all_garbled(self, message_list):
 
-		# Call send_garbled for each message
-		for send_item in message_list:
+		if not self.batched:
+
+			# Call send_garbled for each message
+			for send_item in message_list:
+
+				self.send_garbled(send_item[0], send_item[1])
+
+			return
+
+		to_send = []
+		for (message, send_info) in message_list:
+
+			message = self.garble(message, send_info)
+
+			# Packets can be built as bytearrays, sendmmsg needs a string to point at
+			if message is not None:
+
+				to_send.append((str(message), send_info))
+
+		for batch_start in range(0, len(to_send), batch_size):
+
+			self.send_batch(to_send[batch_start:batch_start + batch_size])
+
+	# Sends up to batch_size messages with sendmmsg, after they have been garbled
+	def send_batch(self, to_send):
+
+		for (message_index, (message, send_info)) in enumerate(to_send):
+
+			self.send_vectors[message_index].iov_base = ctypes.cast(ctypes.c_char_p(message), ctypes.c_void_p)
+			self.send_vectors[message_index].iov_len = len(message)
+
+			self.send_headers[message_index].msg_hdr.msg_name = ctypes.addressof(self.get_destination(send_info))
+
+		# The socket blocks, so everything goes out unless there is an error
+		# Messages keep their references in to_send until the call returns
+		sent = 0
+		while sent < len(to_send):
+
+			result = libc.sendmmsg(self.sock.fileno(), ctypes.addressof(self.send_headers[sent]), len(to_send) - sent, 0)
+
+			if result < 0:
+
+				error_number = ctypes.get_errno()
+
+				raise socket.error(error_number, errno.errorcode.get(error_number, str(error_number)))
+
+			sent += result
+
+		for (message, send_info) in to_send:
+
+			self.sent_count += 1
+			self.sent_bytes += len(message)
+
+			logging.debug("Packet sent to: " + str(send_info))
+			logging.debug("Message contents: " + message)
+
+	# The address of a destination for sendmmsg, resolved the first time it is used
+	def get_destination(self, send_info):
+
+		try:
+
+			return self.destinations[send_info]
+
+		except KeyError:
+
+			(host, port) = send_info
+
+			destination = sockaddr_in()
+			destination.sin_family = socket.AF_INET
+			destination.sin_port = socket.htons(int(port))
+			destination.sin_addr[:] = bytearray(socket.inet_aton(socket.gethostbyname(host)))
+
+			self.destinations[send_info] = destination
+
+			return destination
+
+	# Returns every datagram waiting on the socket, up to batch_size, without blocking
+	# Each item is (message, (ip, port))
+	def receive_batch(self):
+
+		if self.batched:
+
+			result = libc.recvmmsg(self.sock.fileno(), ctypes.addressof(self.receive_headers), batch_size, dont_wait, None)
+
+			if result < 0:
+
+				error_number = ctypes.get_errno()
+
+				if error_number in would_block:
+
+					return []
+
+				raise socket.error(error_number, errno.errorcode.get(error_number, str(error_number)))
+
+			if result == 0:
+
+				return []
+
+			lengths = self.length_formats[result].unpack(ctypes.string_at(ctypes.addressof(self.receive_headers), result * self.header_size))
+			addresses = ctypes.string_at(ctypes.addressof(self.receive_addresses), result * self.address_size)
+
+			block_address = ctypes.addressof(self.receive_block)
+
+			received = []
+			for message_index in range(result):
+
+				message = ctypes.string_at(block_address + message_index * self.receive_size, lengths[message_index])
+
+				# Port and address, the family and padding are the same for every sender
+				address_start = message_index * self.address_size + self.port_offset
+				packed_sender = addresses[address_start:address_start + 6]
+
+				try:
+
+					sender = self.senders[packed_sender]
+
+				except KeyError:
+
+					sender = (socket.inet_ntoa(packed_sender[2:]), struct.unpack("!H", packed_sender[:2])[0])
+					self.senders[packed_sender] = sender
+
+				received.append((message, sender))
+
+			return received
+
+		# One datagram per call, into the same buffer
+		received = []
+		while len(received) < batch_size:
+
+			if dont_wait is None and len(select.select([self.sock], [], [], 0)[0]) == 0:
+
+				break
+
+			try:
+
+				(size, sender) = self.sock.recvfrom_into(self.receive_buffer, self.receive_size, dont_wait or 0)
+
+			except socket.timeout:
+
+				break
+
+			except socket.error as error:
+
+				if error.errno in would_block:
+
+					break
+
+				raise
+
+			received.append((str(self.receive_buffer[:size]), sender))
 
-			self.send_garbled(send_item[0], send_item[1])
+		return received
 
 	# Sets the garbling parameters of this socket
 	# Throws execptions for invalid input
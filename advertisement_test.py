@@ -0,0 +1,76 @@
+# Compares the text and binary routing advertisement formats
+# Each table is encoded and decoded, the same work done for every advertisement sent and received
+
+import sys
+import os
+import time
+import logging
+
+from general_utility import enforce_path
+import route
+
+# Table sizes to test
+table_sizes = (100, 1000, 10000)
+
+# Encodes and decodes a table with the sent number of entries in both formats, prints and returns {format : (bytes, encodes/second, decodes/second)}
+def test(entry_count, repeats = 20):
+
+	# Costs are spread out like they would be in a large network
+	entries = [(target_id, target_id % 50 + 1) for target_id in range(entry_count)]
+
+	formats = {
+		"text" : (route.format_entries, route.parse_entries),
+		"binary" : (route.pack_entries, route.unpack_entries)
+	}
+
+	results = {}
+	for name in sorted(formats.keys()):
+
+		(encode, decode) = formats[name]
+
+		start = time.time()
+		for repeat_index in range(repeats):
+
+			encoded = encode(entries)
+
+		encode_time = time.time() - start
+
+		start = time.time()
+		for repeat_index in range(repeats):
+
+			decoded = dict(decode(encoded))
+
+		decode_time = time.time() - start
+
+		# Both have to give back the same table
+		if decoded != dict(entries):
+
+			raise ValueError("Decoded table does not match: " + name)
+
+		results[name] = (len(encoded), repeats / encode_time, repeats / decode_time)
+
+		print ("Entries: " + str(entry_count)).ljust(16) + name.ljust(8) + "Bytes: " + str(len(encoded)).ljust(10) + "Encodes/second: " + str(int(repeats / encode_time)).ljust(10) + "Decodes/second: " + str(int(repeats / decode_time))
+
+	return results
+
+# Run the test for each table size
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/advertisement_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.INFO)
+
+	for entry_count in table_sizes:
+		test(entry_count)
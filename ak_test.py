@@ -0,0 +1,92 @@
+# Measures the packets sent back to the sender while downloading
+# Older nodes AK every segment with its own packet, newer nodes gather AKs into AK blocks
+# Node 1 downloads from node 4 in local_test_1.txt, through one relay
+# Reverse packets include the routing traffic node 1 sends during the download
+# Under loss, AKs are only sent right away for a new gap, a filled gap, or once per AK block when the sender's window is full
+# Loss starts once the connection is made, a lossy handshake can fall back to the text header and test the wrong thing
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+
+# The topology used, nodes 1 and 4 are two hops apart
+topology_file = "topology/local_test_1.txt"
+
+# Size of the generated file, in bytes
+file_size = 500000
+
+# Downloads the file from node 4 to node 1, prints and returns (segments, forward packets, reverse packets)
+# legacy True uses the text header, which AKs every segment
+def test(source_file, legacy = False, window = 20, loss_chance = 0):
+
+	network = network_sim.Network(topology_file, loss_chance = 0, corruption_chance = 0)
+
+	try:
+
+		# Let routing settle
+		network.run(4)
+
+		file_name = os.path.basename(source_file)
+		network.place_content(4, source_file, file_name)
+
+		client_point = network.connect(1, 4, window=window, legacy_header=legacy)
+
+		for the_node in network.nodes.values():
+
+			the_node.main_socket.set_garble_parameters(loss_threshold = loss_chance)
+
+		(ignore, start_forward) = network.sent([4])
+		(ignore, start_reverse) = network.sent([1])
+
+		taken = network.download(client_point, file_name, source_file)
+
+		(ignore, end_forward) = network.sent([4])
+		(ignore, end_reverse) = network.sent([1])
+
+		# The connection node 4 sent the file over
+		sender = network.connections(4)[0]
+		segments = sender.last_seq - sender.first_seq + 1
+
+	finally:
+
+		network.close()
+
+	forward = end_forward - start_forward
+	reverse = end_reverse - start_reverse
+
+	print ("per segment" if legacy else "AK blocks").ljust(14) + "Loss: " + str(loss_chance).ljust(4) + "Segments: " + str(segments).ljust(8) + "Forward packets: " + str(forward).ljust(8) + "Reverse packets: " + str(reverse).ljust(8) + "Reverse per forward: " + ("%.2f" % (float(reverse) / forward)).ljust(6) + "Seconds: " + str(taken)
+
+	return segments, forward, reverse
+
+# Run the test with and without AK blocks
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/ak_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Random content, so nothing can be compressed away
+	generated_name = os.path.join(content_folder, "generated_" + str(file_size))
+	with open(generated_name, "wb") as generated:
+
+		generated.write(os.urandom(file_size))
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for loss_chance in (0, 5):
+		test(generated_name, legacy = True, loss_chance = loss_chance)
+		test(generated_name, legacy = False, loss_chance = loss_chance)
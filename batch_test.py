@@ -0,0 +1,103 @@
+# Measures socket throughput with and without batched sends and receives
+# Packets are sent in bursts the way a node flushes its send list, then every packet waiting is read back
+
+import socket
+import sys
+import os
+import time
+import logging
+
+from general_utility import enforce_path
+import UDP_socket
+
+# The IP or host name to use
+host_name = "localhost"
+
+# The port to send from
+send_port = 17880
+
+# The port to recv from
+recv_port = 17881
+
+# Sends number_to_send packets of packet_size bytes, burst_size at a time, and reads them all back
+# Prints and returns (packets sent per second, packets received per second, packets received)
+def test(batched = True, packet_size = 1000, burst_size = 64, number_to_send = 100000):
+
+	# Create the socket to send messages from
+	sender = UDP_socket.UDP_socket(host_name, send_port, batched = batched)
+
+	# Socket to get messages from
+	recv = UDP_socket.UDP_socket(host_name, recv_port, batched = batched)
+
+	try:
+
+		burst = [("x" * packet_size, (host_name, recv_port))] * burst_size
+
+		send_time = 0
+		recv_time = 0
+		received_total = 0
+		for burst_index in range(number_to_send // burst_size):
+
+			start = time.time()
+			sender.send_all_garbled(burst)
+			send_time += time.time() - start
+
+			# Read until the whole burst is in, or nothing more arrives
+			start = time.time()
+			received_burst = 0
+			while received_burst < burst_size:
+
+				received = recv.receive_batch()
+
+				if len(received) == 0:
+
+					# Let anything still in flight arrive
+					if time.time() - start > .1:
+
+						break
+
+					continue
+
+				received_burst += len(received)
+
+			recv_time += time.time() - start
+			received_total += received_burst
+
+		sent_total = sender.sent_count
+
+	finally:
+
+		sender.sock.close()
+		recv.sock.close()
+
+	print ("batched" if batched and UDP_socket.libc is not None else "one per call").ljust(14) + "Packet size: " + str(packet_size).ljust(6) + "Burst: " + str(burst_size).ljust(4) + "Sent/second: " + str(int(sent_total / send_time)).ljust(10) + "Received/second: " + str(int(received_total / recv_time)).ljust(10) + "Received: " + str(received_total) + "/" + str(sent_total)
+
+	return sent_total / send_time, received_total / recv_time, received_total
+
+# Run the test with and without batching, for small and large packets
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/batch_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.INFO)
+
+	if UDP_socket.libc is None:
+
+		print "sendmmsg / recvmmsg are not available here, both runs use one call per packet"
+
+	for packet_size in (100, 1000):
+
+		test(batched = False, packet_size = packet_size)
+		test(batched = True, packet_size = packet_size)
@@ -0,0 +1,82 @@
+# Checksum algorithms used by the link layer to detect corrupted packets
+# Every algorithm declares its own digest size so the link header only holds what it needs
+#
+# name		size	notes
+# md5		16	original format, needed to talk to older nodes
+# crc32		4
+# adler32	4	fastest, weakest on short packets
+# fast64	8	crc32 and adler32 side by side
+
+import hashlib
+import zlib
+import struct
+
+# Holds the packed form of the 32 bit checksums
+crc_format = struct.Struct("!L")
+fast64_format = struct.Struct("!LL")
+
+# A single checksum algorithm
+# digest takes a string or a read only buffer and returns a string of exactly size bytes
+class Checksum:
+
+	def __init__(self, name, size, digest):
+
+		self.name = name
+
+		# Number of bytes the digest takes in the header
+		self.size = size
+
+		self.digest = digest
+
+# Uses md5 to return the hash value for the sent string
+def md5_digest(sent):
+
+	# Make the md5 hasher
+	hasher = hashlib.md5()
+
+	# Add the string
+	hasher.update(sent)
+
+	# Return the hash
+	return hasher.digest()
+
+# zlib returns signed values on some platforms, mask to keep the packed value the same everywhere
+def crc32_digest(sent):
+
+	return crc_format.pack(zlib.crc32(sent) & 0xffffffff)
+
+def adler32_digest(sent):
+
+	return crc_format.pack(zlib.adler32(sent) & 0xffffffff)
+
+def fast64_digest(sent):
+
+	return fast64_format.pack(zlib.crc32(sent) & 0xffffffff, zlib.adler32(sent) & 0xffffffff)
+
+# All of the supported algorithms
+# name : Checksum
+algorithms = {
+	"md5" : Checksum("md5", hashlib.md5().digest_size, md5_digest),
+	"crc32" : Checksum("crc32", crc_format.size, crc32_digest),
+	"adler32" : Checksum("adler32", crc_format.size, adler32_digest),
+	"fast64" : Checksum("fast64", fast64_format.size, fast64_digest)
+}
+
+# The algorithm used when none is specified, matches the original packet format
+default_algorithm = "md5"
+
+# Gets the checksum with the sent name
+# Raises ValueError if the algorithm is not known
+def get_checksum(name = None):
+
+	if name is None:
+
+		name = default_algorithm
+
+	try:
+
+		return algorithms[name]
+
+	except KeyError:
+
+		raise ValueError("Checksum algorithm not known: " + str(name))
@@ -0,0 +1,58 @@
+# Compares the speed of the link layer checksum algorithms
+# Each packet is packed and unpacked by the link layer, the same work done for every packet sent and received
+
+import sys
+import os
+import time
+import logging
+
+from general_utility import enforce_path
+import checksum
+import link
+
+# The size of the packet body, close to the largest MTU in the topology files
+packet_size = 1000
+
+# Packs and unpacks packets using the sent algorithm, prints and returns packets/second
+def test(checksum_name, number_to_send = 100000):
+
+	# The link layer to test
+	tester = link.Link(None, checksum_name = checksum_name)
+
+	contents = os.urandom(packet_size)
+
+	start = time.time()
+	for packet_index in range(number_to_send):
+
+		tester.unpack(tester.pack(contents))
+
+	total_time = time.time() - start
+
+	rate = number_to_send / total_time
+
+	print checksum_name.ljust(10) + "Header size: " + str(tester.header_size()).ljust(4) + "Packets/second: " + str(int(rate))
+
+	return rate
+
+# Run the test for each algorithm
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/checksum_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.INFO)
+
+	print "Packet body size: " + str(packet_size)
+	for name in sorted(checksum.algorithms.keys()):
+		test(name)
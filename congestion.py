@@ -0,0 +1,182 @@
+# Congestion control for RTP connections
+# Keeps a congestion window, the number of segments the network is trusted with right now
+# A connection never has more segments in flight than the smaller of its window and the congestion window
+#
+# name		notes
+# slow_start	doubles every round trip up to a threshold, then grows by one segment per round trip (Reno style)
+# aimd		grows by one segment per round trip from the start, halves on loss
+# none		never limits, the window alone decides
+#
+# Every controller keeps a history of the congestion window and goodput while a message is sent
+
+import time
+
+# Largest congestion window, in segments
+cwnd_max = 0xffff
+
+# Seconds between entries in the history
+history_interval = .1
+
+# The base controller, never limits sending
+# Other controllers change the congestion window in the on_* methods
+class Controller:
+
+	def __init__(self):
+
+		# The congestion window in segments, may be fractional
+		self.cwnd = float(cwnd_max)
+
+		# When the controller was made, history times are measured from here
+		self.start_time = time.time()
+
+		# (seconds since start, congestion window, goodput in bytes/second)
+		self.history = []
+
+		# Content AKed since the last history entry
+		self.interval_start = self.start_time
+		self.interval_bytes = 0
+
+	# The number of segments allowed in flight
+	def limit(self):
+
+		return max(1, int(self.cwnd))
+
+	# Called when a new segment is AKed while the congestion window is what limits sending
+	def on_ak(self):
+
+		pass
+
+	# Called when later segments are AKed but an earlier one is still missing
+	def on_duplicate(self):
+
+		pass
+
+	# Called when a segment's retransmit timer runs out
+	def on_timeout(self):
+
+		pass
+
+	# Adds content that was AKed for the first time to the goodput
+	def record(self, acked_bytes):
+
+		self.interval_bytes += acked_bytes
+
+		current_time = time.time()
+		if current_time - self.interval_start >= history_interval:
+
+			self.add_history(current_time)
+
+	# Closes the current history interval
+	def add_history(self, current_time=None):
+
+		if current_time is None:
+
+			current_time = time.time()
+
+		# Nothing to measure over
+		if current_time <= self.interval_start:
+
+			return None
+
+		goodput = self.interval_bytes / (current_time - self.interval_start)
+
+		self.history.append((current_time - self.start_time, self.cwnd, goodput))
+
+		self.interval_start = current_time
+		self.interval_bytes = 0
+
+	# Returns the history as readable lines
+	def history_string(self):
+
+		lines = ["Seconds".ljust(10) + "CWND".ljust(10) + "Goodput (bytes/second)"]
+		for (seconds, cwnd, goodput) in self.history:
+
+			lines.append(str(round(seconds, 3)).ljust(10) + str(round(cwnd, 2)).ljust(10) + str(int(goodput)))
+
+		return "\n".join(lines)
+
+# Additive increase, multiplicative decrease
+# Starts at initial_window and grows by about one segment every round trip
+class AIMD(Controller):
+
+	def __init__(self, initial_window=2):
+
+		Controller.__init__(self)
+
+		self.cwnd = float(initial_window)
+
+	# One segment per window of AKs
+	def on_ak(self):
+
+		self.cwnd = min(self.cwnd + 1 / self.cwnd, cwnd_max)
+
+	# Halve on loss
+	def on_duplicate(self):
+
+		self.cwnd = max(self.cwnd / 2, 1.0)
+
+	# Nothing is getting through, start over
+	def on_timeout(self):
+
+		self.cwnd = 1.0
+
+# Slow start until ssthresh, then AIMD
+# Loss found by duplicates halves the window, a timeout starts again from one segment
+class SlowStart(AIMD):
+
+	def __init__(self, initial_window=2):
+
+		AIMD.__init__(self, initial_window)
+
+		# Slow start threshold, no limit until the first loss
+		self.ssthresh = float(cwnd_max)
+
+	# One segment per AK in slow start, doubling every round trip
+	def on_ak(self):
+
+		if self.cwnd < self.ssthresh:
+
+			self.cwnd = min(self.cwnd + 1, cwnd_max)
+
+		else:
+
+			AIMD.on_ak(self)
+
+	def on_duplicate(self):
+
+		self.ssthresh = max(self.cwnd / 2, 2.0)
+
+		self.cwnd = self.ssthresh
+
+	def on_timeout(self):
+
+		self.ssthresh = max(self.cwnd / 2, 2.0)
+
+		self.cwnd = 1.0
+
+# All of the supported controllers
+# name : class
+controllers = {
+	"slow_start" : SlowStart,
+	"aimd" : AIMD,
+	"none" : Controller
+}
+
+# The controller used when none is specified
+default_controller = "slow_start"
+
+# Makes a new controller with the sent name
+# Raises ValueError if the controller is not known
+def get_controller(name = None):
+
+	if name is None:
+
+		name = default_controller
+
+	try:
+
+		return controllers[name]()
+
+	except KeyError:
+
+		raise ValueError("Congestion controller not known: " + str(name))
@@ -0,0 +1,82 @@
+# Compares the congestion controllers on a lossy network
+# Node 1 downloads brain.jpg from node 4 in local_test_1.txt with a large window
+# Prints the time taken, traffic and resends for each controller, then the congestion window and goodput over time
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import congestion
+import network_sim
+
+# The topology used, nodes 1 and 4 are two hops apart
+topology_file = "topology/local_test_1.txt"
+
+# Larger than the path can take when packets are being lost
+window = 50
+
+# Downloads the file with the sent controller, prints and returns (seconds, bytes sent, packets sent, bytes resent)
+def test(congestion_name, source_file, loss_chance = 5, show_history = True):
+
+	network = network_sim.Network(topology_file, loss_chance = loss_chance, corruption_chance = 0, congestion_name = congestion_name)
+
+	try:
+
+		# Let routing settle
+		network.run(4)
+
+		file_name = os.path.basename(source_file)
+		network.place_content(4, source_file, file_name)
+
+		client_point = network.connect(1, 4, window=window)
+
+		(start_bytes, start_count) = network.sent()
+
+		taken = network.download(client_point, file_name, source_file)
+
+		(end_bytes, end_count) = network.sent()
+
+		# The connection node 4 sent the file over
+		sender = network.connections(4)[0]
+
+	finally:
+
+		network.close()
+
+	sent_bytes = end_bytes - start_bytes
+	sent_count = end_count - start_count
+
+	print congestion_name.ljust(12) + "Loss: " + str(loss_chance).ljust(4) + "Seconds: " + str(taken).ljust(16) + "Bytes sent: " + str(sent_bytes).ljust(10) + "Packets sent: " + str(sent_count).ljust(8) + "Bytes resent: " + str(sender.bytes_retransmitted)
+
+	if show_history:
+
+		print sender.congestion.history_string()
+		print ""
+
+	return taken, sent_bytes, sent_count, sender.bytes_retransmitted
+
+# Run the test for each controller
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/congestion_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	source_file = os.path.join(content_folder, "brain.jpg")
+
+	for name in sorted(congestion.controllers.keys()):
+		test(name, source_file)
@@ -0,0 +1,92 @@
+# Measures how long routing takes to settle, at start up and after a node fails
+# Runs the whole ITC-2 topology for each routing protocol
+# The network has converged once every node has a working route to every node it can reach and none to any it can't
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+import route
+
+# The topology used
+topology_file = "topology/ITC-2"
+
+# The node that fails, its neighbors can still reach each other without it
+fail_id = 4
+
+# Longest to wait for the network to converge, in seconds
+convergence_limit = 60
+
+# Seconds the converged network is left idle while its routing traffic is counted
+idle_seconds = 10
+
+# Starts the network, measures idle routing traffic, fails a node
+# Prints and returns (start up seconds, idle packets per second, seconds to detect the failure, seconds after the failure, packets sent after the failure)
+# Times are None if the network did not converge within convergence_limit
+def test(routing_protocol):
+
+	network = network_sim.Network(topology_file, routing_protocol = routing_protocol)
+
+	try:
+
+		start_time = network.run(convergence_limit, until=network.routes_converged)
+
+		(ignore, idle_start) = network.sent()
+
+		network.run(idle_seconds)
+
+		(ignore, idle_end) = network.sent()
+
+		network.kill(fail_id)
+
+		(ignore, start_count) = network.sent()
+
+		# Both are measured from the failure
+		detect_time = network.run(convergence_limit, until=lambda: network.failure_detected(fail_id))
+
+		fail_time = None
+		if detect_time is not None:
+
+			remaining_time = network.run(convergence_limit, until=network.routes_converged)
+
+			if remaining_time is not None:
+
+				fail_time = detect_time + remaining_time
+
+		(ignore, end_count) = network.sent()
+
+	finally:
+
+		network.close()
+
+	sent_count = end_count - start_count
+	idle_rate = (idle_end - idle_start) / float(idle_seconds)
+
+	print routing_protocol.ljust(18) + "Start up seconds: " + str(start_time).ljust(16) + "Idle packets/second: " + str(idle_rate).ljust(8) + "Seconds to detect: " + str(detect_time).ljust(16) + "Seconds after node " + str(fail_id) + " fails: " + str(fail_time).ljust(16) + "Packets sent: " + str(sent_count)
+
+	return start_time, idle_rate, detect_time, fail_time, sent_count
+
+# Run the test for each protocol
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/convergence_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for protocol in sorted(route.protocols.keys()):
+		test(protocol)
@@ -0,0 +1,128 @@
+# Compares the route cost functions
+# Node 1 downloads brain.jpg from node 4 in local_test_1.txt, the path through node 3 has the narrowest link
+# Prints the next hops node 4 uses, the path MTU, the time and packets taken, and how often link costs and routes changed while the network was idle
+# Latency is also run without hysteresis, to show the route changes it prevents
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+import route
+
+# The topology used, nodes 2 and 3 are both two hops from 1 to 4
+topology_file = "topology/local_test_1.txt"
+
+# Seconds the network is given to settle, long enough for every link to get route.rtt_window pings and the routes to follow
+settle_seconds = 8
+
+# Seconds the network is left idle while route changes are counted
+idle_seconds = 10
+
+# Downloads the file with the sent cost function
+# Prints and returns (seconds, packets sent, link cost changes while idle, route changes while idle)
+# Seconds and packets are None if routes never settled enough for node 4 to reach node 1 and connect
+# hysteresis False changes link costs on every measurement, with no hold time
+def test(cost_function, source_file, hysteresis = True):
+
+	saved_hysteresis = (route.cost_hysteresis, route.cost_hysteresis_steps, route.rtt_hysteresis, route.cost_hold_time)
+
+	if not hysteresis:
+
+		route.cost_hysteresis = 0
+		route.cost_hysteresis_steps = 0
+		route.rtt_hysteresis = 0
+		route.cost_hold_time = 0
+
+	network = network_sim.Network(topology_file, cost_function = cost_function)
+
+	try:
+
+		# Let routing settle
+		network.run(settle_seconds)
+
+		# Every change to a routing table moves its version on
+		start_versions = sum(the_node.router.table_version for the_node in network.nodes.values())
+		start_costs = sum(the_node.router.cost_change_count for the_node in network.nodes.values())
+
+		network.run(idle_seconds)
+
+		route_changes = sum(the_node.router.table_version for the_node in network.nodes.values()) - start_versions
+		cost_changes = sum(the_node.router.cost_change_count for the_node in network.nodes.values()) - start_costs
+
+		server = network.nodes[4].router
+
+		try:
+
+			next_hops = server.equal_cost_hops.get(1, (server.get_next_hop(1),))
+			path_mtu = server.get_path_mtu(1)
+
+		except KeyError:
+
+			next_hops = None
+			path_mtu = None
+
+		taken = None
+		sent_count = None
+
+		if next_hops is not None:
+
+			file_name = os.path.basename(source_file)
+			network.place_content(4, source_file, file_name)
+
+			# Routes that keep moving can stop the connection from being made
+			try:
+
+				client_point = network.connect(1, 4)
+
+			except RuntimeError:
+
+				client_point = None
+
+			if client_point is not None:
+
+				(ignore, start_count) = network.sent()
+
+				taken = network.download(client_point, file_name, source_file)
+
+				(ignore, end_count) = network.sent()
+
+				sent_count = end_count - start_count
+
+	finally:
+
+		network.close()
+
+		(route.cost_hysteresis, route.cost_hysteresis_steps, route.rtt_hysteresis, route.cost_hold_time) = saved_hysteresis
+
+	print (cost_function + ("" if hysteresis else " (no hysteresis)")).ljust(28) + "Next hops: " + str(next_hops).ljust(10) + "Path MTU: " + str(path_mtu).ljust(6) + "Seconds: " + str(taken).ljust(16) + "Packets sent: " + str(sent_count).ljust(8) + "Idle cost changes: " + str(cost_changes).ljust(6) + "Idle route changes: " + str(route_changes)
+
+	return taken, sent_count, cost_changes, route_changes
+
+# Run the test for each cost function
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/cost_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	source_file = os.path.join(content_folder, "brain.jpg")
+
+	for name in route.cost_functions:
+		test(name, source_file)
+
+	test("latency", source_file, hysteresis = False)
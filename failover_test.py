@@ -0,0 +1,182 @@
+# Measures how quickly forwarding recovers when a link is taken down, with and without fast reroute
+# Node 1 downloads a generated file from node 4 in local_test_1.txt, once a quarter of it is in the link from node 1 to its next hop is downed on both ends
+# Prints the time until node 1 can forward to node 4 again, until node 4 can forward back to node 1, and until the rest of the download is in and matches the file
+# Fast reroute only repairs routes at the node next to the failure, the far side still waits for the routing update
+
+import sys
+import os
+import time
+import logging
+
+from general_utility import *
+import network_sim
+import route
+
+# The topology used, nodes 2 and 3 are both two hops from 1 to 4
+topology_file = "topology/local_test_1.txt"
+
+# Node that downloads, and node that serves
+client_id = 1
+server_id = 4
+
+# Makes the path through node 2 the only cheapest one, so node 3 is left as the backup
+cost_function = "inverse_mtu"
+
+# Size of the file downloaded, in bytes, big enough that it is still coming in when the link goes down
+file_size = 1000000
+
+# Part of the file that has to be in before the link is downed
+down_at = .25
+
+# True if following the next hops from source_id reaches target_id without using a downed link
+def path_works(network, source_id, target_id):
+
+	current_id = source_id
+	hops = 0
+	while current_id != target_id:
+
+		the_node = network.nodes[current_id]
+
+		try:
+
+			next_hop = the_node.router.get_next_hop(target_id)
+
+		except KeyError:
+
+			return False
+
+		if next_hop in the_node.link_down or not network.linked(current_id, next_hop) or hops > len(network.nodes):
+
+			return False
+
+		current_id = next_hop
+		hops += 1
+
+	return True
+
+# Downs the link part way through a download
+# Prints and returns (seconds to forward, seconds to forward back, seconds until the download is in and correct)
+# Each is None if it did not happen in time
+def test(routing_protocol, source_file, fast_reroute = True):
+
+	network = network_sim.Network(topology_file, routing_protocol = routing_protocol, cost_function = cost_function)
+
+	file_name = os.path.basename(source_file)
+
+	try:
+
+		for the_node in network.nodes.values():
+
+			the_node.router.fast_reroute = fast_reroute
+
+		# Let routing settle
+		network.run(4)
+
+		network.place_content(server_id, source_file, file_name)
+
+		client_point = network.connect(client_id, server_id, window=20)
+
+		saved_name = os.path.join(content_folder, str(client_id), file_name)
+		if os.path.exists(saved_name):
+
+			os.remove(saved_name)
+
+		with open(source_file, "rb") as expected:
+
+			expected_contents = expected.read()
+
+		def done():
+
+			if not os.path.exists(saved_name) or os.path.getsize(saved_name) != len(expected_contents):
+
+				return False
+
+			with open(saved_name, "rb") as saved:
+
+				return saved.read() == expected_contents
+
+		client_point.file_request(file_name)
+
+		# Wait until the download is part way in
+		connection = client_point.connections.values()[0]
+
+		def part_in():
+
+			return connection.receive_name is not None and connection.received_count >= connection.receive_total * down_at
+
+		if network.run(30, until=part_in) is None or done():
+
+			raise RuntimeError("Download was not part way in when the link was to be downed")
+
+		# Down both ends of the link in use
+		down_id = network.nodes[client_id].router.get_next_hop(server_id)
+
+		start_time = time.time()
+
+		network.nodes[client_id].do_user_input("downLink", str(down_id))
+		network.nodes[down_id].do_user_input("downLink", str(client_id))
+
+		forward = network.run(10, until=lambda: path_works(network, client_id, server_id))
+		both = network.run(10, until=lambda: path_works(network, client_id, server_id) and path_works(network, server_id, client_id))
+
+		if both is not None:
+
+			both = time.time() - start_time
+
+		finished = network.run(120, until=done)
+
+		if finished is not None:
+
+			finished = time.time() - start_time
+
+	finally:
+
+		network.close()
+
+		for node_id in (client_id, server_id):
+
+			placed = os.path.join(content_folder, str(node_id), file_name)
+			if os.path.exists(placed):
+
+				os.remove(placed)
+
+	print routing_protocol.ljust(18) + ("fast reroute" if fast_reroute else "no fast reroute").ljust(18) + "Downed link: " + str(client_id) + "-" + str(down_id) + "   Seconds to forward: " + str(forward).ljust(18) + "Seconds both ways: " + str(both).ljust(18) + "Seconds to finish download: " + str(finished)
+
+	return forward, both, finished
+
+# Run the test for each routing protocol, with and without fast reroute
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/failover_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	# Random content, so nothing can be compressed away
+	source_file = os.path.join(content_folder, "generated_" + str(file_size))
+	with open(source_file, "wb") as generated:
+
+		generated.write(os.urandom(file_size))
+
+	try:
+
+		for protocol in sorted(route.protocols.keys()):
+
+			test(protocol, source_file, fast_reroute = False)
+			test(protocol, source_file, fast_reroute = True)
+
+	finally:
+
+		os.remove(source_file)
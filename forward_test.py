@@ -0,0 +1,77 @@
+# Measures how fast a transit node forwards packets for other nodes
+# Node 2 of local_test_1.txt forwards packets from node 1 to node 4, no sockets are used
+
+import sys
+import os
+import time
+import logging
+
+from general_utility import enforce_path
+import DNP
+import route
+
+# The topology used, node 2 is linked to both 1 and 4
+topology_file = "topology/local_test_1.txt"
+
+# Size of the message in each packet, fits every link in the topology
+message_size = 500
+
+# Forwards packets through node 2, prints and returns packets/second
+# fast_forward False measures the old path that unpacks and packs every packet again
+def test(fast_forward = True, checksum_name = None, number_to_send = 50000):
+
+	# The node sending packets
+	source = DNP.DNP(1, [], checksum_name = checksum_name)
+	source.set_routing(route.Route(1, topology_file, source))
+
+	# The transit node
+	send_list = []
+	transit = DNP.DNP(2, send_list, checksum_name = checksum_name)
+	transit_router = route.Route(2, topology_file, transit)
+	transit.set_routing(transit_router)
+	transit.fast_forward = fast_forward
+
+	# Node 4 is a neighbor of node 2
+	transit_router.node_id_to_next_hop[4] = (4, 1)
+
+	# Packet from node 1 to node 4 as it arrives at node 2
+	packet = str(source.single_pack("x" * message_size, 4, 10, 10))
+
+	start = time.time()
+	for packet_index in range(number_to_send):
+
+		transit.unpack(packet)
+
+		# The node would send these
+		del send_list[:]
+
+	total_time = time.time() - start
+
+	rate = number_to_send / total_time
+
+	print ("fast" if fast_forward else "repack").ljust(8) + str(checksum_name).ljust(10) + "Forwarded: " + str(transit.forwarded_count + transit.repacked_count).ljust(8) + "Packets/second: " + str(int(rate))
+
+	return rate
+
+# Compare both forwarding paths
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/forward_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for checksum_name in ("md5", "crc32"):
+		test(False, checksum_name)
+		test(True, checksum_name)
@@ -48,37 +48,3 @@ def unpack_string(to_unpack):
 	unpacked = struct.unpack("!" + "L"*amount, to_unpack)
 
 	return unpacked
-
-# Opens topology file and returns information about the node with the sent name
-# (ip, port, connection1, connection2, mtu)
-# TODO: extend to more than 2 connections?
-def get_topology_from_file(file_name, node_id):
-
-	# Open topology file
-	with open(file_name) as config_file:
-
-		# Go through each line
-		for line in config_file:
-
-			# Ignore lines that do not correspond to this node_id, which should be the first token in the line
-			line_contents = line.split()
-			line_id = line_contents[0]
-			if line_id == str(node_id):
-
-				# Get all of the relevant info from the line
-				ip = line_contents[1]
-				port = int(line_contents[2])
-				connection1 = line_contents[3]
-				connection2 = line_contents[4]
-				mtu = line_contents[5]
-
-	# If no items were found, then this node is not in the file
-	try:
-
-		ip
-
-	except UnboundLocalError:
-
-		raise ValueError("Node ID not in file: " + str(node_id))
-
-	return ip, port, connection1, connection2, mtu
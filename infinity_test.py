@@ -0,0 +1,121 @@
+# Measures how distance vector settles after a node fails, with and without split horizon
+# Without it, the nodes left can pass routes to the failed node back and forth, counting the cost up until the routes are held down or reach infinity
+# Runs a ring, where every route to the failed node can bounce around the rest of the ring, and ITC-2
+# Split horizon only stops loops between two nodes, in ITC-2 node 4 is in the triangle 1-4-5 and node 1 is in the triangle 1-2-3
+# A route can go round a triangle without ever being sent back the way it came, so without hold down ITC-2 still counts to infinity
+# The network has settled once every node has a working route to every node it can reach, none to any it can't, and no update is still waiting to be sent
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+import route
+
+# (topology, node that fails)
+# Node 4 of ITC-2 is the case split horizon can't fix, see the top of the file
+cases = (("topology/ring_test_1.txt", 1), ("topology/ITC-2", 4))
+
+# Longest to wait for the network to settle, in seconds
+convergence_limit = 60
+
+# True once every node's table is correct and nothing is left to send
+def settled(network):
+
+	if not network.routes_converged():
+
+		return False
+
+	for the_node in network.nodes.values():
+
+		router = the_node.router
+
+		if router.trigger_timer is not None or router.node_id_to_next_hop != router.unstable_route:
+
+			return False
+
+	return True
+
+# Fails a node once the network has settled
+# Prints and returns (seconds to settle, triggered updates sent by the busiest node, highest cost held for the failed node, packets sent)
+# Seconds is None if the network did not settle within convergence_limit
+# hold_down False lets removed routes straight back in, leaving split horizon and infinity to stop the count
+def test(topology_file, fail_id, split_horizon = True, hold_down = True):
+
+	network = network_sim.Network(topology_file, routing_protocol = "distance_vector")
+
+	try:
+
+		for the_node in network.nodes.values():
+
+			the_node.router.split_horizon = split_horizon
+
+			if not hold_down:
+
+				the_node.router.kill_replace = 0
+
+		network.run(convergence_limit, until=lambda: settled(network))
+
+		network.kill(fail_id)
+
+		start_rounds = dict((node_id, the_node.router.advert_rounds) for (node_id, the_node) in network.nodes.items())
+
+		(ignore, start_count) = network.sent()
+
+		# Watch the cost of the routes to the failed node as they count up
+		highest_cost = [0]
+
+		def watch():
+
+			for the_node in network.nodes.values():
+
+				entry = the_node.router.unstable_route.get(fail_id)
+
+				if entry is not None:
+
+					highest_cost[0] = max(highest_cost[0], entry[1])
+
+			return settled(network)
+
+		fail_time = network.run(convergence_limit, until=watch)
+
+		(ignore, end_count) = network.sent()
+
+		rounds = max(the_node.router.advert_rounds - start_rounds[node_id] for (node_id, the_node) in network.nodes.items())
+
+	finally:
+
+		network.close()
+
+	sent_count = end_count - start_count
+
+	print os.path.basename(topology_file).ljust(18) + ("split horizon" if split_horizon else "no split horizon").ljust(18) + ("hold down" if hold_down else "no hold down").ljust(14) + "Seconds after node " + str(fail_id) + " fails: " + str(fail_time).ljust(16) + "Rounds: " + str(rounds).ljust(6) + "Highest cost: " + str(highest_cost[0]).ljust(6) + "Packets sent: " + str(sent_count)
+
+	return fail_time, rounds, highest_cost[0], sent_count
+
+# Run each case with and without split horizon and hold down
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/infinity_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for (topology_file, fail_id) in cases:
+		for hold_down in (True, False):
+
+			test(topology_file, fail_id, split_horizon = False, hold_down = hold_down)
+			test(topology_file, fail_id, split_horizon = True, hold_down = hold_down)
@@ -2,43 +2,54 @@
 # Handles checksum and Time To Live
 #
 # checksum	TTL	contents
-# 16		4
+# 4 - 16	4
+#
+# The checksum size depends on the algorithm, see checksum.py
 
-import hashlib
 import struct
 import logging
 
 from general_utility import *
-
-# Get the size of every hash
-hash_size = hashlib.md5().digest_size
+import checksum
 
 class Link:
 
 	# The starting TTL for origin messages
 	TTL_origin = 50
 
-	def __init__(self, upper_layer):
+	# checksum_name selects the integrity algorithm, every node in the network must use the same one
+	def __init__(self, upper_layer, checksum_name = None):
 
 		# Should be the route layer
 		self.upper_layer = upper_layer
 
-	# Uses md5 to return the hash value for the sent string
-	def get_hash(self, sent):
+		# The algorithm used to check for corruption, fails for unknown names
+		self.checksum = checksum.get_checksum(checksum_name)
 
-		# Make the md5 hasher
-		hasher = hashlib.md5()
+		# Cached since it is needed for every packet
+		self.hash_size = self.checksum.size
 
-		# Add the string
-		hasher.update(sent)
+	# Returns the checksum for the sent string
+	def get_hash(self, sent):
 
-		# Return the hash
-		return hasher.digest()
+		return self.checksum.digest(sent)
 
 	# Takes the TTL and the contents. Creates a hash for the packet
 	# Decrements TTL and rasies RuntimeError if it goes below 0. Throws packet contents as well
 	def pack(self, contents, TTL = None):
 
+		# Leave room for this header in front of the contents
+		packet_whole = bytearray(self.header_size() + len(contents))
+		packet_whole[self.header_size():] = contents
+
+		# Fill in the header
+		return self.pack_into(packet_whole, TTL)
+
+	# Fills in the header of a packet that was built with header_size() free bytes at the start
+	# The packet must be a bytearray, it is changed in place and returned
+	# Decrements TTL and rasies RuntimeError if it goes below 0. Throws packet contents as well
+	def pack_into(self, packet_whole, TTL = None):
+
 		# TTL not set means this message is originating from this node
 		if TTL is None:
 
@@ -53,16 +64,18 @@ class Link:
 		# Raise if less than 0
 		if TTL < 0:
 
+			contents = str(packet_whole[self.header_size():])
+
 			logging.info("DROPPED: Time to live expired.")
 			logging.debug("Packet contents: " + contents)
 
 			raise RuntimeError("Time To Live expired", contents)
 
 		# Add TTL
-		packet_whole = struct.pack("!L", TTL) + contents
+		struct.pack_into("!L", packet_whole, self.hash_size, TTL)
 
-		# Make the checksum and add to the whole
-		packet_whole = self.get_hash(packet_whole) + packet_whole
+		# Make the checksum over everything after it, without copying the packet
+		packet_whole[:self.hash_size] = self.get_hash(buffer(packet_whole, self.hash_size))
 
 		# Return the packet
 		return packet_whole
@@ -71,34 +84,38 @@ class Link:
 	# Raises RuntimeError if the checksum shows corrupted data
 	def unpack(self, packet):
 
-		# Separate the hash from the rest of the packet
-		sent_hash = packet[:hash_size]
-		packet_body = packet[hash_size:]
+		# Check the packet and get the TTL
+		TTL = self.verify(packet)
 
-		# Get the hash for the packet_body
-		packet_hash = self.get_hash(packet_body)
+		# Get the body
+		packet_body = packet[self.header_size():]
+
+		return (TTL,), packet_body
+
+	# Checks the checksum and returns the TTL, without copying the packet
+	# Raises RuntimeError if the checksum shows corrupted data
+	def verify(self, packet):
+
+		# Get the hash for everything after the hash
+		packet_hash = self.get_hash(buffer(packet, self.hash_size))
 
 		# Check for corruption
-		if sent_hash != packet_hash:
+		if packet[:self.hash_size] != packet_hash:
 
 			logging.info("DROPPED: Packet corrupted")
 
 			raise RuntimeError("Packet corrupted")
 
-		# Get the TTL and the body
-		TTL = struct.unpack("!L", packet_body[:field_size])
-		packet_body = packet_body[field_size:]
-
-		return TTL, packet_body
+		return struct.unpack_from("!L", packet, self.hash_size)[0]
 
 	# The size of the headers generated by this layer
 	# Expected to be:
 	# checksum	| TTL
-	# 16		| 4
-	# Total: 20
+	# 4 - 16	| 4
+	# Total: 8 - 20, 20 for md5
 	def header_size(self):
 
-		return hash_size + field_size
+		return self.hash_size + field_size
 
 	# The total size including the lower layer headers
 	# Included for completeness
@@ -0,0 +1,89 @@
+# Fast link failure detection, separate from the routing heartbeat
+# Works like BFD: each side makes sure the other hears from it at least every interval, and a link is down once nothing has been heard for interval * multiplier
+#
+# Any packet from a neighbor counts, so a link carrying traffic needs no probes
+# Probes are only sent over links that have been quiet for a whole interval
+# A neighbor is only watched once it has sent a probe itself, older nodes never do and are left to the routing heartbeat
+
+import time
+import logging
+
+# Seconds between probes on a quiet link, and the number of intervals missed before the link is down
+# A link is down after about a second of silence, long enough that a few lost probes or a slow pass of the node loop don't take it down
+default_interval = .25
+default_multiplier = 4
+
+class Liveness:
+
+	# timers is the node's shared timer.Timers
+	# send_probe(link_id) sends a probe over the link
+	# link_failed(link_id) is called once a watched link has been quiet for too long
+	# interval is the longest time a link goes without hearing from this node, in seconds
+	# multiplier is the number of intervals a link can miss before it is down
+	def __init__(self, timers, send_probe, link_failed, interval=default_interval, multiplier=default_multiplier):
+
+		self.timers = timers
+		self.send_probe = send_probe
+		self.link_failed = link_failed
+
+		self.interval = interval
+		self.multiplier = multiplier
+
+		# Last time anything was heard from and sent to each link
+		# link_id : time
+		self.last_heard = {}
+		self.last_sent = {}
+
+		# Links that send probes, and so are watched
+		self.watched = set()
+
+		self.timers.schedule(self.interval, self.check)
+
+	# The time a watched link can be quiet before it is down
+	def detect_time(self):
+
+		return self.interval * self.multiplier
+
+	# Called for every packet received from a link
+	def heard(self, link_id):
+
+		self.last_heard[link_id] = time.time()
+
+	# Called for every packet sent over a link
+	def sent(self, link_id):
+
+		self.last_sent[link_id] = time.time()
+
+	# Called when a link sends a probe, it takes part from now on
+	def probed(self, link_id):
+
+		self.watched.add(link_id)
+
+	# Stops watching a link until it sends a probe again
+	def forget(self, link_id):
+
+		self.watched.discard(link_id)
+
+	# Runs every interval, probes quiet links and fails watched links that have gone silent
+	def check(self):
+
+		self.timers.schedule(self.interval, self.check)
+
+		current_time = time.time()
+
+		for link_id in self.watched:
+
+			# Sent just before the next check, so the neighbor hears from this node within the interval
+			if current_time - self.last_sent.get(link_id, 0) >= self.interval / 2:
+
+				self.send_probe(link_id)
+
+		for link_id in list(self.watched):
+
+			if current_time - self.last_heard.get(link_id, current_time) > self.detect_time():
+
+				logging.warning("Link silent for: " + str(current_time - self.last_heard[link_id]) + " seconds: " + str(link_id))
+
+				self.watched.discard(link_id)
+
+				self.link_failed(link_id)
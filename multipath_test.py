@@ -0,0 +1,91 @@
+# Measures how parallel downloads are spread over equal cost paths
+# Node 1 downloads brain.jpg from node 4 in local_test_1.txt over several connections at once
+# Nodes 2 and 3 are both two hops from 1 to 4, with multipath each connection is sent over one of them
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+
+# The topology used, nodes 2 and 3 are equal cost paths from 1 to 4
+topology_file = "topology/local_test_1.txt"
+
+# The relays between 1 and 4
+relay_ids = (2, 3)
+
+# Downloads the file over parallel_count connections, prints and returns (seconds, {relay_id : packets forwarded})
+def test(source_file, multipath = True, parallel_count = 4, window = 20):
+
+	network = network_sim.Network(topology_file)
+
+	try:
+
+		for the_node in network.nodes.values():
+
+			the_node.router.multipath = multipath
+
+		# Let routing settle
+		network.run(4)
+
+		# Every connection downloads its own copy so the saved files don't collide
+		(base_name, extension) = os.path.splitext(os.path.basename(source_file))
+
+		requests = []
+		for connection_index in range(parallel_count):
+
+			file_name = base_name + "_" + str(connection_index) + extension
+			network.place_content(4, source_file, file_name)
+
+			client_point = network.connect(1, 4, window=window)
+
+			requests.append((client_point, file_name, source_file))
+
+		start_forwarded = dict((relay_id, network.nodes[relay_id].DNP.forwarded_count + network.nodes[relay_id].DNP.repacked_count) for relay_id in relay_ids)
+
+		taken = network.download_all(requests)
+
+		forwarded = dict((relay_id, network.nodes[relay_id].DNP.forwarded_count + network.nodes[relay_id].DNP.repacked_count - start_forwarded[relay_id]) for relay_id in relay_ids)
+
+	finally:
+
+		network.close()
+
+		for (client_point, file_name, source_file) in requests:
+
+			for node_id in (1, 4):
+
+				placed = os.path.join(content_folder, str(node_id), file_name)
+				if os.path.exists(placed):
+
+					os.remove(placed)
+
+	print ("multipath" if multipath else "single path").ljust(14) + "Connections: " + str(parallel_count).ljust(4) + "Seconds: " + str(taken).ljust(16) + "   ".join(["Forwarded by " + str(relay_id) + ": " + str(forwarded[relay_id]).ljust(6) for relay_id in relay_ids])
+
+	return taken, forwarded
+
+# Run the test with and without multipath
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/multipath_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	source_file = os.path.join(content_folder, "brain.jpg")
+
+	test(source_file, multipath = False)
+	test(source_file, multipath = True)
@@ -0,0 +1,335 @@
+# Runs a whole network of nodes inside one process, used by the benchmarks
+# Every node has a real UDP socket on localhost, the main loop of each node is run in turn
+# Hosts in the topology file are replaced with localhost, so any topology can be run on one machine
+
+import os
+import select
+import shutil
+import tempfile
+import time
+
+from general_utility import *
+import node
+import service_point
+
+class Network:
+
+	# Starts the nodes in the topology file
+	# node_ids selects which nodes to run, None runs all of them
+	# base_port moves the ports so several networks can be run one after another, None keeps the ports in the file
+	# Other arguments are sent to every node
+	def __init__(self, topology_file, node_ids=None, base_port=None, **node_args):
+
+		# Write a copy of the topology that runs on this machine
+		self.topology_file = self.localize(topology_file, base_port)
+
+		# Every id in the file, in order
+		if node_ids is None:
+
+			node_ids = self.all_ids
+
+		# node_id : Node
+		self.nodes = {}
+		for node_id in node_ids:
+
+			self.nodes[node_id] = node.Node(node_id, self.topology_file, **node_args)
+
+		# Last time cleanup was run on each node
+		self.last_cleanup = dict((node_id, 0) for node_id in self.nodes.keys())
+
+	# Makes a copy of the topology file with every host set to localhost
+	# Returns the name of the copy
+	def localize(self, topology_file, base_port):
+
+		self.all_ids = []
+
+		local_lines = []
+		with open(topology_file) as config_file:
+
+			for line in config_file:
+
+				line_contents = line.split()
+				if len(line_contents) == 0:
+
+					continue
+
+				node_id = int(line_contents[0])
+				if node_id not in self.all_ids:
+
+					self.all_ids.append(node_id)
+
+				line_contents[1] = "localhost"
+
+				if base_port is not None:
+
+					line_contents[2] = str(base_port + node_id)
+
+				local_lines.append(" ".join(line_contents))
+
+		(handle, local_name) = tempfile.mkstemp(suffix=".txt", prefix="topology_")
+		with os.fdopen(handle, "w") as local_file:
+
+			local_file.write("\n".join(local_lines) + "\n")
+
+		return local_name
+
+	# Runs one pass of the main loop of a node
+	def step(self, node_id):
+
+		the_node = self.nodes[node_id]
+		sock = the_node.main_socket.sock
+
+		# Get everything waiting on the socket
+		while len(select.select([sock], [], [], 0)[0]) > 0:
+
+			for (socket_input, sender) in the_node.main_socket.receive_batch():
+
+				the_node.receive(socket_input, sender)
+
+		the_node.timers.run()
+
+		if len(the_node.send_list) > 0:
+
+			the_node.send_waiting()
+
+		if time.time() - self.last_cleanup[node_id] > the_node.cleanup_timeout:
+
+			self.last_cleanup[node_id] = time.time()
+
+			the_node.cleanup()
+
+	# Runs every node for the sent number of seconds
+	# If until is sent, stops as soon as until() is True
+	# Returns the time taken, or None if until() never became True
+	def run(self, seconds, until=None):
+
+		start = time.time()
+		while time.time() - start < seconds:
+
+			for node_id in self.nodes.keys():
+
+				self.step(node_id)
+
+			if until is not None and until():
+
+				return time.time() - start
+
+			time.sleep(.0005)
+
+		if until is None:
+
+			return time.time() - start
+
+		return None
+
+	# Stops a node as if it had failed
+	def kill(self, node_id):
+
+		the_node = self.nodes[node_id]
+
+		del self.nodes[node_id]
+
+		the_node.main_socket.sock.close()
+
+	# Connects client_id to a new download service on server_id
+	# Returns the client service point, use it to download
+	def connect(self, client_id, server_id, window=5, legacy_header=False, timeout=10):
+
+		server = self.nodes[server_id]
+		server_service = self.free_service_id(server)
+		server.services[server_service] = service_point.ServicePoint(server_id, server_service, server.DNP, server.services, congestion_name=server.congestion_name)
+
+		client = self.nodes[client_id]
+		client_service = self.free_service_id(client)
+		client_point = service_point.ServicePoint(client_id, client_service, client.DNP, client.services, max_connections=1, congestion_name=client.congestion_name)
+		client.services[client_service] = client_point
+
+		client_point.start_connection(server_id, listen_port=server_service, window=window, legacy_header=legacy_header)
+
+		# Wait for both sides to finish the handshake
+		def connected():
+
+			connection = client_point.connections.values()[0]
+			return connection.stage == 4 and len(server.services[server_service].connected_to) > 0
+
+		if self.run(timeout, until=connected) is None:
+
+			raise RuntimeError("Connection not made")
+
+		return client_point
+
+	# Places a file into the content folder of a node
+	def place_content(self, node_id, source_file, file_name=None):
+
+		if file_name is None:
+
+			file_name = os.path.basename(source_file)
+
+		enforce_path(os.path.join(content_folder, str(node_id)))
+		shutil.copyfile(source_file, os.path.join(content_folder, str(node_id), file_name))
+
+	# Downloads a file through a connection made by connect
+	# Returns the time taken, None if the download did not finish before timeout
+	def download(self, client_point, file_name, expected_file, timeout=120):
+
+		return self.download_all([(client_point, file_name, expected_file)], timeout=timeout)
+
+	# Runs several downloads at the same time, requests is a list of (client_point, file_name, expected_file)
+	# Each client needs its own file name
+	# Returns the time taken for all of them, None if they did not all finish before timeout
+	def download_all(self, requests, timeout=120):
+
+		# (saved_name, expected contents)
+		checks = []
+		for (client_point, file_name, expected_file) in requests:
+
+			saved_name = os.path.join(content_folder, str(client_point.node_id), file_name)
+			if os.path.exists(saved_name):
+
+				os.remove(saved_name)
+
+			with open(expected_file, "rb") as expected:
+
+				checks.append((saved_name, expected.read()))
+
+		def done():
+
+			for (saved_name, expected_contents) in checks:
+
+				if not os.path.exists(saved_name) or os.path.getsize(saved_name) != len(expected_contents):
+
+					return False
+
+				with open(saved_name, "rb") as saved:
+
+					if saved.read() != expected_contents:
+
+						return False
+
+			return True
+
+		for (client_point, file_name, expected_file) in requests:
+
+			client_point.file_request(file_name)
+
+		return self.run(timeout, until=done)
+
+	# Bytes and packets sent by every node, or only the nodes in node_ids
+	def sent(self, node_ids=None):
+
+		if node_ids is None:
+
+			node_ids = self.nodes.keys()
+
+		sent_bytes = sum(self.nodes[node_id].main_socket.sent_bytes for node_id in node_ids)
+		sent_count = sum(self.nodes[node_id].main_socket.sent_count for node_id in node_ids)
+
+		return sent_bytes, sent_count
+
+	# Closes every socket and removes the topology copy
+	def close(self):
+
+		for node_id in self.nodes.keys():
+
+			self.kill(node_id)
+
+		os.remove(self.topology_file)
+
+	# True if every running node has a working route to every node it can reach, and no route to any node it can't
+	# A link only counts if the nodes at both ends list each other and are running
+	def routes_converged(self):
+
+		for node_id in self.nodes.keys():
+
+			reachable = self.reachable(node_id)
+
+			table = self.nodes[node_id].router.node_id_to_next_hop
+
+			# No routes to nodes that are gone or cut off
+			for target_id in table.keys():
+
+				if int(target_id) not in reachable and table[target_id][0] != "UNREACHABLE":
+
+					return False
+
+			# Following the next hops gets to every node that can be reached
+			for target_id in reachable:
+
+				current_id = node_id
+				hops = 0
+				while current_id != target_id:
+
+					entry = self.nodes[current_id].router.node_id_to_next_hop.get(target_id)
+
+					if entry is None or hops > len(self.nodes) or not self.linked(current_id, entry[0]):
+
+						return False
+
+					current_id = entry[0]
+					hops += 1
+
+		return True
+
+	# True if both nodes are running and list each other as links
+	def linked(self, first_id, second_id):
+
+		if first_id not in self.nodes or second_id not in self.nodes:
+
+			return False
+
+		return second_id in self.nodes[first_id].link_info and first_id in self.nodes[second_id].link_info
+
+	# True once every running neighbor of node_id has marked its link to node_id as dead
+	def failure_detected(self, node_id):
+
+		for the_node in self.nodes.values():
+
+			if the_node.router.active_links.get(node_id, False):
+
+				return False
+
+		return True
+
+	# Every running node that can be reached from node_id, including itself
+	def reachable(self, node_id):
+
+		found = set([node_id])
+		waiting = [node_id]
+		while len(waiting) > 0:
+
+			current_id = waiting.pop()
+
+			for neighbor_id in self.nodes[current_id].link_info.keys():
+
+				if neighbor_id not in found and self.linked(current_id, neighbor_id):
+
+					found.add(neighbor_id)
+					waiting.append(neighbor_id)
+
+		return found
+
+	# Every RTP connection open on a node
+	def connections(self, node_id):
+
+		the_node = self.nodes[node_id]
+
+		found = []
+		for service_id in the_node.services.keys():
+
+			# Connections are listed under the service point that owns them, routing and messages have none
+			point_connections = getattr(the_node.services[service_id], "connections", {})
+			if service_id in point_connections:
+
+				found.append(point_connections[service_id])
+
+		return found
+
+	# A service id that is not used on the node
+	def free_service_id(self, the_node):
+
+		service_id = 20
+		while service_id in the_node.services:
+
+			service_id += 1
+
+		return service_id
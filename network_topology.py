@@ -0,0 +1,158 @@
+# The network topology, parsed once from a topology file
+#
+# Each line of the file is: node_id host port neighbor_id [neighbor_id ...] mtu
+# A node can be on more than one line, its neighbors are all of the ones on its lines
+# Host and port have to be the same on every line of a node, the mtu of a line is used for the links to the neighbors on it
+
+import os
+
+# Parsed topologies, shared by every node in the process
+# file_name : (modified time, Topology)
+loaded = {}
+
+class Topology:
+
+	# Reads and checks the whole file, raises ValueError if anything in it is wrong
+	def __init__(self, file_name):
+
+		self.file_name = file_name
+
+		# Every node id, in the order they first appear in the file
+		self.node_ids = []
+
+		# node_id : (host, port)
+		self.addresses = {}
+
+		# Neighbors of each node, in the order they appear in the file
+		# node_id : [neighbor_id, ...]
+		self.neighbors = {}
+
+		# The mtu each node uses for the link to each neighbor, and the smallest over all of its lines
+		# (node_id, neighbor_id) : mtu
+		# node_id : mtu
+		self.link_mtus = {}
+		self.mtus = {}
+
+		with open(file_name) as config_file:
+
+			for (line_number, line) in enumerate(config_file, 1):
+
+				line_contents = line.split()
+
+				# Blank lines are allowed
+				if len(line_contents) == 0:
+
+					continue
+
+				if len(line_contents) < 4:
+
+					raise ValueError("Topology line " + str(line_number) + " needs at least an id, host, port and mtu: " + line.strip())
+
+				try:
+
+					node_id = int(line_contents[0])
+					host = line_contents[1]
+					port = int(line_contents[2])
+					neighbor_ids = [int(neighbor_id) for neighbor_id in line_contents[3:-1]]
+					mtu = int(line_contents[-1])
+
+				except ValueError:
+
+					raise ValueError("Topology line " + str(line_number) + " has a bad number: " + line.strip())
+
+				self.add_line(line_number, node_id, host, port, neighbor_ids, mtu)
+
+		# Links have to go to nodes that are in the file
+		for node_id in self.node_ids:
+
+			for neighbor_id in self.neighbors[node_id]:
+
+				if neighbor_id not in self.addresses:
+
+					raise ValueError("Neighbor of node " + str(node_id) + " not in file: " + str(neighbor_id))
+
+	# Adds the contents of one line
+	def add_line(self, line_number, node_id, host, port, neighbor_ids, mtu):
+
+		if node_id not in self.addresses:
+
+			self.node_ids.append(node_id)
+			self.addresses[node_id] = (host, port)
+			self.neighbors[node_id] = []
+			self.mtus[node_id] = mtu
+
+		elif self.addresses[node_id] != (host, port):
+
+			raise ValueError("Topology line " + str(line_number) + " gives node " + str(node_id) + " another address: " + host + " " + str(port))
+
+		self.mtus[node_id] = min(self.mtus[node_id], mtu)
+
+		for neighbor_id in neighbor_ids:
+
+			if neighbor_id == node_id:
+
+				raise ValueError("Topology line " + str(line_number) + " links node " + str(node_id) + " to itself")
+
+			# Listed twice, the first mtu is kept
+			if (node_id, neighbor_id) in self.link_mtus:
+
+				continue
+
+			self.neighbors[node_id].append(neighbor_id)
+			self.link_mtus[(node_id, neighbor_id)] = mtu
+
+	# Returns (host, port, mtu) of a node, the mtu is the smallest of its links
+	def get_node(self, node_id):
+
+		try:
+
+			(host, port) = self.addresses[int(node_id)]
+
+		except KeyError:
+
+			raise ValueError("Node ID not in file: " + str(node_id))
+
+		return host, port, self.mtus[int(node_id)]
+
+	# Returns the ids of the neighbors of a node
+	def get_neighbors(self, node_id):
+
+		self.get_node(node_id)
+
+		return tuple(self.neighbors[int(node_id)])
+
+	# The mtu a node uses for its link to a neighbor
+	# A neighbor that the node does not list gets the node's smallest mtu
+	def get_link_mtu(self, node_id, neighbor_id):
+
+		try:
+
+			return self.link_mtus[(int(node_id), int(neighbor_id))]
+
+		except KeyError:
+
+			return self.get_node(node_id)[2]
+
+# Returns the parsed topology of the file
+# Parsed only the first time, or again if the file has changed since
+def get_topology(file_name):
+
+	modified = os.path.getmtime(file_name)
+
+	try:
+
+		(loaded_modified, topology) = loaded[file_name]
+
+		if loaded_modified == modified:
+
+			return topology
+
+	except KeyError:
+
+		pass
+
+	topology = Topology(file_name)
+
+	loaded[file_name] = (modified, topology)
+
+	return topology
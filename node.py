@@ -14,9 +14,14 @@ import argparse
 from general_utility import *
 import UDP_socket
 import link
+import checksum
+import congestion
+import timer
 import DNP
 import RTP
 import route
+import liveness
+import network_topology
 import message
 import service_point
 
@@ -26,7 +31,7 @@ class Node:
 
 	# Starts the node
 	# Needs the ID of this node and the configuration file for the network
-	def __init__(self, node_id, topology_file, loss_chance = 0, corruption_chance = 0, select_timeout=.01, cleanup_timeout=.5, logger_level="WARNING", logger_file_handle=None):
+	def __init__(self, node_id, topology_file, loss_chance = 0, corruption_chance = 0, select_timeout=.01, cleanup_timeout=.5, logger_level="WARNING", logger_file_handle=None, checksum_name=None, legacy_rtp=False, congestion_name=None, routing_protocol=None, cost_function=None, liveness_interval=liveness.default_interval, liveness_multiplier=liveness.default_multiplier):
 
 		# Set the logger file, if sent
 		if logger_file_handle is not None:
@@ -68,14 +73,27 @@ class Node:
 		self.node_id = node_id
 		self.topology_file = topology_file
 
+		# The routing protocol and link costs, every node in the topology needs to use the same ones
+		self.routing_protocol = routing_protocol
+		self.cost_function = cost_function
+
+		# Link failure detection, see liveness.py, an interval of None leaves it to the heartbeat
+		self.liveness_interval = liveness_interval
+		self.liveness_multiplier = liveness_multiplier
+
 		# Get information about this node from the topology file
-		(ip, port, connection1, connection2, mtu) = get_topology_from_file(self.topology_file, self.node_id)
+		self.topology = network_topology.get_topology(self.topology_file)
+		(ip, port, mtu) = self.topology.get_node(self.node_id)
 
 		# Open a UDP socket with the info
-		self.main_socket = UDP_socket.UDP_socket(ip, port, loss_chance, corruption_chance)
+		self.main_socket = UDP_socket.UDP_socket(ip, port, loss_chance, corruption_chance, receive_size=self.buffer_size)
+
+		# Deadlines for every layer in this node, run on each pass through the main loop
+		self.timers = timer.Timers()
 
 		# Create the DNP packet handler
-		self.DNP = DNP.DNP(self.node_id, self.send_list)
+		# Every node in the topology needs to use the same checksum
+		self.DNP = DNP.DNP(self.node_id, self.send_list, checksum_name=checksum_name, timers=self.timers)
 
 		# Save the socket read and the user input for use with select
 		self.inputs = [sys.stdin, self.main_socket.sock]
@@ -90,7 +108,11 @@ class Node:
 		# ID : (ip,port,mtu)
 		self.link_info = {}
 		self.info_to_id = {}
-		for node_id in (int(connection1), int(connection2)):
+
+		# Packets arrive from the resolved address of the neighbor, not the name in the topology
+		# (ip, port) : ID
+		self.address_to_id = {}
+		for node_id in self.topology.get_neighbors(self.node_id):
 
 			(ip, port) = self.router.get_next_hop_sock(node_id, link_only=True)
 
@@ -100,6 +122,14 @@ class Node:
 			self.link_info[node_id] = (ip, port, mtu)
 			self.info_to_id[(ip, port)] = node_id
 
+			try:
+
+				self.address_to_id[(socket.gethostbyname(ip), port)] = node_id
+
+			except socket.error:
+
+				self.address_to_id[(ip, port)] = node_id
+
 		# Tracks downed links
 		# Contains ids
 		self.link_down = []
@@ -107,6 +137,12 @@ class Node:
 		# Tracks the ids of dynamic connections
 		self.dyn_connections = []
 
+		# Start connections with the old RTP text header
+		self.legacy_rtp = legacy_rtp
+
+		# The congestion controller used by every connection
+		self.congestion_name = congestion_name
+
 	# TODO: use @classmethod to make a constructor that loads from a file
 
 	# Destructor
@@ -168,86 +204,110 @@ class Node:
 				# Socket input
 				else:
 
-					# Get the input string
-					socket_input = input_item.recv(self.buffer_size)
+					# Get every packet waiting, up to a batch, each select only wakes up once for them
+					for (socket_input, sender) in self.main_socket.receive_batch():
 
-					# TEMP echo to make sure it works
-					#print "Socket input:\n" + socket_input
+						# Open the packet and hand it to the service
+						self.receive(socket_input, sender)
 
-					# Use DNP to open the packet
-					result = self.DNP.unpack(socket_input)
+			# Run any timers that are due, they may add messages to send
+			self.timers.run()
 
-					#if not result:
-					#	print "nothing"
-					#elif result[2] != 2 and result[2] != 3:
-					#	print "node ", result
+			# Send all messages waiting
+			if len(self.send_list) > 0:
 
-					# Ignore heartbeats
-					if result and result[2] != 2:
-						logging.info("Got packet: " + str(result[:-1]))
-						logging.debug("Contents: " + str(result[-1]))
+				self.send_waiting()
 
-					# If the return is not None, forward the packet to the specified service
-					if result is not None:
+			# Do cleanup if enough time has passed
+			if time.time() - last_cleanup > self.cleanup_timeout:
 
-						service_id = int(result[0])
+				# Reset cleanup time
+				last_cleanup = time.time()
 
-						# Get the service, fails if the service doesn't exist
-						try:
+				self.cleanup()
 
-							server = self.services[service_id]
+	# Opens a packet from the socket and forwards it to the specified service
+	# sender is the address the packet came from, if known
+	def receive(self, socket_input, sender=None):
 
-						# That service doesn't exist
-						except KeyError:
+		# Any packet from a neighbor shows the link works, even one that turns out to be corrupted
+		if sender is not None:
 
-							logging.info("Service does not exist: " + str(service_id) + " requested by: " + str(result[1]))
+			neighbor_id = self.address_to_id.get(sender)
 
-						# Have the service handle the packet
-						else:
+			if neighbor_id is not None:
 
-							try:
-								server.serve(result)
+				self.router.heard_from(neighbor_id)
 
-							# Blissfully ignore problems
-							except Exception, e:
+		# TEMP echo to make sure it works
+		#print "Socket input:\n" + socket_input
 
-								logging.error("Unexpected error:" + str(sys.exc_info()[0]))
-								#print e
+		# Use DNP to open the packet
+		result = self.DNP.unpack(socket_input)
 
-							# Don't ignore
-							#except:
+		#if not result:
+		#	print "nothing"
+		#elif result[2] != 2 and result[2] != 3:
+		#	print "node ", result
 
-								#raise
+		# Ignore heartbeats
+		if result and result[2] != 2:
+			logging.info("Got packet: " + str(result[:-1]))
+			logging.debug("Contents: " + str(result[-1]))
 
-			# Send all messages waiting
-			if len(self.send_list) > 0:
+		# If the return is not None, forward the packet to the specified service
+		if result is not None:
 
-				self.send_waiting()
+			service_id = int(result[0])
 
-			# Do cleanup if enough time has passed
-			if time.time() - last_cleanup > self.cleanup_timeout:
+			# Get the service, fails if the service doesn't exist
+			try:
 
-				# Reset cleanup time
-				last_cleanup = time.time()
+				server = self.services[service_id]
+
+			# That service doesn't exist
+			except KeyError:
+
+				logging.info("Service does not exist: " + str(service_id) + " requested by: " + str(result[1]))
+
+			# Have the service handle the packet
+			else:
+
+				try:
+					server.serve(result)
+
+				# Blissfully ignore problems
+				except Exception, e:
+
+					logging.error("Unexpected error:" + str(sys.exc_info()[0]))
+					#print e
+
+				# Don't ignore
+				#except:
 
-				# TEMP print to show working
-				#print "Doing cleanup"
-				for service in self.services.values():
+					#raise
 
-					# May not have any cleanup
-					try:
+	# Runs cleanup on every service and DNP
+	def cleanup(self):
 
-						service.cleanup()
+		# TEMP print to show working
+		#print "Doing cleanup"
+		for service in self.services.values():
 
-					# Doesn't have cleanup, just ignore
-					#except AttributeError:
+			# May not have any cleanup
+			try:
 
-						#pass
-					except:
-						raise
+				service.cleanup()
 
-				# Do cleanup on DNP
-				self.DNP.cleanup()
+			# Doesn't have cleanup, just ignore
+			#except AttributeError:
+
+				#pass
+			except:
+				raise
+
+		# Do cleanup on DNP
+		self.DNP.cleanup()
 
 	# Creates the standard services at a node
 	#
@@ -265,7 +325,7 @@ class Node:
 	def create_standard_services(self):
 
 		# Routing
-		self.services[2] = route.Route(self.node_id, self.topology_file, self.DNP)
+		self.services[2] = route.get_protocol(self.routing_protocol)(self.node_id, self.topology_file, self.DNP, cost_function=self.cost_function, liveness_interval=self.liveness_interval, liveness_multiplier=self.liveness_multiplier)
 
 		# Save the common name for the routing
 		self.router = self.services[2]
@@ -316,6 +376,11 @@ class Node:
 
 		self.send_list[:] = list(ifilterfalse(determine, self.send_list))
 
+		# Neighbors hearing from this node don't need liveness probes
+		for item in self.send_list:
+
+			self.router.sent_to(self.info_to_id[item[1]])
+
 		#print "To send: ", len(self.send_list)
 
 		# Send every message
@@ -387,6 +452,9 @@ class Node:
 
 					self.link_down.append(contents)
 
+					# Traffic moves to the backup next hops now, rather than when the link stops answering pings
+					self.router.declare_dead(contents)
+
 		# Bring link back up
 		elif command == "upLink":
 
@@ -454,7 +522,7 @@ class Node:
 
 				service_id = rand_id
 
-				self.services[service_id] = service_point.ServicePoint(self.node_id, service_id, self.DNP, self.services, max_connections=max_connections)
+				self.services[service_id] = service_point.ServicePoint(self.node_id, service_id, self.DNP, self.services, max_connections=max_connections, congestion_name=self.congestion_name)
 
 				self.service_points.append(service_id)
 
@@ -489,9 +557,9 @@ class Node:
 
 					service_id = rand_id
 
-					service_temp = service_point.ServicePoint(self.node_id, service_id, self.DNP, self.services, max_connections=max_connections)
+					service_temp = service_point.ServicePoint(self.node_id, service_id, self.DNP, self.services, max_connections=max_connections, congestion_name=self.congestion_name)
 
-					conn_id = service_temp.start_connection(target_id, listen_port=target_listen, window=window)
+					conn_id = service_temp.start_connection(target_id, listen_port=target_listen, window=window, legacy_header=self.legacy_rtp)
 
 					# Connection fails, error codes are < 0
 					if conn_id < 0:
@@ -623,11 +691,25 @@ if __name__ == "__main__":
 
 	parser.add_argument("-v", "--loggerLevel", dest="log_level", default="WARNING", help="The level the logger operates on. ERROR, WARNING, INFO, DEBUG")
 
+	parser.add_argument("-k", "--checksum", dest="checksum_name", default=checksum.default_algorithm, choices=sorted(checksum.algorithms.keys()), help="The link layer checksum. Every node in the topology must use the same one")
+
+	parser.add_argument("-g", "--congestion", dest="congestion_name", default=congestion.default_controller, choices=sorted(congestion.controllers.keys()), help="The congestion controller used when sending files")
+
+	parser.add_argument("-r", "--routing", dest="routing_protocol", default=route.default_protocol, choices=sorted(route.protocols.keys()), help="The routing protocol. Every node in the topology must use the same one")
+
+	parser.add_argument("-m", "--cost", dest="cost_function", default=route.default_cost_function, choices=route.cost_functions, help="How routes are measured: hop count, ping round trip time, link mtu, or round trip time and mtu together. Every node in the topology must use the same one")
+
+	parser.add_argument("--legacyRTP", dest="legacy_rtp", action="store_true", help="Start connections with the old RTP text header. Connections fall back to it anyway if the other node does not answer")
+
+	parser.add_argument("--livenessInterval", dest="liveness_interval", type=float, default=liveness.default_interval, help="Seconds between liveness probes on a quiet link. 0 leaves link failure detection to the routing heartbeat")
+
+	parser.add_argument("--livenessMultiplier", dest="liveness_multiplier", type=int, default=liveness.default_multiplier, help="Probe intervals a link can miss before it is down")
+
 	# Get the arguments and unpack them
 	args = parser.parse_args()
 
 	# Create the node
-	the_node = Node(args.node_id, args.topology_file, loss_chance = args.loss_chance, corruption_chance = args.corruption_chance, logger_level=args.log_level, logger_file_handle=args.log_file )
+	the_node = Node(args.node_id, args.topology_file, loss_chance = args.loss_chance, corruption_chance = args.corruption_chance, logger_level=args.log_level, logger_file_handle=args.log_file, checksum_name=args.checksum_name, legacy_rtp=args.legacy_rtp, congestion_name=args.congestion_name, routing_protocol=args.routing_protocol, cost_function=args.cost_function, liveness_interval=args.liveness_interval or None, liveness_multiplier=args.liveness_multiplier )
 
 	# Run the node
 	the_node.run()
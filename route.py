@@ -5,14 +5,125 @@
 import logging
 import copy
 import time
+import heapq
+import struct
 
 from general_utility import *
+import liveness
+import network_topology
 #import link
 
+# Incremental updates are binary, after the "6;" type:
+# version (1 byte), kind (1 byte), epoch (8 bytes), sequence (4 bytes)
+# Followed by (target_id, cost) pairs, 4 and 2 bytes
+update_version = 1
+update_header_format = struct.Struct("!BBQL")
+
+# Update kinds
+update_full = 0
+update_delta = 1
+
+# The cost sent for a target that was dropped, larger costs are sent as one less
+withdrawn_cost = 0xffff
+
+# Link costs, the cost of a path is the sum of the costs of its links
+# Every node in the topology should use the same one
+#
+# name		cost of a link
+# fewest_hops	1
+# latency	the round trip time of pings over the link, in rtt_unit steps
+# inverse_mtu	mtu_reference divided by the mtu of the link, so narrow links cost more
+# composite	latency plus inverse_mtu
+cost_functions = ("fewest_hops", "latency", "inverse_mtu", "composite")
+
+# The cost function used when none is specified
+default_cost_function = "fewest_hops"
+
+# Seconds of round trip time per step of cost
+# Whole milliseconds, so jitter does not outweigh the mtu of a link in composite, 10 ms of delay is worth going from 1200 to 600
+rtt_unit = .001
+
+# Divided by the link mtu for inverse_mtu
+mtu_reference = 12000
+
+# A link's round trip time is the smallest of its last rtt_window ping samples, it has none until it has that many
+# A slow pass of the node loop only ever adds to a sample, so the smallest is the link itself
+rtt_window = 6
+
+# A link's cost is only changed when the measured cost is off by more than this fraction, and by more than cost_hysteresis_steps
+# Keeps routes from flapping when a measurement wanders around a step
+cost_hysteresis = .5
+cost_hysteresis_steps = 1
+
+# Round trip times closer than this many seconds to the one a link's cost was set from count as the same
+# Smaller differences are the node loop and the garbler, not the link
+rtt_hysteresis = .005
+
+# Seconds a link's cost is held after it changes before it can change again
+# Noise that gets past the hysteresis moves routes at most this often
+cost_hold_time = 10
+
+# A route that costs infinity or more can't be used, poisoned routes are sent with it
+# A route counting up through a loop is dropped once it gets there
+# Sixteen links of a typical cost for each cost function, like the sixteen hops of RIP
+infinity_links = 16
+infinity_costs = {
+	"fewest_hops" : infinity_links,
+	"latency" : infinity_links * int(.005 / rtt_unit),
+	"inverse_mtu" : infinity_links * (mtu_reference // 500),
+	"composite" : infinity_links * (int(.005 / rtt_unit) + mtu_reference // 500)
+}
+
+# Formats (target_id, cost) pairs the way older advertisements are sent: target_id,cost;target_id,cost;...
+def format_entries(entries):
+
+	return "".join([str(target_id) + "," + str(cost) + ";" for (target_id, cost) in entries])
+
+# Parses text target_id,cost;... back into a list of (target_id, cost)
+def parse_entries(contents):
+
+	entries = []
+	for item in contents.split(";"):
+		if item:
+
+			(target_id, cost) = item.split(",")
+			entries.append((int(target_id), int(cost)))
+
+	return entries
+
+# Packs (target_id, cost) pairs into the binary form, a cost of None is sent as withdrawn_cost
+def pack_entries(entries):
+
+	flat = []
+	for (target_id, cost) in entries:
+
+		flat.append(target_id)
+		flat.append(withdrawn_cost if cost is None else min(cost, withdrawn_cost - 1))
+
+	return struct.pack("!" + "LH" * (len(flat) // 2), *flat)
+
+# Unpacks binary (target_id, cost) pairs, starting at offset
+# Returns a list of (target_id, cost), withdrawn targets have a cost of withdrawn_cost
+def unpack_entries(body, offset=0):
+
+	count = (len(body) - offset) // 6
+
+	flat = struct.unpack_from("!" + "LH" * count, body, offset)
+
+	return zip(flat[0::2], flat[1::2])
+
 class Route:
 
 	# Initializes the dictionaries for routing and the objective for calculating shortest paths
-	def __init__(self, node_id, topology_file, DNP, service_id = 2, cost_function = "fewest_hops", heartbeat_interval=.5, stablize_interval=2.0, replace_interval = .51):
+	# full_refresh_interval is how often the whole table is sent to neighbors that take incremental updates
+	# full_min_interval limits how often one neighbor can be sent the whole table
+	# trigger_delay gathers changes that come close together into one incremental update
+	# multipath False sends everything for a target over one next hop even when others cost the same
+	# cost_function is one of cost_functions, None uses default_cost_function
+	# liveness_interval and liveness_multiplier set up fast failure detection, see liveness.py, an interval of None leaves it to the heartbeat
+	# fast_reroute False stops backup next hops from being used when a link dies
+	# split_horizon False advertises routes back to the neighbors they were learned from
+	def __init__(self, node_id, topology_file, DNP, service_id = 2, cost_function = None, heartbeat_interval=.5, stablize_interval=2.0, replace_interval = .51, full_refresh_interval=10.0, full_min_interval=1.0, trigger_delay=.05, multipath=True, liveness_interval=liveness.default_interval, liveness_multiplier=liveness.default_multiplier, fast_reroute=True, split_horizon=True):
 
 		# Simple packet sender
 		self.DNP = DNP
@@ -29,8 +140,8 @@ class Route:
 		# How long to keep dead links out
 		self.kill_replace = replace_interval
 
-		# Holds the possible cost functions
-		self.costs = {"fewest_hops" : self.fewest_hops}
+		# Holds the possible link cost functions, see cost_functions
+		self.costs = {"fewest_hops" : self.fewest_hops, "latency" : self.latency, "inverse_mtu" : self.inverse_mtu, "composite" : self.composite}
 
 		# Uses node names to get the destination IP, port, and MTU for use with UDP_socket
 		# Should only hold info for nodes directly connected with this node
@@ -38,7 +149,45 @@ class Route:
 		self.node_id_to_UDP = {}
 
 		# Set the cost function
-		self.cost_function = self.costs[cost_function]
+		if cost_function is None:
+
+			cost_function = default_cost_function
+
+		try:
+
+			self.link_cost_function = self.costs[cost_function]
+
+		except KeyError:
+
+			raise ValueError("Cost function not known: " + str(cost_function))
+
+		self.infinity = infinity_costs[cost_function]
+
+		# The cost used for each link, changed only when the measured cost moves past cost_hysteresis
+		# link_id : cost
+		self.link_costs = {}
+
+		# Round trip time of pings over each link, and the samples it comes from, in seconds
+		# link_id : seconds
+		# link_id : [seconds, ...]
+		self.link_rtts = {}
+		self.rtt_samples = {}
+
+		# The last ping sent over each link, answers to older pings are not timed
+		# link_id : (ping_number, time sent)
+		self.last_ping = {}
+		self.ping_number = 0
+
+		# Counts link cost changes that reached the routes
+		self.cost_change_count = 0
+
+		# When each link's cost last changed, see cost_hold_time
+		# link_id : time
+		self.cost_changed = {}
+
+		# The round trip time each link's cost was set from, see rtt_hysteresis
+		# link_id : seconds, None if the link had not been timed
+		self.cost_rtts = {}
 
 		# Uses the routing protocol to find the next hop for a given node ID
 		# Meaning of cost changes based on how best path is being determined
@@ -46,20 +195,23 @@ class Route:
 		# target_id : (next_hop_id, cost)
 		self.node_id_to_next_hop = {int(node_id) : (int(node_id), 0)}
 
-		# Load the file to get the network topology
-		self.ip, self.port, connection1, connection2, self.mtu = get_topology_from_file(topology_file, node_id)
+		# Load the file to get the network topology, parsed once and shared with the node
+		topology = network_topology.get_topology(topology_file)
 
-		# Go through the connections and get their info from the file
-		for connection_id in (connection1, connection2):
+		self.ip, self.port, self.mtu = topology.get_node(node_id)
 
-			# Get info
-			conn_ip, conn_port, ignore1, ignore2, conn_mtu = get_topology_from_file(topology_file, connection_id)
+		# Go through the connections and get their info from the topology
+		for connection_id in topology.get_neighbors(node_id):
+
+			# Get info, the mtu is the one the neighbor gives for the link
+			conn_ip, conn_port, ignore = topology.get_node(connection_id)
+			conn_mtu = topology.get_link_mtu(connection_id, node_id)
 
 			# Add as next hop
-			self.add_connection(connection_id, conn_ip, conn_port, int(conn_mtu))
+			self.add_connection(connection_id, conn_ip, conn_port, conn_mtu)
 
 			# Add to the routing table as single hops
-			self.node_id_to_next_hop[int(connection_id)] = (int(connection_id), self.cost_function(0))
+			self.node_id_to_next_hop[int(connection_id)] = (int(connection_id), self.cost_function(0, int(connection_id)))
 
 		# Used temporarily when updating routing table
 		# Do not use for routing
@@ -67,6 +219,38 @@ class Route:
 		#self.unstable_route = copy.copy(self.node_id_to_next_hop)
 		self.unstable_route = {int(node_id) : (int(node_id), 0)}
 
+		# Every next hop with the lowest cost for each target in the unstable table
+		# The next hop in unstable_route is the lowest id of these
+		# target_id : set(next_hop, ...)
+		self.unstable_hops = {}
+
+		# Targets with more than one equal cost next hop in the stable table
+		# target_id : (next_hop, ...) in order
+		self.equal_cost_hops = {}
+
+		self.multipath = multipath
+
+		# A loop free next hop for each target that takes over as soon as the link to the current next hop dies
+		# Found from the neighbors' advertisements whenever the table stablizes
+		# target_id : (next_hop, cost)
+		self.backup_hops = {}
+
+		# Targets the stable table has switched to their backup, until the next stablize
+		# target_id : next_hop
+		self.backups_in_use = {}
+
+		self.fast_reroute = fast_reroute
+
+		# The targets in the unstable table that go through each next hop, equal cost next hops included
+		# Kept by set_route, add_hop, drop_hop and remove_route, so a neighbor's routes can be found without going through the whole table
+		# next_hop : set(target_id, ...)
+		self.routes_via = {}
+
+		# Targets that have changed in the unstable table since the last incremental update
+		self.changed_targets = set()
+
+		self.index_routes()
+
 		# Holds the basic link info, used for reseting unstable_route
 		#self.link_info = copy.copy(self.unstable_route)
 		#self.link_info = {int(node_id) : (int(node_id), 0)}
@@ -100,12 +284,83 @@ class Route:
 		# Recently killed links
 		self.recently_killed = {}
 
+		# Path MTUs advertised by each neighbor
+		# neighbor_id : {target_id : mtu}
+		self.path_mtu_ads = {}
+
+		# Goes up every time the routing table or a path MTU changes
+		# Lets users of the table know to look up their paths again
+		self.table_version = 0
+
+		self.full_refresh_interval = full_refresh_interval
+		self.full_min_interval = full_min_interval
+		self.trigger_delay = trigger_delay
+
+		# Incremental updates are numbered within an epoch, a new epoch starts whenever the node does
+		# Each neighbor is sent its own updates, numbered separately
+		# neighbor_id : sequence
+		self.advert_epoch = int(time.time() * 1000)
+		self.advert_sequence = {}
+
+		# The costs each neighbor has been told about, as of its advert_sequence
+		# neighbor_id : {target_id : cost}
+		self.advertised = {}
+
+		# Routes are not advertised back to the neighbors they go through
+		# Incremental neighbors are sent them with a cost of infinity, older neighbors are not sent them at all
+		# Only loops between two nodes are stopped, a route going round three or more is left to kill_replace and infinity
+		self.split_horizon = split_horizon
+
+		# Goes up every time a triggered update is sent
+		self.advert_rounds = 0
+
+		# Neighbors that have sent an incremental update, they get those instead of the whole table every heartbeat
+		self.incremental_neighbors = set()
+
+		# The whole table of each incremental neighbor, rebuilt from its updates
+		# neighbor_id : {target_id : cost}
+		self.neighbor_ads = {}
+
+		# The last update seen from each incremental neighbor
+		# neighbor_id : (epoch, sequence)
+		self.neighbor_sequence = {}
+
+		# Last time the whole table was sent to each neighbor, and the pending send if it was too soon
+		self.last_full = {}
+		self.full_timers = {}
+
+		# The path MTU advertisement last sent to incremental neighbors
+		self.last_path_mtu_message = None
+
+		# Sends the pending incremental update, None if nothing has changed
+		self.trigger_timer = None
+
+		# Deadlines are shared with the rest of the node through DNP
+		self.timers = self.DNP.timers
+
+		# Fast failure detection, None if only the heartbeat is used
+		self.liveness = None
+		if liveness_interval is not None:
+
+			self.liveness = liveness.Liveness(self.timers, self.send_probe, self.declare_dead, interval=liveness_interval, multiplier=liveness_multiplier)
+
+		# The pending stablize, None if the table has not changed since the last one
+		self.stablize_timer = None
+
 		self.stablize()
 
+		# Start the heartbeat, runs once routing is set in DNP
+		self.timers.schedule(0, self.heartbeat)
+
 	# The entry point for packets handled by the routing service
 	# Expects a packet as unpacked by DNP
 	#
 	# Advertisements have the form: target_id,cost;target_id,cost;...
+	# Path MTU advertisements have the form: target_id,mtu;target_id,mtu;...
+	# Incremental updates are binary, see update_header_format
+	# A cost of withdrawn_cost in a delta means the target was dropped
+	# Liveness probes are 8; and need no answer
+	# These are separate types so older nodes, which can't read them, ignore them
 	def serve(self, packet):
 
 		# Get the readable contents of the package
@@ -119,26 +374,27 @@ class Route:
 		if pkt_type == "1":
 			logging.debug("Got heartbeat from: " + str(source_id))
 
-			# Send response
-			self.DNP.send("2;", source_id, self.service_id, self.service_id, TTL=1, link_only=True)
+			# Send response, with the ping number so the round trip can be timed
+			self.DNP.send("2;" + pkt_contents, source_id, self.service_id, self.service_id, TTL=1, link_only=True)
 
 		# Ping response
 		elif pkt_type == "2":
 
 			logging.debug("Heartbeat response from: " + str(source_id))
 
+			# Set the neighbor as being alive
+			self.last_alive[source_id] = time.time()
+
+			self.ping_answered(source_id, pkt_contents)
+
 			# Link just came back up
 			if self.active_links[source_id] is False:
 
-				logging.warning("Link alive: " + str(source_id))
+				self.active_links[source_id] = True
 
-				# Add the link back into the unstable routing table
-				self.unstable_route[source_id] = (source_id, 1)
-				self.last_update = time.time()
+				logging.warning("Link alive: " + str(source_id))
 
-			# Set the neighbor as being alive
-			self.last_alive[source_id] = time.time()
-			self.active_links[source_id] = True
+				self.link_alive(source_id)
 
 			# Reset the ping count for this neighbor
 			self.ping_count[source_id] = 0
@@ -146,85 +402,278 @@ class Route:
 		# Update message
 		elif pkt_type == "3":
 
-			# Break the message into the advertisement pairs
-			pairs = pkt_contents.split(";")
+			advertisement = parse_entries(pkt_contents)
 
-			# Break each pair into id and cost and add to the advertisement
-			advertisement = []
-			for item in pairs:
-				if item is not "":
-					advertisement.append(item.split(","))
+			# Kept so routes can be worked out again when a link cost changes
+			self.neighbor_ads[source_id] = dict(advertisement)
 
 			# Update the routing table
 			self.update_routing(source_id, advertisement)
 
-	# Checks to make sure that neighbors are alive
-	# Triggers routing updates
+		# Path MTU advertisement
+		elif pkt_type == "4":
+
+			path_mtus = dict(parse_entries(pkt_contents))
+
+			# Paths through this neighbor may have changed
+			if self.path_mtu_ads.get(source_id) != path_mtus:
+
+				self.path_mtu_ads[source_id] = path_mtus
+
+				self.table_version += 1
+
+		# Incremental update
+		elif pkt_type == "6":
+
+			self.receive_update(source_id, pkt_contents)
+
+		# Request for the whole table, an update was missed
+		elif pkt_type == "7":
+
+			self.send_full(source_id)
+
+		# Liveness probe, the neighbor is watched from now on
+		elif pkt_type == "8":
+
+			if self.liveness is not None:
+
+				self.liveness.probed(source_id)
+
+	# Timers handle the heartbeat, hold downs, and stablizing
+	# For completeness
 	def cleanup(self):
 
-		# Get the current time
-		current_time = time.time()
+		return None
+
+	# Checks to make sure that neighbors are alive, pings them, and sends the advertisement
+	# Runs every heartbeat_interval
+	def heartbeat(self):
+
+		# Schedule the next one first so a failed send doesn't stop the heartbeat
+		self.last_beat = time.time()
+		self.timers.schedule(self.heartbeat_interval, self.heartbeat)
 
 		# Set any links that have been pinged more than 3 times to dead
 		for link_name in self.ping_count.keys():
 			link_name = int(link_name)
 
-			# Link state before check
-			previous_state = self.active_links[link_name]
-
 			if self.ping_count[link_name] > 3:
 
-				self.active_links[link_name] = False
+				self.declare_dead(link_name)
+
+		# Ping all links, numbered so the answer can be timed
+		self.ping_number += 1
+		for link_name in self.link_info.keys():
+
+			self.last_ping[link_name] = (self.ping_number, time.time())
+
+			self.DNP.send("1;" + str(self.ping_number), link_name, self.service_id, self.service_id, TTL=1, link_only=True)
+
+			# Lets the neighbor know this node sends liveness probes, older nodes ignore it
+			if self.liveness is not None:
+
+				self.send_probe(link_name)
+
+			# Track number of pings
+			self.ping_count[link_name] += 1
+
+		# Send advertisement
+		self.send_advertisement_packet()
+
+	# Marks a link as dead, from missed pings or liveness
+	# The stable table stops using the link at once, the rest of the table is worked out again as usual
+	def declare_dead(self, link_name):
+
+		self.ping_count[link_name] = 0
+
+		# Already dead
+		if not self.active_links[link_name]:
+
+			return None
+
+		self.active_links[link_name] = False
+
+		logging.warning("Link dead: " + str(link_name))
+
+		if self.liveness is not None:
+
+			self.liveness.forget(link_name)
+
+		self.invalidate_link(link_name)
+
+		self.link_dead(link_name)
+
+	# Takes a dead link out of the stable table so packets stop being sent into it without waiting for the table to stablize
+	def invalidate_link(self, link_name):
+
+		# Backups through the dead link are no use
+		for target_id in [target_id for (target_id, (backup_id, cost)) in self.backup_hops.iteritems() if backup_id == link_name]:
+
+			del self.backup_hops[target_id]
+
+		for target_id in self.node_id_to_next_hop.keys():
+
+			self.repair_route(target_id, link_name)
+
+		self.table_version += 1
+
+	# Stops the stable table from using next_hop_id to get to target_id
+	# Other equal cost next hops keep being used, if there are none the backup next hop takes over
+	# Without either the target can't be reached until the new table is ready
+	def repair_route(self, target_id, next_hop_id):
+
+		(current_next_hop, cost) = self.node_id_to_next_hop[target_id]
+
+		hops = self.equal_cost_hops.get(target_id, (current_next_hop,))
+
+		if next_hop_id not in hops:
+
+			return None
+
+		remaining = tuple([hop_id for hop_id in hops if hop_id != next_hop_id])
+
+		if len(remaining) == 0:
+
+			backup = self.backup_hops.pop(target_id, None)
+
+			if self.fast_reroute and backup is not None and backup[0] != next_hop_id and self.active_links[backup[0]]:
+
+				logging.debug("Switched to backup: " + str(target_id) + " via " + str(backup[0]))
 
-				self.ping_count[link_name] = 0
+				self.node_id_to_next_hop[target_id] = backup
+				self.backups_in_use[target_id] = backup[0]
 
-				# Link was alive and is now dead
-				if previous_state == True:
+			else:
+
+				del self.node_id_to_next_hop[target_id]
+
+		else:
+
+			self.node_id_to_next_hop[target_id] = (remaining[0], cost)
+
+		if len(remaining) > 1:
+
+			self.equal_cost_hops[target_id] = remaining
+
+		else:
+
+			self.equal_cost_hops.pop(target_id, None)
+
+	# Sends a liveness probe, it needs no answer
+	def send_probe(self, link_name):
+
+		self.DNP.send("8;", link_name, self.service_id, self.service_id, TTL=1, link_only=True)
+
+	# Called by the node for every packet received from a neighbor, any packet shows the link works
+	def heard_from(self, link_name):
+
+		if self.liveness is not None:
+
+			self.liveness.heard(link_name)
+
+	# Called by the node for every packet sent to a neighbor
+	def sent_to(self, link_name):
 
-					logging.warning("Link dead: " + str(link_name))
+		if self.liveness is not None:
 
-					# If a link is dead, update the unstable table to not include dead links
-					
-					for target_id in self.unstable_route.keys():
+			self.liveness.sent(link_name)
 
-						if self.unstable_route[target_id][0] == link_name:
+	# Called when a neighbor answers again after being dead
+	def link_alive(self, link_name):
 
-							del self.unstable_route[target_id]
-							self.last_update = time.time()
+		# Add the link back into the unstable routing table
+		self.set_route(link_name, link_name, self.cost_function(0, link_name))
+		self.mark_update()
 
-		# Ping after certain intervals
-		if current_time - self.last_beat > self.heartbeat_interval:
-		# TEMP override to always run
-		#if True:
+		# Lets the neighbor know this node takes incremental updates, older nodes ignore it
+		self.send_full(link_name)
 
-			# Ping all links
-			for link_name in self.link_info.keys():
+	# Called when a neighbor stops answering
+	def link_dead(self, link_name):
 
-				self.DNP.send("1;", link_name, self.service_id, self.service_id, TTL=1, link_only=True)
+		# Its table is sent again in full when it comes back
+		self.neighbor_ads.pop(link_name, None)
+		self.neighbor_sequence.pop(link_name, None)
 
-				# Track number of pings
-				self.ping_count[link_name] += 1
+		# If a link is dead, update the unstable table to not include dead links
+		# Only the routes through it need to be looked at, equal cost next hops take over where there are any
+		# Routes that are gone are held down, then found again from what the other neighbors last advertised
+		for target_id in list(self.routes_via.get(link_name, ())):
 
-			# Send advertisement
-			self.send_advertisement_packet()
+			if self.drop_hop(target_id, link_name):
 
-		# Remove killed links and allow them back in
-		for item in self.recently_killed.keys():
-			if current_time - self.recently_killed[item] > self.kill_replace:
+				self.kill(target_id)
 
-				del self.recently_killed[item]
-				#print "back"
+			self.mark_update()
+
+	# Records that the unstable table changed
+	# The table will be stablized once no updates have happened for stablize_interval
+	def mark_update(self):
+
+		self.last_update = time.time()
+
+		if self.stablize_timer is None:
+
+			self.stablize_timer = self.timers.schedule(self.stablize_interval, self.stablize_check)
+
+		# Tell neighbors about the change soon
+		if self.trigger_timer is None:
+
+			self.trigger_timer = self.timers.schedule(self.trigger_delay, self.send_triggered)
+
+	# Stablizes the table if it has been quiet long enough, otherwise waits for the rest of the interval
+	def stablize_check(self):
+
+		remaining = self.last_update + self.stablize_interval - time.time()
+
+		if remaining > 0:
+
+			self.stablize_timer = self.timers.schedule(remaining, self.stablize_check)
+
+		else:
+
+			self.stablize_timer = None
 
-		# Stablize routing table
-		if current_time - self.last_update > self.stablize_interval:
-			#print "Stablize"
 			self.stablize()
 
-		# Set the last clean time to now
-		self.last_beat = current_time
+	# Holds a killed route out of the table for kill_replace seconds
+	def kill(self, target_id):
+
+		self.recently_killed[target_id] = time.time()
+
+		self.timers.schedule(self.kill_replace, self.allow_killed, target_id)
+
+	# Lets a killed route back in, unless it was killed again in the meantime
+	def allow_killed(self, target_id):
+
+		try:
+
+			killed_time = self.recently_killed[target_id]
+
+		except KeyError:
+
+			return None
+
+		remaining = killed_time + self.kill_replace - time.time()
+
+		if remaining > 0:
+
+			self.timers.schedule(remaining, self.allow_killed, target_id)
+
+		else:
+
+			del self.recently_killed[target_id]
+
+			# Incremental neighbors won't advertise it again until it changes, so check what they last said
+			for neighbor_id in self.neighbor_ads.keys():
+
+				if target_id in self.neighbor_ads[neighbor_id]:
+
+					self.update_routing(neighbor_id, self.neighbor_ads[neighbor_id].items())
 
 	# Returns the info needed for UDP_socket based on the target node
-	def get_next_hop_sock(self, target_id, link_only=False):
+	# flow is (source_id, destination_port, source_port), packets of one flow always take the same next hop
+	def get_next_hop_sock(self, target_id, link_only=False, flow=None):
 
 		# Special case if this is the destination
 		if int(target_id) == int(self.node_id):
@@ -232,13 +681,15 @@ class Route:
 			return (self.ip, self.port, self.mtu)
 
 		# Get the info to send to
-		send_info = self.node_id_to_UDP[self.get_next_hop(target_id, link_only=link_only)][:2]
+		send_info = self.node_id_to_UDP[self.get_next_hop(target_id, link_only=link_only, flow=flow)][:2]
 
 		return send_info
 
 	# Gets the next hop for a packet given the final target node id
 	# returns the id of the neighbor
-	def get_next_hop(self, target_id, link_only=False):
+	# When several next hops cost the same, flows are spread over them by hashing flow with the target
+	# No flow gives the lowest id next hop
+	def get_next_hop(self, target_id, link_only=False, flow=None):
 
 		# Special case if the target is this node
 		if int(target_id) == int(self.node_id):
@@ -267,18 +718,59 @@ class Route:
 
 				raise KeyError(str(target_id) + " is not reachable")
 
+			if flow is not None and self.multipath:
+
+				hops = self.equal_cost_hops.get(int(target_id))
+
+				# This node's id is part of the hash so the next router over doesn't make the same choice
+				if hops is not None:
+
+					return hops[hash((self.node_id, int(target_id)) + flow) % len(hops)]
+
 			return next_hop_id
 
 	# Returns the id of the neighbor to send to and the mtu of the link
 	# link_only True means that only links of this node will be considered, down or not
-	def get_next_hop_info(self, target_id, link_only=False):
+	def get_next_hop_info(self, target_id, link_only=False, flow=None):
 
-		next_hop_id = self.get_next_hop(target_id, link_only=link_only)
+		next_hop_id = self.get_next_hop(target_id, link_only=link_only, flow=flow)
 
 		link_mtu = self.get_link_mtu(next_hop_id)
 
 		return next_hop_id, link_mtu
 
+	# Gets the smallest mtu on the path to the target
+	# Neighbors that don't advertise path MTUs are taken to have no smaller link past them
+	# With equal cost next hops, flow picks the path like get_next_hop, no flow gives the smallest over all of them
+	# Fails if the target cannot be reached
+	def get_path_mtu(self, target_id, flow=None):
+
+		next_hop_id = self.get_next_hop(target_id, flow=flow)
+
+		if flow is None and self.multipath and int(target_id) in self.equal_cost_hops:
+
+			return min([self.hop_path_mtu(target_id, hop_id) for hop_id in self.equal_cost_hops[int(target_id)]])
+
+		return self.hop_path_mtu(target_id, next_hop_id)
+
+	# Gets the smallest mtu on the path to the target through the sent next hop
+	def hop_path_mtu(self, target_id, next_hop_id):
+
+		link_mtu = self.get_link_mtu(next_hop_id)
+
+		# Direct link, or this node
+		if int(next_hop_id) == int(target_id):
+
+			return link_mtu
+
+		advertised_mtu = self.path_mtu_ads.get(int(next_hop_id), {}).get(int(target_id))
+
+		if advertised_mtu is None:
+
+			return link_mtu
+
+		return min(link_mtu, advertised_mtu)
+
 	# Gets the mtu for a link
 	def get_link_mtu(self, target_id):
 
@@ -308,162 +800,1000 @@ class Route:
 
 		self.node_id_to_UDP[int(connection_id)] = (connection_ip, int(connection_port), int(connection_mtu))
 
-	# Calculates cost based on number of hops
-	# Basically just adds 1
-	def fewest_hops(self, tail_cost):
+	# Times the answer to a ping and updates the link cost
+	# Older nodes answer without the ping number, the last ping sent is taken to be the one answered
+	def ping_answered(self, link_name, contents):
 
-		return int(tail_cost) + 1
-
-	# Updates the routing table based on the advertisement message
-	# advertisement : ((can_reach_id, cost), ...)
-	def update_routing(self, source_id, advertisement):
+		try:
 
-		# Tracks if any updates were made
-		updates_made = False
+			(ping_number, sent_time) = self.last_ping[link_name]
 
-		# Unpack the advertisement
-		#source_id = advertisement[0]
-		#reach_info = advertisement[1:]
-		reach_info = advertisement
+		except KeyError:
 
-		source_id = int(source_id)
+			return None
 
-		# Ignore phantom updates
-		if not self.active_links[source_id]:
+		# An answer to an older ping, the time would be too long
+		if contents != "" and contents != str(ping_number):
 
 			return None
 
-		# Go through each node in the current table
-		# Any node in the table that uses that link, but is not in the advertisement indicates a dead link
-		#print "dead check"
-		for table_id in self.unstable_route.keys():
+		del self.last_ping[link_name]
 
-			table_id = int(table_id)
-			#print self.unstable_route
-			#print self.unstable_route[table_id], " ", source_id, " ", table_id, " ", reach_info
-			#print int(self.unstable_route[table_id][0]) == source_id, " ", int(table_id) not in [int(r[0]) for r in reach_info]
-			if int(self.unstable_route[table_id][0]) == source_id and int(table_id) not in [int(r[0]) for r in reach_info] and table_id != int(self.node_id):
+		samples = self.rtt_samples.setdefault(link_name, [])
+		samples.append(time.time() - sent_time)
+		del samples[:-rtt_window]
 
-				updates_made = True
-				#print "deaded: ", table_id
-				self.recently_killed[table_id] = time.time()
+		if len(samples) == rtt_window:
 
-				# Remove the entry
-				del self.unstable_route[table_id]
+			self.link_rtts[link_name] = min(samples)
 
-		# Go through each node / cost and check if it is better than what is currently stored in the table
-		for (target_id, cost) in reach_info:
+		self.update_link_cost(link_name)
 
-			target_id = int(target_id)
+	# Measures the cost of a link again, routes are only changed if it moved past cost_hysteresis and cost_hysteresis_steps
+	# the round trip time moved past rtt_hysteresis, and the cost has not changed within cost_hold_time
+	def update_link_cost(self, link_name):
 
-			# Get the cost of using this path
-			ad_cost = self.cost_function(cost)
+		if time.time() - self.cost_changed.get(link_name, 0) < cost_hold_time:
 
+			return None
 
-			# If this id is in the recently killed list, ignore it
-			if target_id in self.recently_killed.keys():
+		current = self.link_cost(link_name)
 
-				pass
+		rtt = self.link_rtts.get(link_name)
+		set_rtt = self.cost_rtts.get(link_name)
 
-			# If this id is not in the list, add it with the updated cost
-			elif target_id not in self.unstable_route.keys():
+		if rtt is None or (set_rtt is not None and abs(rtt - set_rtt) <= rtt_hysteresis):
 
-				updates_made = True
-				#print "new"
+			return None
 
-				self.unstable_route[target_id] = (source_id, ad_cost)
+		measured = self.link_cost_function(link_name)
 
-			# id is in the routing table, update the entry if this new advertisement is better
-			else:
+		# The first time a link is timed replaces whatever it cost untimed
+		if set_rtt is None:
 
-				# Get the current info
-				(current_next_hop, current_cost) = self.unstable_route[target_id]
+			moved = measured != current
 
-				# Use the new cost if it is less than the current cost
-				if ad_cost < current_cost:
+			self.cost_rtts[link_name] = rtt
 
-					updates_made = True
-					#print "better"
+		else:
 
-					self.unstable_route[int(target_id)] = (int(source_id), ad_cost)
+			moved = abs(measured - current) > max(cost_hysteresis * current, cost_hysteresis_steps)
 
-				# In case of ties, use the node with the lower id
-				elif ad_cost == current_cost and source_id < current_next_hop:
+		if moved:
 
-					updates_made = True
-					#print "tie"
+			logging.info("Link cost to: " + str(link_name) + " changed from: " + str(current) + " to: " + str(measured))
 
-					self.unstable_route[int(target_id)] = (int(source_id), ad_cost)
+			self.link_costs[link_name] = measured
+			self.cost_rtts[link_name] = rtt
+			self.cost_changed[link_name] = time.time()
+			self.cost_change_count += 1
 
-		# If any updates were made, set the update time
-		if updates_made:
+			self.link_cost_changed(link_name)
 
-			self.last_update = time.time()
+	# The cost used for a link, measured the first time it is asked for
+	def link_cost(self, link_name):
 
-	# Resets unstable route based on the active links
-	def reset_unstable(self):
+		try:
 
-		# Cost to self is always 0
-		self.unstable_route = {int(self.node_id): (self.node_id, 0)}
+			return self.link_costs[link_name]
 
-	# Makes the updated routing table into the new rounting table
-	# TODO: make this safer? Calling will wipe out the table if done at the wrong time
-	def stablize(self):
+		except KeyError:
 
-		# Set the useable routing table to be the updated routing table
-		self.node_id_to_next_hop = copy.copy(self.unstable_route)
+			cost = self.link_cost_function(link_name)
+			self.link_costs[link_name] = cost
+			self.cost_rtts[link_name] = self.link_rtts.get(link_name)
 
-		logging.debug("Routing table updated: " + self.routing_table_string(" "))
+			return cost
 
-		# Reset the unstable routing table
-		#self.unstable_route = copy.copy(self.link_info)
-		#self.reset_unstable()
+	# The cost of a path through the link, given the cost from the far end of the link
+	def cost_function(self, tail_cost, link_name):
 
-	# Sends an advertisement message based on the current unstable routing table
-	def send_advertisement_packet(self):
+		return int(tail_cost) + self.link_cost(link_name)
 
-		# Get the advertisement
-		advertisement_message = self.make_advertisement_message()
+	# Every link costs the same
+	def fewest_hops(self, link_name):
 
-		# Send the packet to the neighbors
-		for neighbor_id in self.node_id_to_UDP.keys():
+		return 1
 
-			# Send the advertisement
-			self.DNP.send(advertisement_message, neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+	# Round trip time in rtt_unit steps, a link that has not been timed costs 1
+	def latency(self, link_name):
 
-	# Makes an advertisement message
-	def make_advertisement_message(self):
+		rtt = self.link_rtts.get(link_name)
 
-		# Go through the unstable table
-		# The type of the message is first, 2 is an advertisement
-		advertisement_message = "3;"
-		for target_id in self.unstable_route.keys():
+		if rtt is None:
 
-			# Add the id and the cost to the message
-			advertisement_message += str(target_id) + "," + str(self.unstable_route[target_id][1]) + ";"
+			return 1
 
-		return advertisement_message
+		return max(1, int(round(rtt / rtt_unit)))
 
-	# Returns the current routing table as a string
-	# One entry is:
-	# Target--node_id--NextHop--next_hop--Cost--cost
-	# Multiple entries joined by sep
-	def routing_table_string(self, sep="\n"):
+	# Narrow links cost more, so bulk transfers take the wide ones
+	def inverse_mtu(self, link_name):
 
-		# Go through the current routing table and add each entry to the list
-		entry_list = []
-		for target_id in self.node_id_to_next_hop.keys():
+		return max(1, mtu_reference // self.get_link_mtu(link_name))
 
-			# Get the info for this target
-			next_hop, cost = self.node_id_to_next_hop[target_id]
+	# Delay and width together, see rtt_unit
+	def composite(self, link_name):
 
-			# Make the string
-			entry_string = "Target--" + str(target_id) + "--NextHop--" + str(next_hop) + "--Cost--" + str(cost)
+		return self.latency(link_name) + self.inverse_mtu(link_name)
 
-			# Add to list
-			entry_list.append(entry_string)
+	# Works out every route through the link again, and every target the neighbor advertised
+	# A route that got worse may now be better through another neighbor, so they are removed and every stored advertisement is used again
+	def link_cost_changed(self, link_name):
 
-		# Join all entries
+		for target_id in list(self.routes_via.get(link_name, ())):
+
+			if target_id != int(self.node_id):
+
+				self.remove_route(target_id)
+
+		if self.active_links[link_name]:
+
+			self.set_route(link_name, link_name, self.cost_function(0, link_name))
+
+		for (neighbor_id, neighbor_table) in self.neighbor_ads.items():
+
+			self.update_routing(neighbor_id, neighbor_table.items())
+
+		self.mark_update()
+
+	# Adds or replaces a route in the unstable table, next_hop becomes the only next hop
+	def set_route(self, target_id, next_hop, cost):
+
+		for hop_id in self.unstable_hops.get(target_id, ()):
+
+			self.routes_via[hop_id].discard(target_id)
+
+		self.unstable_route[target_id] = (next_hop, cost)
+		self.unstable_hops[target_id] = set([next_hop])
+		self.routes_via.setdefault(next_hop, set()).add(target_id)
+
+		self.changed_targets.add(target_id)
+
+	# Adds another next hop with the same cost as the current route
+	def add_hop(self, target_id, next_hop):
+
+		(current_next_hop, cost) = self.unstable_route[target_id]
+
+		self.unstable_hops[target_id].add(next_hop)
+		self.routes_via.setdefault(next_hop, set()).add(target_id)
+
+		self.changed_targets.add(target_id)
+
+		# The lowest id is used when there is no flow to choose by
+		if next_hop < current_next_hop:
+
+			self.unstable_route[target_id] = (next_hop, cost)
+
+	# Stops using one next hop for a target
+	# Returns True if it was the last one and the route was removed
+	def drop_hop(self, target_id, next_hop):
+
+		hops = self.unstable_hops[target_id]
+
+		if len(hops) == 1:
+
+			self.remove_route(target_id)
+
+			return True
+
+		hops.discard(next_hop)
+		self.routes_via[next_hop].discard(target_id)
+
+		self.changed_targets.add(target_id)
+
+		(current_next_hop, cost) = self.unstable_route[target_id]
+
+		if current_next_hop == next_hop:
+
+			self.unstable_route[target_id] = (min(hops), cost)
+
+		return False
+
+	# Removes a route from the unstable table, keeping routes_via up to date
+	def remove_route(self, target_id):
+
+		del self.unstable_route[target_id]
+
+		for hop_id in self.unstable_hops.pop(target_id):
+
+			self.routes_via[hop_id].discard(target_id)
+
+		self.changed_targets.add(target_id)
+
+	# Rebuilds routes_via after the unstable table is replaced all at once
+	def index_routes(self):
+
+		self.routes_via = {}
+		self.unstable_hops = {}
+		for (target_id, (next_hop, cost)) in self.unstable_route.iteritems():
+
+			self.unstable_hops[target_id] = set([next_hop])
+			self.routes_via.setdefault(next_hop, set()).add(target_id)
+
+		self.changed_targets.update(self.unstable_route.keys())
+
+	# Updates the routing table based on the advertisement message
+	# advertisement : ((can_reach_id, cost), ...)
+	def update_routing(self, source_id, advertisement):
+
+		# Tracks if any updates were made
+		updates_made = False
+
+		source_id = int(source_id)
+
+		# Ignore phantom updates
+		if not self.active_links[source_id]:
+
+			return None
+
+		# Index the advertisement once, target_id : cost of using this path
+		# Targets that cost infinity through the source can't be reached that way, the same as if they were left out
+		reach_info = {}
+		for (target_id, cost) in advertisement:
+
+			cost = self.cost_function(cost, source_id)
+
+			if cost < self.infinity:
+
+				reach_info[int(target_id)] = cost
+
+		# Any node in the table that uses that link, but is not in the advertisement indicates a dead link
+		# Only the routes through the source need to be checked
+		for table_id in list(self.routes_via.get(source_id, ())):
+
+			if table_id == int(self.node_id):
+
+				continue
+
+			# Gone, or no longer as cheap as the other next hops
+			if table_id not in reach_info or (reach_info[table_id] > self.unstable_route[table_id][1] and len(self.unstable_hops[table_id]) > 1):
+
+				updates_made = True
+
+				# Other next hops that cost the same take over, otherwise the route is removed
+				if self.drop_hop(table_id, source_id):
+
+					self.kill(table_id)
+
+				# Withdrawn, the stable table stops using the source for it now rather than at the next stablize
+				if self.fast_reroute and table_id not in reach_info and table_id in self.node_id_to_next_hop:
+
+					self.repair_route(table_id, source_id)
+
+					self.table_version += 1
+
+			# Costs more through the only next hop, the route has to follow it or a loop would never count up to infinity
+			# Another neighbor may have advertised a cheaper or equal way since
+			elif reach_info[table_id] > self.unstable_route[table_id][1]:
+
+				updates_made = True
+
+				self.set_route(table_id, source_id, reach_info[table_id])
+
+				for (neighbor_id, neighbor_table) in self.neighbor_ads.iteritems():
+
+					if neighbor_id != source_id and self.active_links[neighbor_id] and table_id in neighbor_table:
+
+						cost = self.cost_function(neighbor_table[table_id], neighbor_id)
+
+						if cost < self.unstable_route[table_id][1]:
+
+							self.set_route(table_id, neighbor_id, cost)
+
+						# Costs the same, so it is a next hop as well
+						elif cost == self.unstable_route[table_id][1] and neighbor_id not in self.unstable_hops[table_id]:
+
+							self.add_hop(table_id, neighbor_id)
+
+		# A backup that is now withdrawn as well, the target can't be reached that way either
+		for table_id in [table_id for (table_id, hop_id) in self.backups_in_use.iteritems() if hop_id == source_id and table_id not in reach_info]:
+
+			del self.backups_in_use[table_id]
+
+			if table_id in self.node_id_to_next_hop:
+
+				self.repair_route(table_id, source_id)
+
+				self.table_version += 1
+
+		# Go through each node / cost and check if it is better than what is currently stored in the table
+		for (target_id, ad_cost) in reach_info.iteritems():
+
+			# If this id is in the recently killed list, ignore it
+			if target_id in self.recently_killed:
+
+				continue
+
+			current = self.unstable_route.get(target_id)
+
+			# If this id is not in the list, add it with the updated cost
+			# Use the new cost if it is less than the current cost
+			if current is None or ad_cost < current[1]:
+
+				updates_made = True
+
+				self.set_route(target_id, source_id, ad_cost)
+
+			# In case of ties, keep both
+			elif ad_cost == current[1] and source_id not in self.unstable_hops[target_id]:
+
+				updates_made = True
+
+				self.add_hop(target_id, source_id)
+
+		# If any updates were made, set the update time
+		if updates_made:
+
+			self.mark_update()
+
+	# Resets unstable route based on the active links
+	def reset_unstable(self):
+
+		# Cost to self is always 0
+		self.unstable_route = {int(self.node_id): (self.node_id, 0)}
+		self.index_routes()
+
+	# Makes the updated routing table into the new rounting table
+	# TODO: make this safer? Calling will wipe out the table if done at the wrong time
+	def stablize(self):
+
+		equal_cost_hops = dict((target_id, tuple(sorted(hops))) for (target_id, hops) in self.unstable_hops.iteritems() if len(hops) > 1)
+
+		# Paths may have changed
+		if self.node_id_to_next_hop != self.unstable_route or self.equal_cost_hops != equal_cost_hops:
+
+			self.table_version += 1
+
+		# Set the useable routing table to be the updated routing table
+		self.node_id_to_next_hop = copy.copy(self.unstable_route)
+		self.equal_cost_hops = equal_cost_hops
+		self.backups_in_use = {}
+
+		self.find_backups()
+
+		logging.debug("Routing table updated: " + self.routing_table_string(" "))
+
+	# Finds a loop free alternate next hop for every target, from what the neighbors last advertised
+	# A neighbor is loop free for a target when its own path there can't come back through this node:
+	# its cost to the target is less than its cost to this node plus this node's cost to the target
+	# The cheapest loop free neighbor that is not already a next hop is kept
+	def find_backups(self):
+
+		node_id = int(self.node_id)
+
+		backups = {}
+		for (neighbor_id, neighbor_table) in self.neighbor_ads.items():
+
+			if not self.active_links[neighbor_id]:
+
+				continue
+
+			# With split horizon the neighbor's route back over the link is not advertised
+			# The link is the way back unless the neighbor advertises a cheaper one
+			to_self = min(neighbor_table.get(node_id, self.infinity), self.link_cost(neighbor_id))
+
+			for (target_id, tail_cost) in neighbor_table.iteritems():
+
+				entry = self.node_id_to_next_hop.get(target_id)
+
+				if entry is None or target_id == node_id or tail_cost >= self.infinity or neighbor_id in self.equal_cost_hops.get(target_id, (entry[0],)):
+
+					continue
+
+				if tail_cost < to_self + entry[1]:
+
+					cost = self.cost_function(tail_cost, neighbor_id)
+
+					if target_id not in backups or cost < backups[target_id][1]:
+
+						backups[target_id] = (neighbor_id, cost)
+
+		self.backup_hops = backups
+
+		# Reset the unstable routing table
+		#self.unstable_route = copy.copy(self.link_info)
+		#self.reset_unstable()
+
+	# Sends advertisements, runs every heartbeat
+	# Older neighbors get the whole unstable routing table every time
+	# Neighbors that take incremental updates only get the whole table every full_refresh_interval, changes are sent as they happen
+	def send_advertisement_packet(self):
+
+		path_mtu_message = self.make_path_mtu_message()
+
+		# Path MTUs only go to incremental neighbors when they change
+		path_mtu_changed = path_mtu_message != self.last_path_mtu_message
+		self.last_path_mtu_message = path_mtu_message
+
+		# Send the packet to the neighbors
+		for neighbor_id in self.node_id_to_UDP.keys():
+
+			if neighbor_id in self.incremental_neighbors:
+
+				if time.time() - self.last_full.get(neighbor_id, 0) >= self.full_refresh_interval:
+
+					self.send_full(neighbor_id)
+
+				elif path_mtu_changed:
+
+					self.DNP.send(path_mtu_message, neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+
+			# Send the advertisement
+			else:
+
+				self.DNP.send(self.make_advertisement_message(neighbor_id), neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+				self.DNP.send(path_mtu_message, neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+
+	# The cost a neighbor is told for a target, None if the target is not advertised
+	# With split horizon a route through the neighbor is poisoned, so the neighbor can't route back through this node
+	def advertised_cost(self, neighbor_id, target_id):
+
+		entry = self.unstable_route.get(target_id)
+
+		if entry is None:
+
+			return None
+
+		if self.split_horizon and neighbor_id in self.unstable_hops[target_id]:
+
+			return self.infinity
+
+		return entry[1]
+
+	# Sends the changes since the last update to the incremental neighbors
+	def send_triggered(self):
+
+		self.trigger_timer = None
+
+		changed_targets = self.changed_targets
+		self.changed_targets = set()
+
+		# Only the targets that changed need to be compared, a cost of None means the target was dropped
+		# Every neighbor sent the whole table is kept numbered, one that is not taken updates yet sees the gap and asks for the whole table again
+		sent = False
+		for (neighbor_id, advertised) in self.advertised.iteritems():
+
+			changes = []
+			for target_id in changed_targets:
+
+				cost = self.advertised_cost(neighbor_id, target_id)
+
+				if advertised.get(target_id) != cost:
+
+					changes.append((target_id, cost))
+
+					if cost is None:
+						del advertised[target_id]
+					else:
+						advertised[target_id] = cost
+
+			if len(changes) == 0:
+
+				continue
+
+			self.advert_sequence[neighbor_id] += 1
+
+			if neighbor_id in self.incremental_neighbors:
+
+				self.DNP.send(self.make_update_message(update_delta, changes, neighbor_id), neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+
+				sent = True
+
+		if sent:
+
+			self.advert_rounds += 1
+
+	# Sends the whole table to a neighbor as an incremental update
+	# Sent at most once every full_min_interval to each neighbor, a request that comes too soon is sent once the interval is up
+	def send_full(self, neighbor_id):
+
+		# Already waiting to be sent, it will have everything in it then
+		if neighbor_id in self.full_timers:
+
+			return None
+
+		remaining = self.last_full.get(neighbor_id, 0) + self.full_min_interval - time.time()
+
+		if remaining > 0:
+
+			self.full_timers[neighbor_id] = self.timers.schedule(remaining, self.send_waiting_full, neighbor_id)
+
+			return None
+
+		self.last_full[neighbor_id] = time.time()
+
+		# Changes waiting for the other neighbors have to be sent first, this table already has them
+		self.timers.cancel(self.trigger_timer)
+		self.send_triggered()
+
+		advertised = {}
+		for target_id in self.unstable_route.keys():
+
+			advertised[target_id] = self.advertised_cost(neighbor_id, target_id)
+
+		self.advertised[neighbor_id] = advertised
+		self.advert_sequence[neighbor_id] = self.advert_sequence.get(neighbor_id, 0) + 1
+
+		update_message = self.make_update_message(update_full, advertised.items(), neighbor_id)
+
+		self.DNP.send(update_message, neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+		self.DNP.send(self.make_path_mtu_message(), neighbor_id, self.service_id, self.service_id, TTL=1, link_only=True)
+
+	# Sends a whole table that was asked for too soon, once its interval is up
+	def send_waiting_full(self, neighbor_id):
+
+		del self.full_timers[neighbor_id]
+
+		self.send_full(neighbor_id)
+
+	# Makes an incremental update message for a neighbor
+	# changes is a list of (target_id, cost), a cost of None means the target was dropped
+	def make_update_message(self, kind, changes, neighbor_id):
+
+		# The type of the message is first, 6 is an incremental update
+		header = update_header_format.pack(update_version, kind, self.advert_epoch, self.advert_sequence[neighbor_id])
+
+		return "6;" + header + pack_entries(changes)
+
+	# Handles an incremental update from a neighbor
+	# The neighbor's whole table is rebuilt and used like a normal advertisement
+	def receive_update(self, source_id, contents):
+
+		(version, kind, epoch, sequence) = update_header_format.unpack_from(contents)
+
+		# Can't be read, the neighbor is left on whatever it was sending before
+		if version != update_version:
+
+			logging.warning("Unknown update version: " + str(version) + " from: " + str(source_id))
+
+			return None
+
+		entries = unpack_entries(contents, update_header_format.size)
+
+		self.incremental_neighbors.add(source_id)
+
+		# Decodes straight into the neighbor's table
+		if kind == update_full:
+
+			neighbor_table = dict(entries)
+
+		# A delta only makes sense on top of the one before it, ask for the whole table if one was missed
+		elif self.neighbor_sequence.get(source_id) != (epoch, sequence - 1):
+
+			self.DNP.send("7;", source_id, self.service_id, self.service_id, TTL=1, link_only=True)
+
+			return None
+
+		else:
+
+			neighbor_table = self.neighbor_ads[source_id]
+
+			for (target_id, cost) in entries:
+
+				if cost == withdrawn_cost:
+					neighbor_table.pop(target_id, None)
+				else:
+					neighbor_table[target_id] = cost
+
+		self.neighbor_ads[source_id] = neighbor_table
+		self.neighbor_sequence[source_id] = (epoch, sequence)
+
+		self.update_routing(source_id, neighbor_table.items())
+
+	# Makes an advertisement message for a neighbor
+	# Older nodes would use a poisoned cost like any other, so with split horizon routes through the neighbor are left out instead
+	def make_advertisement_message(self, neighbor_id):
+
+		# Go through the unstable table
+		# The type of the message is first, 2 is an advertisement
+		return "3;" + format_entries([(target_id, entry[1]) for (target_id, entry) in self.unstable_route.iteritems() if not (self.split_horizon and neighbor_id in self.unstable_hops[target_id])])
+
+	# Makes a path MTU advertisement message
+	def make_path_mtu_message(self):
+
+		# Go through the routing table
+		# The type of the message is first, 4 is a path MTU advertisement
+		entries = []
+		for target_id in self.node_id_to_next_hop.keys():
+
+			if int(target_id) == int(self.node_id):
+
+				continue
+
+			# Add the id and the mtu to the message
+			try:
+
+				entries.append((target_id, self.get_path_mtu(target_id)))
+
+			except KeyError:
+
+				pass
+
+		return "4;" + format_entries(entries)
+
+	# Returns the current routing table as a string
+	# One entry is:
+	# Target--node_id--NextHop--next_hop--Cost--cost--PathMTU--mtu
+	# Multiple entries joined by sep
+	def routing_table_string(self, sep="\n"):
+
+		# Go through the current routing table and add each entry to the list
+		entry_list = []
+		for target_id in self.node_id_to_next_hop.keys():
+
+			# Get the info for this target
+			next_hop, cost = self.node_id_to_next_hop[target_id]
+
+			# The path MTU can't be found for unreachable targets
+			try:
+				path_mtu = self.get_path_mtu(target_id)
+			except KeyError:
+				path_mtu = "unknown"
+
+			backup = self.backup_hops.get(target_id, ("none", None))[0]
+
+			# Make the string
+			entry_string = "Target--" + str(target_id) + "--NextHop--" + str(next_hop) + "--Cost--" + str(cost) + "--PathMTU--" + str(path_mtu) + "--Backup--" + str(backup)
+
+			# Add to list
+			entry_list.append(entry_string)
+
+		# Join all entries
 		routing_table_string = sep.join(entry_list)
 
 		return routing_table_string
+
+# Link state routing
+# Every node floods the state of its own links, each node keeps all of them and finds shortest paths itself
+# New routes are used as soon as the shortest paths are found, there is no stablize wait or hold down
+#
+# Link state advertisements have the form: 5;origin_id;sequence;neighbor_id,cost,mtu;neighbor_id,cost,mtu;...
+# Every node in the topology must use the same routing protocol
+class LinkStateRoute(Route):
+
+	# lsa_refresh is how often this node floods its links even if nothing changed
+	# lsa_max_age is how long the links of another node are kept without hearing from it
+	# spf_delay gathers changes that come close together into one shortest path run
+	def __init__(self, node_id, topology_file, DNP, service_id = 2, cost_function = None, heartbeat_interval=.5, lsa_refresh=5.0, lsa_max_age=20.0, spf_delay=.01, liveness_interval=liveness.default_interval, liveness_multiplier=liveness.default_multiplier, fast_reroute=True):
+
+		self.lsa_refresh = lsa_refresh
+		self.lsa_max_age = lsa_max_age
+		self.spf_delay = spf_delay
+
+		# The link state database
+		# origin_id : (sequence, {neighbor_id : (cost, mtu)}, time received)
+		self.lsdb = {}
+
+		# Sequence numbers start from the clock, so a restarted node is not ignored until its old advertisements age out
+		self.lsa_sequence = int(time.time() * 1000)
+
+		# Last time this node flooded its links
+		self.last_refresh = 0
+
+		# The pending shortest path run, None if nothing has changed
+		self.spf_timer = None
+
+		# Smallest mtu on the shortest path to each target
+		# target_id : mtu
+		self.path_mtus = {}
+
+		Route.__init__(self, node_id, topology_file, DNP, service_id=service_id, cost_function=cost_function, heartbeat_interval=heartbeat_interval, liveness_interval=liveness_interval, liveness_multiplier=liveness_multiplier, fast_reroute=fast_reroute)
+
+	# Link state advertisements are handled here, pings by Route
+	# Distance vector and path MTU advertisements are ignored
+	def serve(self, packet):
+
+		(dest_port, source_id, source_port, message) = packet
+
+		pkt_type, pkt_contents = message.split(";", 1)
+
+		# Link state advertisement
+		if pkt_type == "5":
+
+			self.receive_lsa(int(source_id), pkt_contents)
+
+		# Heartbeat, response, and liveness probe
+		elif pkt_type in ("1", "2", "8"):
+
+			Route.serve(self, packet)
+
+	# Flood this node's links and send everything known to the neighbor that came back
+	def link_alive(self, link_name):
+
+		self.originate()
+
+		for origin_id in self.lsdb.keys():
+
+			self.DNP.send(self.make_lsa_message(origin_id), link_name, self.service_id, self.service_id, TTL=1, link_only=True)
+
+	# Flood this node's links without the dead one
+	def link_dead(self, link_name):
+
+		self.originate()
+
+	# Flood this node's links with the new cost
+	def link_cost_changed(self, link_name):
+
+		self.originate()
+
+	# Called every heartbeat, refreshes this node's links and drops links nobody has refreshed
+	def send_advertisement_packet(self):
+
+		current_time = time.time()
+
+		if current_time - self.last_refresh >= self.lsa_refresh:
+
+			self.originate()
+
+		for origin_id in self.lsdb.keys():
+
+			if origin_id != self.node_id and current_time - self.lsdb[origin_id][2] > self.lsa_max_age:
+
+				logging.warning("Link state aged out: " + str(origin_id))
+
+				del self.lsdb[origin_id]
+
+				self.schedule_spf()
+
+	# Makes a new advertisement for this node's active links and floods it
+	def originate(self):
+
+		self.lsa_sequence += 1
+		self.last_refresh = time.time()
+
+		links = {}
+		for link_name in self.node_id_to_UDP.keys():
+
+			if self.active_links[link_name]:
+
+				links[link_name] = (self.link_cost(link_name), self.get_link_mtu(link_name))
+
+		self.install_lsa(self.node_id, self.lsa_sequence, links)
+
+		self.flood(self.make_lsa_message(self.node_id))
+
+	# Handles a link state advertisement from a neighbor
+	def receive_lsa(self, source_id, contents):
+
+		fields = contents.split(";")
+
+		origin_id = int(fields[0])
+		sequence = int(fields[1])
+
+		# An advertisement from before this node restarted, jump past it
+		if origin_id == self.node_id:
+
+			if sequence >= self.lsa_sequence:
+
+				self.lsa_sequence = sequence
+
+				self.originate()
+
+			return None
+
+		# Already have this one or a newer one, only note that the origin is still around
+		if origin_id in self.lsdb and sequence <= self.lsdb[origin_id][0]:
+
+			if sequence == self.lsdb[origin_id][0]:
+
+				(ignore, links, ignore) = self.lsdb[origin_id]
+				self.lsdb[origin_id] = (sequence, links, time.time())
+
+			return None
+
+		links = {}
+		for item in fields[2:]:
+			if item != "":
+				(neighbor_id, cost, mtu) = item.split(",")
+				links[int(neighbor_id)] = (int(cost), int(mtu))
+
+		self.install_lsa(origin_id, sequence, links)
+
+		# Pass it on to everyone but the neighbor it came from
+		self.flood(self.make_lsa_message(origin_id), except_id=source_id)
+
+	# Adds an advertisement to the database, shortest paths are only found again if the links changed
+	def install_lsa(self, origin_id, sequence, links):
+
+		if origin_id not in self.lsdb or self.lsdb[origin_id][1] != links:
+
+			self.schedule_spf()
+
+		self.lsdb[origin_id] = (sequence, links, time.time())
+
+	# Sends an advertisement to every active neighbor, except except_id
+	def flood(self, lsa_message, except_id=None):
+
+		for link_name in self.node_id_to_UDP.keys():
+
+			if self.active_links[link_name] and link_name != except_id:
+
+				self.DNP.send(lsa_message, link_name, self.service_id, self.service_id, TTL=1, link_only=True)
+
+	# Makes the advertisement message for an origin in the database
+	def make_lsa_message(self, origin_id):
+
+		(sequence, links, ignore) = self.lsdb[origin_id]
+
+		return "5;" + str(origin_id) + ";" + str(sequence) + ";" + "".join([str(neighbor_id) + "," + str(cost) + "," + str(mtu) + ";" for (neighbor_id, (cost, mtu)) in links.items()])
+
+	# Runs the shortest path search soon, once
+	def schedule_spf(self):
+
+		if self.spf_timer is None:
+
+			self.spf_timer = self.timers.schedule(self.spf_delay, self.run_spf)
+
+	# Finds the shortest path to every node in the database, Dijkstra
+	# A link is only used if both ends advertise it
+	# Replaces the routing table right away
+	def run_spf(self):
+
+		self.spf_timer = None
+
+		# target_id : (next_hop_id, cost)
+		table = {self.node_id : (self.node_id, 0)}
+		path_mtus = {self.node_id : self.get_link_mtu(self.node_id)}
+
+		# Every first hop of the shortest paths to each target
+		# target_id : set(next_hop_id, ...)
+		hops = {}
+
+		# (cost, next_hop_id, target_id, mtu), ties go to the lower next hop like distance vector
+		# This node's own links are known to work both ways, they answer pings
+		frontier = []
+		for (neighbor_id, (cost, mtu)) in self.lsdb.get(self.node_id, (0, {}, 0))[1].items():
+
+			heapq.heappush(frontier, (cost, neighbor_id, neighbor_id, mtu))
+
+		while len(frontier) > 0:
+
+			(cost, next_hop_id, target_id, mtu) = heapq.heappop(frontier)
+
+			if target_id in table:
+
+				# Already found a shorter path, or this first hop was already used
+				if cost > table[target_id][1] or next_hop_id in hops[target_id]:
+
+					continue
+
+				# A path that costs the same through another first hop, everything past it can use that hop too
+				# The path MTU is the smallest over all of them
+				hops[target_id].add(next_hop_id)
+				path_mtus[target_id] = min(path_mtus[target_id], mtu)
+
+			else:
+
+				table[target_id] = (next_hop_id, cost)
+				hops[target_id] = set([next_hop_id])
+				path_mtus[target_id] = mtu
+
+			# Nothing is known past a node that has not advertised
+			if target_id not in self.lsdb:
+
+				continue
+
+			# The far end must advertise the link back
+			for (neighbor_id, (link_cost, link_mtu)) in self.lsdb[target_id][1].items():
+
+				if neighbor_id not in table and neighbor_id in self.lsdb and target_id in self.lsdb[neighbor_id][1]:
+
+					heapq.heappush(frontier, (cost + link_cost, next_hop_id, neighbor_id, min(mtu, link_mtu)))
+
+		equal_cost_hops = dict((target_id, tuple(sorted(first_hops))) for (target_id, first_hops) in hops.iteritems() if len(first_hops) > 1)
+
+		if table != self.node_id_to_next_hop or path_mtus != self.path_mtus or equal_cost_hops != self.equal_cost_hops:
+
+			self.table_version += 1
+
+			self.node_id_to_next_hop = table
+			self.equal_cost_hops = equal_cost_hops
+			self.unstable_route = copy.copy(table)
+			self.index_routes()
+			self.path_mtus = path_mtus
+			self.backups_in_use = {}
+
+			self.find_backups()
+
+			logging.debug("Routing table updated: " + self.routing_table_string(" "))
+
+	# Shortest path costs from any node over the links both ends advertise
+	# Returns {target_id : cost}
+	def distances_from(self, root_id):
+
+		distances = {}
+
+		frontier = [(0, root_id)]
+		while len(frontier) > 0:
+
+			(cost, target_id) = heapq.heappop(frontier)
+
+			if target_id in distances:
+
+				continue
+
+			distances[target_id] = cost
+
+			if target_id not in self.lsdb:
+
+				continue
+
+			for (neighbor_id, (link_cost, link_mtu)) in self.lsdb[target_id][1].items():
+
+				if neighbor_id not in distances and neighbor_id in self.lsdb and target_id in self.lsdb[neighbor_id][1]:
+
+					heapq.heappush(frontier, (cost + link_cost, neighbor_id))
+
+		return distances
+
+	# Same loop free check as distance vector, with each neighbor's costs worked out from the link state database
+	def find_backups(self):
+
+		backups = {}
+		for (neighbor_id, (link_cost, link_mtu)) in self.lsdb.get(self.node_id, (0, {}, 0))[1].items():
+
+			if not self.active_links[neighbor_id]:
+
+				continue
+
+			distances = self.distances_from(neighbor_id)
+
+			to_self = distances.get(self.node_id)
+
+			if to_self is None:
+
+				continue
+
+			for (target_id, (next_hop_id, cost)) in self.node_id_to_next_hop.iteritems():
+
+				if target_id == self.node_id or target_id not in distances or neighbor_id in self.equal_cost_hops.get(target_id, (next_hop_id,)):
+
+					continue
+
+				if distances[target_id] < to_self + cost:
+
+					backup_cost = link_cost + distances[target_id]
+
+					if target_id not in backups or backup_cost < backups[target_id][1]:
+
+						backups[target_id] = (neighbor_id, backup_cost)
+
+		self.backup_hops = backups
+
+	# Uses the mtus found with the shortest paths
+	# The smallest over every equal cost path, so flow makes no difference
+	def get_path_mtu(self, target_id, flow=None):
+
+		try:
+
+			return self.path_mtus[int(target_id)]
+
+		except KeyError:
+
+			return Route.get_path_mtu(self, target_id, flow=flow)
+
+# All of the routing protocols
+# name : class
+protocols = {
+	"distance_vector" : Route,
+	"link_state" : LinkStateRoute
+}
+
+# The protocol used when none is specified, matches older nodes
+default_protocol = "distance_vector"
+
+# Gets the routing class with the sent name
+# Raises ValueError if the protocol is not known
+def get_protocol(name = None):
+
+	if name is None:
+
+		name = default_protocol
+
+	try:
+
+		return protocols[name]
+
+	except KeyError:
+
+		raise ValueError("Routing protocol not known: " + str(name))
@@ -0,0 +1,93 @@
+# Measures how the distance vector update scales with the size of the routing table
+# Node 1 in local_test_1.txt is given advertisements from its neighbors 2 and 3, node 3 reaches most of the network
+# Only node 1 is started, routing timers are never run so the table only changes through the calls timed here
+
+import sys
+import os
+import time
+import logging
+
+from general_utility import enforce_path
+import network_sim
+
+# The topology used, node 1 has neighbors 2 and 3
+topology_file = "topology/local_test_1.txt"
+
+# Table sizes to test
+table_sizes = (100, 1000, 10000)
+
+# Targets reached through node 2, the rest go through node 3
+small_count = 10
+
+# Times the update steps for a table with the sent number of entries, prints and returns {step : seconds}
+def test(entry_count, repeats = 20):
+
+	network = network_sim.Network(topology_file, node_ids = [1])
+
+	try:
+
+		tester = network.nodes[1].services[2]
+
+		tester.active_links[2] = True
+		tester.active_links[3] = True
+
+		# Targets are numbered after the nodes in the topology
+		large = [(target_id, target_id % 50) for target_id in range(10, 10 + entry_count)]
+		small = [(target_id, 1) for target_id in range(10 + entry_count, 10 + entry_count + small_count)]
+
+		times = {}
+
+		# Every entry is new
+		start = time.time()
+		tester.update_routing(3, large)
+		tester.update_routing(2, small)
+		times["first"] = time.time() - start
+
+		# Nothing changes, the usual case once the network has converged
+		start = time.time()
+		for repeat_index in range(repeats):
+
+			tester.update_routing(3, large)
+
+		times["repeat"] = (time.time() - start) / repeats
+
+		# One target is dropped by node 3
+		start = time.time()
+		tester.update_routing(3, large[1:])
+		times["withdraw"] = time.time() - start
+
+		# The link to node 2 dies, only a few routes use it
+		start = time.time()
+		tester.link_dead(2)
+		times["link dead"] = time.time() - start
+
+	finally:
+
+		network.close()
+
+	print ("Entries: " + str(entry_count)).ljust(16) + "   ".join([step + " ms: " + str(round(times[step] * 1000, 3)) for step in ("first", "repeat", "withdraw", "link dead")])
+
+	return times
+
+# Run the test for each table size
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/route_update_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for entry_count in table_sizes:
+		test(entry_count)
@@ -11,7 +11,8 @@ from general_utility import *
 class ServicePoint:
 
 	# Creates a service point for accepting downloads
-	def __init__(self, node_id, service_id, DNP, service_list, max_connections=3):
+	# congestion_name is the congestion controller used by its connections
+	def __init__(self, node_id, service_id, DNP, service_list, max_connections=3, congestion_name=None):
 
 		self.node_id = node_id
 
@@ -37,6 +38,8 @@ class ServicePoint:
 		# The connection used for sending
 		self.send_connection = None
 
+		self.congestion_name = congestion_name
+
 	# Makes new connections and handles existing ones
 	def serve(self, packet):
 
@@ -100,7 +103,8 @@ class ServicePoint:
 		self.last_cleanup = time.time()
 
 	# Start a new connection
-	def start_connection(self, target_node_id, connection_id=None, listen_port=10, window=5):
+	# legacy_header uses the old RTP text header, needed for older nodes
+	def start_connection(self, target_node_id, connection_id=None, listen_port=10, window=5, legacy_header=False):
 
 		# Fails if max connections is already reached
 		if len(self.connections) >= self.max_connections:
@@ -118,7 +122,7 @@ class ServicePoint:
 
 		# Fails if destination is not reachable
 		try:
-			self.connections[connection_id] = RTP.RTP(self.node_id, connection_id, self.DNP, target_node_id, self.connected_to, listen_port=listen_port, window=window)
+			self.connections[connection_id] = RTP.RTP(self.node_id, connection_id, self.DNP, target_node_id, self.connected_to, listen_port=listen_port, window=window, legacy_header=legacy_header, congestion_name=self.congestion_name)
 
 		except KeyError:
 
@@ -151,10 +155,11 @@ class ServicePoint:
 
 			connection_id = rand_id
 
-		# Get the window size
+		# Get the window size and the kind of header the other side uses
 		window = RTP.get_window(packet)
+		legacy_header = RTP.is_legacy(packet)
 
-		self.connections[connection_id] = RTP.RTP(self.node_id, connection_id, self.DNP, target_id, self.connected_to, target_port=target_port, window=window)
+		self.connections[connection_id] = RTP.RTP(self.node_id, connection_id, self.DNP, target_id, self.connected_to, target_port=target_port, window=window, legacy_header=legacy_header, congestion_name=self.congestion_name)
 
 		self.service_list[connection_id] = self
 
@@ -164,6 +169,8 @@ class ServicePoint:
 	# Throws error if connection does not exist
 	def remove_connection(self, connection_id):
 
+		self.connections[connection_id].close()
+
 		del self.connections[connection_id]
 
 		del self.service_list[connection_id]
@@ -180,6 +187,14 @@ class ServicePoint:
 
 			conn_port = conn[0]
 
-			conns += "NodeID: " + str(conn[1]) + " Port Number: " + str(conn[2]) + " Window: " + str(self.connections[conn_port].window) + "\n"
+			connection = self.connections[conn_port]
+
+			# Round trip time is not known until something has been timed
+			if connection.srtt is None:
+				rtt = "unknown"
+			else:
+				rtt = str(round(connection.srtt, 4))
+
+			conns += "NodeID: " + str(conn[1]) + " Port Number: " + str(conn[2]) + " Window: " + str(connection.window) + " CWND: " + str(connection.congestion.limit()) + " RTT: " + rtt + " RTO: " + str(round(connection.rto, 4)) + "\n"
 
 		return conns
@@ -0,0 +1,81 @@
+# Deadlines shared by every layer in a node
+# Layers register a callback for when something should expire instead of sweeping their tables on every tick
+# Running the timers only pays for the entries that are actually due
+#
+# Deadlines are kept in a heap. Cancelled entries stay in the heap and are skipped when they come up
+
+import heapq
+import itertools
+import time
+import sys
+import logging
+
+class Timers:
+
+	def __init__(self):
+
+		# [deadline, tie breaker, callback, args]
+		self.heap = []
+
+		# Keeps entries with the same deadline in the order they were added
+		self.counter = itertools.count()
+
+	# Calls callback(*args) once delay seconds have passed
+	# Returns a handle that can be sent to cancel
+	def schedule(self, delay, callback, *args):
+
+		entry = [time.time() + delay, next(self.counter), callback, args]
+
+		heapq.heappush(self.heap, entry)
+
+		return entry
+
+	# Stops a scheduled callback from running, handles that already ran or are None are ignored
+	def cancel(self, handle):
+
+		if handle is not None:
+
+			handle[2] = None
+
+	# Seconds until the next deadline, None if nothing is scheduled
+	def next_deadline(self):
+
+		# Drop cancelled entries so they don't cause early wake ups
+		while len(self.heap) > 0 and self.heap[0][2] is None:
+
+			heapq.heappop(self.heap)
+
+		if len(self.heap) == 0:
+
+			return None
+
+		return max(0, self.heap[0][0] - time.time())
+
+	# Runs every callback that is due
+	# Callbacks may schedule new timers, those run on a later call
+	def run(self):
+
+		current_time = time.time()
+
+		while len(self.heap) > 0 and self.heap[0][0] <= current_time:
+
+			(deadline, ignore, callback, args) = heapq.heappop(self.heap)
+
+			# Cancelled
+			if callback is None:
+
+				continue
+
+			# A bad callback should not stop the others from running
+			try:
+
+				callback(*args)
+
+			except Exception:
+
+				logging.error("Unexpected error in timer:" + str(sys.exc_info()[0]))
+
+	# Number of entries waiting, including cancelled ones
+	def __len__(self):
+
+		return len(self.heap)
@@ -0,0 +1,88 @@
+# Measures how long large topology files take to load
+# Writes a ring with chords, every node listed on two lines, then parses it and looks up what every node needs at start up
+
+import sys
+import os
+import time
+import tempfile
+import logging
+
+from general_utility import enforce_path
+import network_topology
+
+# Topology sizes to test
+topology_sizes = (100, 1000, 10000)
+
+# Writes a topology with the sent number of nodes, returns the file name
+# Every node links to the nodes next to it on one line, and to the node halfway round on another
+def make_topology(node_count):
+
+	lines = []
+	for node_id in range(1, node_count + 1):
+
+		left_id = (node_id - 2) % node_count + 1
+		right_id = node_id % node_count + 1
+		across_id = (node_id - 1 + node_count // 2) % node_count + 1
+
+		lines.append(" ".join([str(node_id), "localhost", str(20000 + node_id), str(left_id), str(right_id), "1000"]))
+		lines.append(" ".join([str(node_id), "localhost", str(20000 + node_id), str(across_id), "500"]))
+
+	(handle, file_name) = tempfile.mkstemp(suffix=".txt", prefix="topology_")
+	with os.fdopen(handle, "w") as topology_file:
+
+		topology_file.write("\n".join(lines) + "\n")
+
+	return file_name
+
+# Parses the topology and looks up every node the way Node and Route do, prints and returns (parse seconds, lookup seconds)
+def test(node_count):
+
+	file_name = make_topology(node_count)
+
+	try:
+
+		start = time.time()
+		topology = network_topology.Topology(file_name)
+		parse_time = time.time() - start
+
+		start = time.time()
+		for node_id in topology.node_ids:
+
+			topology.get_node(node_id)
+
+			for neighbor_id in topology.get_neighbors(node_id):
+
+				topology.get_node(neighbor_id)
+				topology.get_link_mtu(neighbor_id, node_id)
+
+		lookup_time = time.time() - start
+
+	finally:
+
+		os.remove(file_name)
+
+	print ("Nodes: " + str(node_count)).ljust(14) + "Parse ms: " + str(round(parse_time * 1000, 3)).ljust(12) + "Every node looked up ms: " + str(round(lookup_time * 1000, 3))
+
+	return parse_time, lookup_time
+
+# Run the test for each size
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/topology_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.INFO)
+
+	for node_count in topology_sizes:
+		test(node_count)
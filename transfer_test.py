@@ -0,0 +1,108 @@
+# Measures bytes on the wire and time taken to download files
+# Compares the old format (text header, base64 content) with raw binary content
+# Node 1 downloads from node 4 in local_test_1.txt, through one relay
+# A download takes tens of milliseconds, so each is run several times and the median is shown
+
+import sys
+import os
+import logging
+
+from general_utility import *
+import network_sim
+
+# The topology used, nodes 1 and 4 are two hops apart
+topology_file = "topology/local_test_1.txt"
+
+# Sizes of the generated files to test, in bytes
+generated_sizes = [200000]
+
+# Times each download is run
+runs = 7
+
+# Downloads the file from node 4 to node 1 once, returns (seconds, bytes sent, packets sent)
+def download_once(source_file, legacy, window):
+
+	network = network_sim.Network(topology_file, loss_chance = 0, corruption_chance = 0)
+
+	try:
+
+		# Let routing settle
+		network.run(4)
+
+		file_name = os.path.basename(source_file)
+		network.place_content(4, source_file, file_name)
+
+		client_point = network.connect(1, 4, window=window, legacy_header=legacy)
+
+		(start_bytes, start_count) = network.sent()
+
+		taken = network.download(client_point, file_name, source_file)
+
+		(end_bytes, end_count) = network.sent()
+
+	finally:
+
+		network.close()
+
+	return taken, end_bytes - start_bytes, end_count - start_count
+
+# Downloads the file from node 4 to node 1 runs times, prints and returns (median seconds, median bytes sent, median packets sent)
+# Seconds is None if any download did not finish
+# legacy True uses the text header and base64 content that older nodes expect
+def test(source_file, legacy = False, window = 20, runs = runs):
+
+	results = [download_once(source_file, legacy, window) for run in range(runs)]
+
+	times = sorted(taken for (taken, sent_bytes, sent_count) in results)
+	sent_bytes = sorted(sent_bytes for (taken, sent_bytes, sent_count) in results)[runs // 2]
+	sent_count = sorted(sent_count for (taken, sent_bytes, sent_count) in results)[runs // 2]
+
+	if None in times:
+
+		taken = None
+		fastest = None
+
+	else:
+
+		taken = times[runs // 2]
+		fastest = times[0]
+
+	print os.path.basename(source_file).ljust(18) + ("base64" if legacy else "raw").ljust(8) + "File bytes: " + str(os.path.getsize(source_file)).ljust(10) + "Bytes sent: " + str(sent_bytes).ljust(10) + "Packets sent: " + str(sent_count).ljust(8) + "Median seconds: " + str(taken).ljust(16) + "Fastest: " + str(fastest)
+
+	return taken, sent_bytes, sent_count
+
+# Run the test for brain.jpg and generated files
+if __name__ == "__main__":
+
+	# No arguments means log to default file
+	if len(sys.argv) < 2:
+
+		log_to = "logs/transfer_test_default.log"
+
+	# Get the name of the log file output
+	else:
+
+		log_to = sys.argv[1]
+
+		# Can create one directory level if needed
+		make_dir, ignore = os.path.split(log_to)
+		enforce_path(make_dir)
+
+	test_files = [os.path.join(content_folder, "brain.jpg")]
+
+	# Random content, so nothing can be compressed away
+	for size in generated_sizes:
+
+		generated_name = os.path.join(content_folder, "generated_" + str(size))
+		with open(generated_name, "wb") as generated:
+
+			generated.write(os.urandom(size))
+
+		test_files.append(generated_name)
+
+	# Nodes set up the logger, so this needs to be set first
+	logging.basicConfig(filename=log_to, filemode='w', level=logging.WARNING)
+
+	for test_file in test_files:
+		test(test_file, legacy = True)
+		test(test_file, legacy = False)